@@ -23,6 +23,9 @@ from paramiko.client import (
     SSHClient, MissingHostKeyPolicy, AutoAddPolicy, RejectPolicy,
     WarningPolicy,
 )
+from paramiko.batch import CommandResult
+from paramiko.executor import HostExecutor, HostResult
+from paramiko.pool import SSHConnectionPool
 from paramiko.auth_handler import AuthHandler
 from paramiko.ssh_gss import GSSAuth, GSS_AUTH_AVAILABLE, GSS_EXCEPTIONS
 from paramiko.channel import Channel, ChannelFile, ChannelStderrFile, ChannelStdinFile
@@ -43,6 +46,8 @@ from paramiko.sftp_attr import SFTPAttributes
 from paramiko.sftp_handle import SFTPHandle
 from paramiko.sftp_si import SFTPServerInterface
 from paramiko.sftp_file import SFTPFile
+from paramiko.sftp_transfer import TransferResult
+from paramiko.sftp_cache import SFTPCache
 from paramiko.message import Message
 from paramiko.packet import Packetizer
 from paramiko.file import BufferedFile
@@ -67,6 +72,7 @@ from paramiko.sftp import (
     SFTP_BAD_MESSAGE, SFTP_NO_CONNECTION, SFTP_CONNECTION_LOST,
     SFTP_OP_UNSUPPORTED,
 )
+from paramiko.py3compat import PY2
 from paramiko._version import __version__, __version_info__  # noqa: F401
 
 
@@ -81,6 +87,10 @@ __all__ = [
     'AutoAddPolicy',
     'RejectPolicy',
     'WarningPolicy',
+    'CommandResult',
+    'HostExecutor',
+    'HostResult',
+    'SSHConnectionPool',
     'SecurityOptions',
     'AuthHandler',
     'Channel',
@@ -133,6 +143,8 @@ __all__ = [
     'SFTP_NO_CONNECTION',
     'SFTP_CONNECTION_LOST',
     'SFTP_OP_UNSUPPORTED',
+    'TransferResult',
+    'SFTPCache',
     'ServerInterface',
     'SubsystemHandler',
     'InteractiveQuery',
@@ -143,3 +155,7 @@ __all__ = [
     'SSHConfig',
     'io_sleep',
 ]
+
+if not PY2:
+    from paramiko.sftp_async import AsyncSFTPClient, AsyncSFTPFile
+    __all__ += ['AsyncSFTPClient', 'AsyncSFTPFile']
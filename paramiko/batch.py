@@ -0,0 +1,214 @@
+# This file is part of paramiko.
+#
+# Paramiko is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# Paramiko is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Paramiko; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
+
+"""
+Running many remote commands concurrently over one `.Transport`.
+"""
+
+import socket
+import time
+from collections import deque
+
+from paramiko.ssh_exception import SSHException
+
+
+class CommandResult (object):
+    """
+    The outcome of one command run by `run_commands` (or
+    `.SSHClient.exec_commands`).
+
+    Output is only collected here when no streaming callback was given for
+    that stream; otherwise the corresponding attribute stays empty.
+    """
+
+    def __init__(self, command):
+        #: The command, as given
+        self.command = command
+        #: Everything the command wrote to stdout, as `bytes`
+        self.stdout = bytes()
+        #: Everything the command wrote to stderr, as `bytes`
+        self.stderr = bytes()
+        #: The command's exit status, or -1 if the server didn't send one
+        self.exit_status = -1
+        #: The exception which prevented the command from completing, if any
+        self.exception = None
+        self._stdout = []
+        self._stderr = []
+
+    def __repr__(self):
+        if self.exception is not None:
+            return '<paramiko.CommandResult {!r}: {!r}>'.format(
+                self.command, self.exception)
+        return '<paramiko.CommandResult {!r}: exit status {}>'.format(
+            self.command, self.exit_status)
+
+
+def run_commands(
+    transport,
+    commands,
+    max_sessions=10,
+    timeout=None,
+    environment=None,
+    on_stdout=None,
+    on_stderr=None,
+    on_done=None,
+):
+    """
+    Execute many commands on the server, each in its own session channel,
+    with up to ``max_sessions`` of them running at once.
+
+    Channel opens and ``exec`` requests are pipelined, and all running
+    channels are watched from the calling thread with
+    `.Transport.select_channels`, so no extra threads are used.  Each
+    command's stdin is closed right away.
+
+    :param .Transport transport: an authenticated client transport
+    :param list commands: the commands (`str` or `bytes`) to execute
+    :param int max_sessions: how many commands to run concurrently
+    :param float timeout:
+        seconds each command may take before its channel is closed and its
+        result gets a `socket.timeout` exception (default: no limit)
+    :param dict environment:
+        environment variables to request for every command (see
+        `.Channel.update_environment`)
+    :param callable on_stdout:
+        optional ``func(CommandResult, bytes)`` called with each chunk of
+        stdout as it arrives, instead of collecting it in the result
+    :param callable on_stderr:
+        optional ``func(CommandResult, bytes)`` called with each chunk of
+        stderr as it arrives, instead of collecting it in the result
+    :param callable on_done:
+        optional ``func(CommandResult)`` called as each command completes
+
+    :return: a `list` of `CommandResult`, in the same order as ``commands``
+    """
+    if max_sessions < 1:
+        raise ValueError('max_sessions must be at least 1')
+    results = [CommandResult(command) for command in commands]
+    todo = deque(results)
+    opening = {}  # Future -> CommandResult
+    running = {}  # Channel -> (CommandResult, start time)
+    exiting = set()  # running Channels at EOF, waiting for the exit status
+
+    def wake(future):
+        transport._ready_channels.notify()
+
+    def finish(result, chan=None):
+        if chan is not None:
+            del running[chan]
+            exiting.discard(chan)
+            chan.close()
+        result.stdout = bytes().join(result._stdout)
+        result.stderr = bytes().join(result._stderr)
+        del result._stdout, result._stderr
+        if on_done is not None:
+            on_done(result)
+
+    while todo or opening or running:
+        while todo and len(opening) + len(running) < max_sessions:
+            result = todo.popleft()
+            try:
+                future = transport.open_session_async()
+            except SSHException as e:
+                result.exception = e
+                finish(result)
+                continue
+            opening[future] = result
+            future.add_done_callback(wake)
+
+        for future in [f for f in opening if f.done()]:
+            result = opening.pop(future)
+            try:
+                chan = future.result()
+                if environment:
+                    chan.update_environment(environment)
+                chan._send_exec_request(result.command)
+                chan.shutdown_write()
+            except SSHException as e:
+                result.exception = e
+                finish(result)
+                continue
+            running[chan] = (result, time.time())
+
+        for chan in list(exiting):
+            result, start = running[chan]
+            if chan.exit_status_ready():
+                result.exit_status = chan.recv_exit_status()
+            elif not transport.is_active():
+                result.exception = SSHException('SSH session not active')
+            else:
+                continue
+            finish(result, chan)
+
+        if not running:
+            if opening:
+                transport.select_channels([], 0.1)
+            continue
+
+        wait = None
+        if timeout is not None:
+            now = time.time()
+            oldest = min(start for result, start in running.values())
+            wait = max(0, oldest + timeout - now)
+        if (opening or exiting) and (wait is None or wait > 0.1):
+            # completed futures and exit statuses also wake us, this is
+            # just a safety net
+            wait = 0.1
+        # channels at EOF stay ready, so they're left out
+        reading = [chan for chan in running if chan not in exiting]
+        for chan in transport.select_channels(reading, wait):
+            result, start = running[chan]
+            # check for EOF before draining, so no data can slip in after
+            eof = chan.eof_received or chan.closed
+            _drain(chan, result, on_stdout, on_stderr)
+            if not eof:
+                continue
+            if not chan.event_ready:
+                result.exception = SSHException('Failed to execute command')
+            elif not transport.is_active():
+                result.exception = SSHException('SSH session not active')
+            elif chan.exit_status_ready():
+                result.exit_status = chan.recv_exit_status()
+            else:
+                # finished once the exit status arrives, without blocking
+                # the other commands meanwhile
+                exiting.add(chan)
+                continue
+            finish(result, chan)
+
+        if timeout is not None:
+            now = time.time()
+            for chan, (result, start) in list(running.items()):
+                if now - start >= timeout:
+                    result.exception = socket.timeout()
+                    finish(result, chan)
+
+    return results
+
+
+def _drain(chan, result, on_stdout, on_stderr):
+    while chan.recv_ready():
+        data = chan.recv(32768)
+        if on_stdout is not None:
+            on_stdout(result, data)
+        else:
+            result._stdout.append(data)
+    while chan.recv_stderr_ready():
+        data = chan.recv_stderr(32768)
+        if on_stderr is not None:
+            on_stderr(result, data)
+        else:
+            result._stderr.append(data)
@@ -120,6 +120,7 @@ class Channel (ClosingContextManager):
         self._name = str(chanid)
         self.logger = util.get_logger('paramiko.transport')
         self._pipe = None
+        self._ready_flag = None
         self.event = threading.Event()
         self.event_ready = False
         self.combine_stderr = False
@@ -228,14 +229,7 @@ class Channel (ClosingContextManager):
             `.SSHException` -- if the request was rejected or the channel was
             closed
         """
-        m = Message()
-        m.add_byte(cMSG_CHANNEL_REQUEST)
-        m.add_int(self.remote_chanid)
-        m.add_string('exec')
-        m.add_boolean(True)
-        m.add_string(command)
-        self._event_pending()
-        self.transport._send_user_message(m)
+        self._send_exec_request(command)
         self._wait_for_event()
 
     @open_only
@@ -665,6 +659,12 @@ class Channel (ClosingContextManager):
                 self.in_stderr_buffer.unlink_event()
                 self._pipe.close()
                 self._pipe = None
+            # likewise, stop reporting this channel as ready to its transport
+            # (the cleared flag is kept, so select_channels won't re-add it)
+            if self._ready_flag is not None:
+                self.in_buffer.unlink_event()
+                self.in_stderr_buffer.unlink_event()
+                self._ready_flag.clear()
 
             if not self.active or self.closed:
                 return
@@ -927,7 +927,8 @@ class Channel (ClosingContextManager):
         simulate real OS-level file descriptor (FD) behavior.  Because of this,
         two OS-level FDs are created, which will use up FDs faster than normal.
         (You won't notice this effect unless you have hundreds of channels
-        open at the same time.)
+        open at the same time.)  To wait on a large number of channels, use
+        `.Transport.select_channels` instead, which needs no FDs per channel.
 
         :return: an OS-level file descriptor (`int`)
 
@@ -940,9 +941,7 @@ class Channel (ClosingContextManager):
                 return self._pipe.fileno()
             # create the pipe and feed in any existing data
             self._pipe = pipe.make_pipe()
-            p1, p2 = pipe.make_or_pipe(self._pipe)
-            self.in_buffer.set_event(p1)
-            self.in_stderr_buffer.set_event(p2)
+            self._set_buffer_events()
             return self._pipe.fileno()
         finally:
             self.lock.release()
@@ -1004,6 +1003,40 @@ class Channel (ClosingContextManager):
 
     # ...calls from Transport
 
+    def _send_exec_request(self, command):
+        # send an "exec" request without waiting for the reply: if rejected,
+        # the channel is closed (see _request_failed)
+        m = Message()
+        m.add_byte(cMSG_CHANNEL_REQUEST)
+        m.add_int(self.remote_chanid)
+        m.add_string('exec')
+        m.add_boolean(True)
+        m.add_string(command)
+        self._event_pending()
+        self.transport._send_user_message(m)
+
+    def _set_ready_flag(self, flag):
+        self.lock.acquire()
+        try:
+            if self._ready_flag is None:
+                self._ready_flag = flag
+                self._set_buffer_events()
+        finally:
+            self.lock.release()
+
+    def _set_buffer_events(self):
+        # you are holding the lock.
+        # stdout and stderr buffers are "or"d together, and signal both the
+        # fileno pipe and the transport ReadySet flag, whichever exist.
+        targets = [t for t in (self._pipe, self._ready_flag) if t is not None]
+        if len(targets) == 1:
+            target = targets[0]
+        else:
+            target = pipe.TeePipe(*targets)
+        p1, p2 = pipe.make_or_pipe(target)
+        self.in_buffer.set_event(p1)
+        self.in_stderr_buffer.set_event(p2)
+
     def _set_transport(self, transport):
         self.transport = transport
         self.logger = util.get_logger(self.transport.get_log_channel())
@@ -1083,6 +1116,9 @@ class Channel (ClosingContextManager):
         if key == 'exit-status':
             self.exit_status = m.get_int()
             self.status_event.set()
+            if self._ready_flag is not None:
+                # wake anything waiting for it in select_channels
+                self.transport._ready_channels.notify()
             ok = True
         elif key == 'xon-xoff':
             # ignore
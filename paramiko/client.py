@@ -27,6 +27,7 @@ import socket
 import warnings
 
 from paramiko.agent import Agent
+from paramiko.batch import run_commands
 from paramiko.common import DEBUG
 from paramiko.config import SSH_PORT
 from paramiko.dsskey import DSSKey
@@ -263,7 +264,8 @@ class SSHClient (ClosingContextManager):
         :param str passphrase:
             Used for decrypting private key files
         :param .PKey pkey:
-            an optional private key (object) to use for authentication
+            an optional private key (object), or list of them, to use for
+            authentication
         :param str key_filename:
             the filename, or list of filenames, of optional private key(s)
             and/or certs to try for authentication
@@ -478,6 +480,36 @@ class SSHClient (ClosingContextManager):
         stderr = chan.makefile_stderr('r', bufsize)
         return stdin, stdout, stderr
 
+    def exec_commands(
+        self,
+        commands,
+        max_sessions=10,
+        timeout=None,
+        environment=None,
+        on_stdout=None,
+        on_stderr=None,
+        on_done=None,
+    ):
+        """
+        Execute a batch of commands on the SSH server, running up to
+        ``max_sessions`` of them concurrently (each in its own channel) over
+        this client's single connection.  Output and exit statuses are
+        collected into `.CommandResult` objects, or streamed to callbacks.
+
+        See `.batch.run_commands` for details of the arguments.
+
+        :return: a `list` of `.CommandResult`, in the same order as ``commands``
+        """
+        return run_commands(
+            self._transport, commands,
+            max_sessions=max_sessions,
+            timeout=timeout,
+            environment=environment,
+            on_stdout=on_stdout,
+            on_stderr=on_stderr,
+            on_done=on_done,
+        )
+
     def invoke_shell(self, term='vt100', width=80, height=24, width_pixels=0,
                      height_pixels=0, environment=None):
         """
@@ -560,7 +592,7 @@ class SSHClient (ClosingContextManager):
         """
         Try, in order:
 
-            - The key(s) passed in, if one was passed in.
+            - The key(s) passed in, if any were passed in.
             - Any key we can find through an SSH agent (if allowed).
             - Any "id_rsa", "id_dsa" or "id_ecdsa" key discoverable in ~/.ssh/
               (if allowed).
@@ -611,16 +643,25 @@ class SSHClient (ClosingContextManager):
         if not allowed_types:
             allowed_types = {'password', 'publickey'}
 
-        if pkey is not None and 'publickey' in allowed_types:
-            try:
-                self._log(DEBUG, "Trying SSH key %s" % pkey.get_fingerprint_sha256_b64())
-                allowed_types = set(
-                    self._transport.auth_publickey(username, pkey))
-                two_factor = (allowed_types & two_factor_types)
-                if not two_factor:
-                    return
-            except SSHException as e:
-                saved_exception = e
+        if pkey is None:
+            pkeys = []
+        elif isinstance(pkey, (list, tuple)):
+            pkeys = pkey
+        else:
+            pkeys = [pkey]
+
+        if 'publickey' in allowed_types:
+            for key in pkeys:
+                try:
+                    self._log(DEBUG, "Trying SSH key %s" % key.get_fingerprint_sha256_b64())
+                    allowed_types = set(
+                        self._transport.auth_publickey(username, key))
+                    two_factor = (allowed_types & two_factor_types)
+                    if not two_factor:
+                        return
+                    break
+                except SSHException as e:
+                    saved_exception = e
 
         if not two_factor and 'publickey' in allowed_types:
             for key_filename in key_filenames:
@@ -0,0 +1,229 @@
+# This file is part of paramiko.
+#
+# Paramiko is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# Paramiko is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Paramiko; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
+
+"""
+Running the same operation on many hosts in parallel.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from paramiko.client import SSHClient, RejectPolicy
+from paramiko.config import SSH_PORT
+from paramiko.hostkeys import HostKeys
+from paramiko.pkey import load_private_key_file
+from paramiko.py3compat import string_types
+from paramiko.util import ClosingContextManager
+
+
+class HostResult (object):
+    """
+    The outcome of running an operation on one host with `.HostExecutor`.
+    """
+
+    def __init__(self, host):
+        #: The host, as given to `.HostExecutor.run`
+        self.host = host
+        #: What the operation returned (a `.CommandResult` for commands)
+        self.value = None
+        #: The exception raised while connecting or running, if any
+        self.exception = None
+
+    def __repr__(self):
+        if self.exception is not None:
+            return '<paramiko.HostResult {!r}: {!r}>'.format(
+                self.host, self.exception)
+        return '<paramiko.HostResult {!r}: {!r}>'.format(self.host, self.value)
+
+
+class HostExecutor (ClosingContextManager):
+    """
+    Run a command, or any operation on a connected `.SSHClient` (such as an
+    SFTP transfer), on many hosts at once using a bounded pool of worker
+    threads.
+
+    Everything that doesn't depend on the host is prepared only once and
+    shared by all connections: private keys (including ``IdentityFile``
+    keys from the SSH config, loaded the first time they are needed), the
+    parsed `.SSHConfig`, and the `.HostKeys` used for verification.  A
+    typical use case is::
+
+        executor = HostExecutor(max_workers=20, username='deploy',
+                                key_filename='/etc/deploy/id_ed25519')
+        executor.load_system_host_keys()
+        for result in executor.run(hosts, 'uptime'):
+            print(result.host, result.value.stdout)
+
+        def upload(client):
+            client.open_sftp().put('app.tar.gz', '/srv/app.tar.gz')
+        for result in executor.run(hosts, upload):
+            ...
+
+    Instances of this class may be used as context managers.
+    """
+
+    def __init__(
+        self,
+        max_workers=10,
+        ssh_config=None,
+        pkey=None,
+        key_filename=None,
+        passphrase=None,
+        **connect_kwargs
+    ):
+        """
+        :param int max_workers: how many hosts to work on at once
+        :param .SSHConfig ssh_config:
+            optional parsed config, consulted for each host's ``HostName``,
+            ``Port``, ``User``, ``IdentityFile`` and ``ConnectTimeout``
+        :param .PKey pkey:
+            an optional private key (object), or list of them, to use for
+            authentication
+        :param str key_filename:
+            the filename, or list of filenames, of private keys to load now
+            and use for authentication
+        :param str passphrase: used for decrypting private key files
+        :param connect_kwargs:
+            any other arguments to `.SSHClient.connect`, used for every host
+            (``look_for_keys`` defaults to ``False``, since keys found that
+            way would be loaded again for each host)
+        """
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._ssh_config = ssh_config
+        self._passphrase = passphrase
+        self._connect_kwargs = connect_kwargs
+        self._connect_kwargs.setdefault('look_for_keys', False)
+        self._system_host_keys = HostKeys()
+        self._host_keys = HostKeys()
+        self._policy = RejectPolicy()
+        self._key_lock = threading.Lock()
+        self._key_cache = {}  # (filename -> PKey)
+
+        if pkey is None:
+            self._pkeys = []
+        elif isinstance(pkey, (list, tuple)):
+            self._pkeys = list(pkey)
+        else:
+            self._pkeys = [pkey]
+        if isinstance(key_filename, string_types):
+            key_filename = [key_filename]
+        for filename in key_filename or []:
+            self._pkeys.append(self._load_key(filename))
+
+    def load_system_host_keys(self, filename=None):
+        """
+        Load host keys from a system (read-only) file, once for all hosts.
+        See `.SSHClient.load_system_host_keys`.
+        """
+        client = SSHClient()
+        client._system_host_keys = self._system_host_keys
+        client.load_system_host_keys(filename)
+
+    def get_host_keys(self):
+        """
+        Get the local `.HostKeys` object shared by all connections.  Keys
+        accepted by `.AutoAddPolicy` are added here (but not saved).
+        """
+        return self._host_keys
+
+    def set_missing_host_key_policy(self, policy):
+        """
+        Set the policy to use when a server's hostname is not in either the
+        system host keys or the local host keys.  See
+        `.SSHClient.set_missing_host_key_policy`.  The policy is shared by
+        all worker threads.
+        """
+        if isinstance(policy, type):
+            policy = policy()
+        self._policy = policy
+
+    def run(self, hosts, operation):
+        """
+        Connect to every host and run ``operation`` there, with up to
+        ``max_workers`` hosts in progress at once.
+
+        This returns a generator, which yields each host's `.HostResult` as
+        soon as that host is done (so not in the order of ``hosts``).  All
+        hosts are queued right away; the work continues even if the
+        generator isn't consumed.
+
+        :param list hosts:
+            hostnames (or ``Host`` aliases from the SSH config) to run on
+        :param operation:
+            either a command (`str`), which is run with
+            `.SSHClient.exec_commands` and gives a `.CommandResult`; or a
+            callable which takes the connected `.SSHClient` and whose return
+            value becomes the result's ``value``
+        :return: a generator of `.HostResult`
+        """
+        futures = [self._pool.submit(self._run_one, host, operation)
+                   for host in hosts]
+        return (future.result() for future in as_completed(futures))
+
+    def close(self):
+        """
+        Wait for any queued work to finish, and shut down the worker threads.
+        """
+        self._pool.shutdown(wait=True)
+
+    def _run_one(self, host, operation):
+        result = HostResult(host)
+        client = SSHClient()
+        try:
+            client._system_host_keys = self._system_host_keys
+            client._host_keys = self._host_keys
+            client._policy = self._policy
+            client.connect(**self._connect_args(host))
+            if isinstance(operation, string_types):
+                result.value = client.exec_commands([operation])[0]
+            else:
+                result.value = operation(client)
+        except Exception as e:
+            result.exception = e
+        finally:
+            client.close()
+        return result
+
+    def _connect_args(self, host):
+        kwargs = dict(self._connect_kwargs)
+        kwargs['hostname'] = host
+        pkeys = list(self._pkeys)
+        if self._ssh_config is not None:
+            config = self._ssh_config.lookup(host)
+            kwargs['hostname'] = config.get('hostname', host)
+            if 'port' in config:
+                kwargs.setdefault('port', int(config['port']))
+            if 'user' in config:
+                kwargs.setdefault('username', config['user'])
+            if 'connecttimeout' in config:
+                kwargs.setdefault('timeout', float(config['connecttimeout']))
+            for filename in config.get('identityfile', []):
+                # like OpenSSH, ignore configured keys which don't exist
+                if os.path.isfile(filename):
+                    pkeys.append(self._load_key(filename))
+        kwargs.setdefault('port', SSH_PORT)
+        if pkeys:
+            kwargs['pkey'] = pkeys
+        return kwargs
+
+    def _load_key(self, filename):
+        with self._key_lock:
+            key = self._key_cache.get(filename)
+            if key is None:
+                key = load_private_key_file(filename, self._passphrase)
+                self._key_cache[filename] = key
+            return key
@@ -29,6 +29,8 @@ import sys
 import os
 import socket
 import threading
+import time
+import weakref
 
 
 def make_pipe():
@@ -150,3 +152,109 @@ def make_or_pipe(pipe):
     p1._partner = p2
     p2._partner = p1
     return p1, p2
+
+
+class TeePipe (object):
+    """
+    A pipe-like object which forwards `set` and `clear` to several other
+    pipe-like objects.  Used when a buffer must signal both a `.Channel`'s
+    own fileno pipe and its `.Transport`'s shared `ReadySet`.
+    """
+    def __init__(self, *pipes):
+        self._pipes = pipes
+
+    def set(self):
+        for p in self._pipes:
+            p.set()
+
+    def clear(self):
+        for p in self._pipes:
+            p.clear()
+
+
+class ReadyFlag (object):
+    """
+    Pipe-like object which marks one member of a `ReadySet` as ready (set) or
+    not ready (cleared).  Unlike a real pipe, it uses no OS-level resources.
+    """
+    def __init__(self, ready_set, obj):
+        self._ready_set = ready_set
+        self._obj = obj
+
+    def set(self):
+        self._ready_set._add(self._obj)
+
+    def clear(self):
+        self._ready_set._discard(self._obj)
+
+
+class ReadySet (object):
+    """
+    Tracks which of a group of objects (normally the `Channels <.Channel>` of
+    one `.Transport`) are ready to be read from, so that any number of them
+    can be waited upon without creating a pipe for each one.
+
+    Members are held by weak reference, so a garbage-collected channel drops
+    out of the set on its own.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cv = threading.Condition(self._lock)
+        self._ready = weakref.WeakSet()
+        self._notified = 0
+
+    def make_flag(self, obj):
+        """
+        Return a new `ReadyFlag` which adds ``obj`` to this set when set and
+        removes it when cleared.
+        """
+        return ReadyFlag(self, obj)
+
+    def _add(self, obj):
+        with self._lock:
+            self._ready.add(obj)
+            self._cv.notify_all()
+
+    def _discard(self, obj):
+        with self._lock:
+            self._ready.discard(obj)
+
+    def wait(self, wanted=None, timeout=None):
+        """
+        Wait until at least one member is ready, `notify` is called, or the
+        timeout expires.
+
+        :param wanted:
+            optional `set` of members to consider; others are ignored even if
+            they are ready
+        :param float timeout:
+            maximum seconds to wait (or ``None``, the default, to wait forever)
+        :return: a `list` of the wanted members which are ready (may be empty)
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._lock:
+            notified = self._notified
+            while True:
+                if wanted is None:
+                    ready = list(self._ready)
+                else:
+                    ready = [obj for obj in self._ready if obj in wanted]
+                if ready or timeout == 0 or notified != self._notified:
+                    return ready
+                if timeout is None:
+                    self._cv.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return ready
+                    self._cv.wait(remaining)
+
+    def notify(self):
+        """
+        Make any threads blocked in `wait` return early (possibly with an
+        empty list), e.g. because something else they wait for has happened.
+        """
+        with self._lock:
+            self._notified += 1
+            self._cv.notify_all()
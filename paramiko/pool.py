@@ -0,0 +1,298 @@
+# This file is part of paramiko.
+#
+# Paramiko is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# Paramiko is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Paramiko; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
+
+"""
+Reusing authenticated connections across many short operations.
+"""
+
+import getpass
+import threading
+import time
+from contextlib import contextmanager
+
+from paramiko.client import SSHClient
+from paramiko.config import SSH_PORT
+from paramiko.ssh_exception import SSHException
+from paramiko.util import ClosingContextManager
+
+
+class SSHConnectionPool (ClosingContextManager):
+    """
+    A pool of connected, authenticated `.SSHClient` objects, keyed by
+    ``(hostname, port, username)``, so that short remote operations don't
+    each pay for TCP setup, key exchange, host key verification and
+    authentication.  A typical use case is::
+
+        pool = SSHConnectionPool(max_per_host=4, key_filename=KEY)
+        with pool.session('db1.example.com', username='ops') as chan:
+            chan.exec_command('pg_isready')
+            status = chan.recv_exit_status()
+        with pool.sftp('db1.example.com', username='ops') as sftp:
+            sftp.get('/etc/motd', 'motd')
+
+    Each connection is used by one borrower at a time.  A connection which has
+    been idle for a while is health-checked (with a keepalive global request)
+    before being handed out again, and one idle for longer than
+    ``idle_timeout`` is closed by a background thread.
+
+    Instances of this class may be used as context managers.
+    """
+
+    def __init__(
+        self,
+        max_per_host=4,
+        idle_timeout=300.0,
+        check_after=30.0,
+        check_timeout=10.0,
+        client_factory=None,
+        **connect_kwargs
+    ):
+        """
+        :param int max_per_host:
+            the most connections to keep open to the same host, port and user;
+            further borrowers wait for one to be returned
+        :param float idle_timeout:
+            seconds after which an unused connection is closed (``None`` to
+            keep them forever)
+        :param float check_after:
+            seconds a connection may sit unused before it must pass a health
+            check to be handed out again
+        :param float check_timeout:
+            seconds to wait for the server to answer a health check
+        :param callable client_factory:
+            returns a new, unconnected `.SSHClient` -- e.g. one with host keys
+            loaded and a missing host key policy set.  By default, an
+            `.SSHClient` with the system host keys loaded is used.
+        :param connect_kwargs:
+            other arguments to `.SSHClient.connect` (such as ``password``,
+            ``pkey`` or ``timeout``), used for every new connection
+        """
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.check_after = check_after
+        self.check_timeout = check_timeout
+        self._client_factory = client_factory
+        self._connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._cv = threading.Condition(self._lock)
+        self._idle = {}    # (key -> [(SSHClient, time last used)])
+        self._counts = {}  # (key -> number of open connections)
+        self._closed = False
+        self._stop = threading.Event()
+        self._reaper = None
+        if idle_timeout is not None:
+            self._reaper = threading.Thread(target=self._reap)
+            self._reaper.daemon = True
+            self._reaper.start()
+
+    def acquire(self, hostname, port=SSH_PORT, username=None, timeout=None):
+        """
+        Borrow a connected `.SSHClient` for the given host, port and user,
+        connecting a new one if none is idle and the per-host limit allows.
+        Return it with `release` when done.
+
+        :param str hostname: the server to connect to
+        :param int port: the server port to connect to
+        :param str username:
+            the username to authenticate as (defaults to the current local
+            username)
+        :param float timeout:
+            seconds to wait for a connection to become available, if the
+            per-host limit has been reached (default: wait forever)
+        :return: a connected `.SSHClient`
+
+        :raises:
+            `.SSHException` -- if the pool is closed or the timeout expired,
+            or any exception raised by `.SSHClient.connect`
+        """
+        if username is None:
+            username = getpass.getuser()
+        key = (hostname, port, username)
+        while True:
+            client, last_used = self._take(key, timeout)
+            if client is None:
+                break
+            if self._healthy(client, last_used):
+                return client
+            self._discard(key, client)
+
+        try:
+            client = self._new_client()
+            client.connect(hostname, port=port, username=username,
+                           **self._connect_kwargs)
+        except:
+            self._discard(key, client)
+            raise
+        client._pool_key = key
+        return client
+
+    def release(self, client):
+        """
+        Return a borrowed client to the pool.  It is closed instead if its
+        connection is no longer active, or the pool has been closed.
+
+        :param .SSHClient client: a client returned by `acquire`
+        """
+        key = client._pool_key
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            self._discard(key, client)
+            return
+        with self._lock:
+            if not self._closed:
+                self._idle.setdefault(key, []).append((client, time.time()))
+                self._cv.notify_all()
+                return
+        self._discard(key, client)
+
+    @contextmanager
+    def connection(self, hostname, port=SSH_PORT, username=None, timeout=None):
+        """
+        Context manager which borrows a connected `.SSHClient` (see
+        `acquire`) and returns it to the pool afterwards.
+        """
+        client = self.acquire(hostname, port, username, timeout)
+        try:
+            yield client
+        finally:
+            self.release(client)
+
+    @contextmanager
+    def session(self, hostname, port=SSH_PORT, username=None, timeout=None):
+        """
+        Context manager which opens a new session `.Channel` on a pooled
+        connection.  The channel is closed, and the connection returned to the
+        pool, afterwards.
+        """
+        with self.connection(hostname, port, username, timeout) as client:
+            chan = client.get_transport().open_session()
+            try:
+                yield chan
+            finally:
+                chan.close()
+
+    @contextmanager
+    def sftp(self, hostname, port=SSH_PORT, username=None, timeout=None):
+        """
+        Context manager which opens a new `.SFTPClient` on a pooled
+        connection.  The SFTP session is closed, and the connection returned
+        to the pool, afterwards.
+        """
+        with self.connection(hostname, port, username, timeout) as client:
+            sftp = client.open_sftp()
+            try:
+                yield sftp
+            finally:
+                sftp.close()
+
+    def prune(self):
+        """
+        Close every connection which has been idle longer than
+        ``idle_timeout``.  This is done periodically by a background thread,
+        so you don't normally need to call it.
+        """
+        if self.idle_timeout is None:
+            return
+        expired = []
+        cutoff = time.time() - self.idle_timeout
+        with self._lock:
+            for key, idle in self._idle.items():
+                for entry in [e for e in idle if e[1] < cutoff]:
+                    idle.remove(entry)
+                    expired.append((key, entry[0]))
+        for key, client in expired:
+            self._discard(key, client)
+
+    def close(self):
+        """
+        Close all idle connections, and any borrowed ones as they are
+        returned.  The pool can't be used afterwards.
+        """
+        with self._lock:
+            self._closed = True
+            idle = [(key, client)
+                    for key, entries in self._idle.items()
+                    for client, last_used in entries]
+            self._idle.clear()
+            self._cv.notify_all()
+        self._stop.set()
+        for key, client in idle:
+            self._discard(key, client)
+
+    def _take(self, key, timeout):
+        """
+        Wait for an idle client for ``key`` (returned as ``(client, last
+        used)``), or for permission to connect a new one (returned as
+        ``(None, None)``, with the connection already counted).
+        """
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise SSHException('Connection pool is closed')
+                idle = self._idle.get(key)
+                if idle:
+                    # most recently used first: least likely to have gone stale
+                    return idle.pop()
+                if self._counts.get(key, 0) < self.max_per_host:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                    return None, None
+                if timeout is None:
+                    self._cv.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise SSHException(
+                            'Timeout waiting for a pooled connection')
+                    self._cv.wait(remaining)
+
+    def _healthy(self, client, last_used):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        if time.time() - last_used < self.check_after:
+            return True
+        try:
+            # servers answer unknown requests with a failure, which is fine:
+            # any answer at all proves the connection works
+            transport.global_request(
+                'keepalive@openssh.com', wait=True, timeout=self.check_timeout)
+        except SSHException:
+            return False
+        return transport.is_active()
+
+    def _discard(self, key, client):
+        """close ``client`` and give up its slot in the per-host count"""
+        if client is not None:
+            client.close()
+        with self._lock:
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                del self._counts[key]
+            self._cv.notify_all()
+
+    def _new_client(self):
+        if self._client_factory is not None:
+            return self._client_factory()
+        client = SSHClient()
+        client.load_system_host_keys()
+        return client
+
+    def _reap(self):
+        interval = min(self.idle_timeout, 60.0) / 2
+        while not self._stop.wait(interval):
+            self.prune()
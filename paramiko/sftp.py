@@ -16,6 +16,7 @@
 # along with Paramiko; if not, write to the Free Software Foundation, Inc.,
 # 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
 
+import errno
 import socket
 import struct
 
@@ -56,6 +57,10 @@ SFTP_FLAG_EXCL = 0x20
 
 _VERSION = 3
 
+# the largest sftp packet we'll ask for or send when both sides agree to go
+# beyond the traditional 32kB requests (the same as OpenSSH)
+_MAX_MSG_LENGTH = 256 * 1024
+
 
 # for debugging
 CMD_NAMES = {
@@ -98,6 +103,8 @@ class BaseSFTP (object):
         self.logger = util.get_logger('paramiko.sftp')
         self.sock = None
         self.ultra_debug = False
+        # extension name -> data, as advertised by the other side
+        self._extensions = {}
 
     # ...internals...
 
@@ -106,28 +113,51 @@ class BaseSFTP (object):
         m.add_int(_VERSION)
         self._send_packet(CMD_INIT, m)
         t, data = self._read_packet()
+        return self._parse_version(t, data)
+
+    def _parse_version(self, t, data):
         if t != CMD_VERSION:
             raise SFTPError('Incompatible sftp protocol')
         version = struct.unpack('>I', data[:4])[0]
         #        if version != _VERSION:
         #            raise SFTPError('Incompatible sftp protocol')
+        msg = Message(data[4:])
+        while msg.get_remainder():
+            name = msg.get_text()
+            self._extensions[name] = msg.get_binary()
         return version
 
-    def _send_server_version(self):
+    def _send_server_version(self, extension_pairs):
         # winscp will freak out if the server sends version info before the
         # client finishes sending INIT.
         t, data = self._read_packet()
         if t != CMD_INIT:
             raise SFTPError('Incompatible sftp protocol')
         version = struct.unpack('>I', data[:4])[0]
-        # advertise that we support "check-file"
-        extension_pairs = ['check-file', 'md5,sha1']
         msg = Message()
         msg.add_int(_VERSION)
         msg.add(*extension_pairs)
         self._send_packet(CMD_VERSION, msg)
         return version
 
+    def _convert_status(self, msg):
+        """
+        Raises EOFError or IOError on error status; otherwise does nothing.
+        """
+        code = msg.get_int()
+        text = msg.get_text()
+        if code == SFTP_OK:
+            return
+        elif code == SFTP_EOF:
+            raise EOFError(text)
+        elif code == SFTP_NO_SUCH_FILE:
+            # clever idea from john a. meinel: map the error codes to errno
+            raise IOError(errno.ENOENT, text)
+        elif code == SFTP_PERMISSION_DENIED:
+            raise IOError(errno.EACCES, text)
+        else:
+            raise IOError(text)
+
     def _log(self, level, msg, *args, **kwargs):
         self.logger.log(level, msg, *args, **kwargs)
 
@@ -136,6 +166,8 @@ class BaseSFTP (object):
             self._log(level, "%s", m)
 
     def _write_all(self, out):
+        # sends may be partial: slice the rest without copying it
+        out = memoryview(out)
         while len(out) > 0:
             n = self.sock.send(out)
             if n <= 0:
@@ -145,7 +177,11 @@ class BaseSFTP (object):
             out = out[n:]
         return
 
-    def _read_all(self, n):
+    def _read_all(self, n, wait=False):
+        """
+        read exactly ``n`` bytes; with ``wait``, a ``socket.timeout`` on a
+        paramiko channel is ignored, rather than losing what's been read
+        """
         out = bytes()
         while n > 0:
             if isinstance(self.sock, socket.socket):
@@ -158,7 +194,12 @@ class BaseSFTP (object):
                         x = self.sock.recv(n)
                         break
             else:
-                x = self.sock.recv(n)
+                try:
+                    x = self.sock.recv(n)
+                except socket.timeout:
+                    if wait:
+                        continue
+                    raise
 
             if len(x) == 0:
                 raise EOFError()
@@ -173,14 +214,14 @@ class BaseSFTP (object):
             self._loglist(DEBUG, util.format_binary(out, 'OUT: '))
         self._write_all(out)
 
-    def _read_packet(self):
-        x = self._read_all(4)
+    def _read_packet(self, wait=False):
+        x = self._read_all(4, wait)
         # most sftp servers won't accept packets larger than about 32k, so
         # anything with the high byte set (> 16MB) is just garbage.
         if byte_ord(x[0]):
             raise SFTPError('Garbage packet received')
         size = struct.unpack('>I', x)[0]
-        data = self._read_all(size)
+        data = self._read_all(size, wait)
         if self.ultra_debug:
             self._loglist(DEBUG, util.format_binary(data, 'IN: '))
         if size > 0:
@@ -0,0 +1,884 @@
+# Copyright (C) 2003-2007  Robey Pointer <robeypointer@gmail.com>
+#
+# This file is part of paramiko.
+#
+# Paramiko is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# Paramiko is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Paramiko; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
+
+"""
+SFTP client for `asyncio`, driven by the event loop instead of blocking reads.
+"""
+
+import asyncio
+import functools
+import os
+import socket
+import struct
+from collections import deque
+
+from paramiko import util
+from paramiko.common import DEBUG, INFO, o777
+from paramiko.message import Message
+from paramiko.py3compat import b, long
+from paramiko.sftp import (
+    BaseSFTP, SFTPError, CMD_INIT, CMD_OPEN, CMD_CLOSE, CMD_READ, CMD_WRITE,
+    CMD_FSTAT, CMD_STAT, CMD_LSTAT, CMD_OPENDIR, CMD_READDIR, CMD_REMOVE,
+    CMD_RENAME, CMD_MKDIR, CMD_RMDIR, CMD_REALPATH, CMD_HANDLE, CMD_DATA,
+    CMD_NAME, CMD_ATTRS, CMD_STATUS, CMD_EXTENDED, CMD_EXTENDED_REPLY,
+    _VERSION,
+)
+from paramiko.sftp_attr import SFTPAttributes
+from paramiko.sftp_client import _open_flags, _parse_limits, _request_message
+from paramiko.sftp_file import SFTPFile
+from paramiko.sftp_transfer import _write_at
+from paramiko.ssh_exception import SSHException
+
+
+class AsyncSFTPClient (BaseSFTP):
+    """
+    SFTP client for use with `asyncio`.  Methods which talk to the server
+    return `asyncio.Future` objects, to be awaited, instead of blocking; the
+    responses are read by the event loop as they arrive.  So any number of
+    requests, on any number of sessions, can be in progress at once from one
+    thread.  A typical use case is::
+
+        sftp = await AsyncSFTPClient.from_transport(transport)
+        async with await sftp.open('/etc/motd', 'rb') as f:
+            data = await f.read()
+        await sftp.get('/srv/backup.tar', 'backup.tar')
+        sftp.close()
+
+    The channel is watched with `asyncio.AbstractEventLoop.add_reader`, so a
+    selector-based event loop is needed (the default, except on Windows).
+    The `.Transport` still runs in its own thread, as usual.
+
+    Instances of this class may be used as asynchronous context managers.
+    """
+
+    def __init__(self, sock, loop=None):
+        """
+        Create an asyncio SFTP client from an existing `.Channel`, which
+        should already have requested the ``"sftp"`` subsystem.  Call `start`
+        before using it (`from_transport` does both).
+
+        :param .Channel sock: an open `.Channel` using the ``"sftp"`` subsystem
+        :param loop: the event loop to use (by default, the current one)
+        """
+        BaseSFTP.__init__(self)
+        self.sock = sock
+        self.loop = loop if loop is not None else asyncio.get_event_loop()
+        self.request_number = 1
+        # request # -> Future of (type, msg)
+        self._expecting = {}
+        # Future of the server's version, while negotiating
+        self._version = None
+        self._incoming = bytearray()
+        self._outgoing = deque()  # memoryviews of what's still to be sent
+        self._retry = None
+        self._reading = False
+        self._error = None
+        self._max_read_size = SFTPFile.MAX_REQUEST_SIZE
+        self._max_write_size = SFTPFile.MAX_REQUEST_SIZE
+        transport = sock.get_transport()
+        self.logger = util.get_logger(transport.get_log_channel() + '.sftp')
+        self.ultra_debug = transport.get_hexdump()
+
+    @classmethod
+    def from_transport(cls, t, loop=None, window_size=None,
+                       max_packet_size=None):
+        """
+        Open an SFTP session on a new channel of an open `.Transport`.
+
+        :param .Transport t: an open `.Transport` which is already
+            authenticated
+        :param loop: the event loop to use (by default, the current one)
+        :param int window_size:
+            optional window size for the SFTP session.
+        :param int max_packet_size:
+            optional max packet size for the SFTP session.
+
+        :return: a future of the new, started `.AsyncSFTPClient`
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        opening = asyncio.wrap_future(
+            t.open_session_async(window_size=window_size,
+                                 max_packet_size=max_packet_size),
+            loop=loop)
+
+        def opened(chan):
+            # waits for the server's reply: keep that out of the event loop
+            invoking = loop.run_in_executor(
+                None, chan.invoke_subsystem, 'sftp')
+            return _finally_on_error(
+                loop, _then(loop, invoking, lambda _: cls(chan, loop).start()),
+                chan.close)
+
+        return _then(loop, opening, opened)
+
+    def _log(self, level, msg, *args, **kwargs):
+        super(AsyncSFTPClient, self)._log(level, "[chan %s] " + msg,
+                                          self.sock.get_name(), *args,
+                                          **kwargs)
+
+    def start(self):
+        """
+        Start reading from the channel, and negotiate the SFTP session.
+
+        :return: a future of this client, once it's ready for use
+        """
+        self.sock.settimeout(0.0)
+        self.loop.add_reader(self.sock.fileno(), self._read_ready)
+        self._reading = True
+        self._version = asyncio.Future(loop=self.loop)
+        m = Message()
+        m.add_int(_VERSION)
+        self._send_packet(CMD_INIT, m)
+
+        def negotiated(version):
+            self._log(INFO, "Opened sftp connection (server version %s)",
+                      version)
+            if 'limits@openssh.com' not in self._extensions:
+                return self
+            return _then(
+                self.loop, self._request(CMD_EXTENDED, 'limits@openssh.com'),
+                self._set_limits, lambda e: self)
+
+        return _then(self.loop, self._version, negotiated)
+
+    def close(self):
+        """
+        Close the SFTP session and its underlying channel.  Requests still in
+        progress fail with `.SSHException`.
+        """
+        self._log(INFO, 'sftp session closed.')
+        self._stop(SSHException('SFTP session closed'))
+        self.sock.close()
+
+    def __aenter__(self):
+        return _resolved(self.loop, self)
+
+    def __aexit__(self, *exc_info):
+        self.close()
+        return _resolved(self.loop, None)
+
+    def normalize(self, path):
+        """
+        Return the normalized path (on the server) of a given path, like
+        `.SFTPClient.normalize`.
+
+        :return: a future of the normalized path, as a `str`
+        """
+        self._log(DEBUG, "normalize(%r)", path)
+        return _then(self.loop, self._request(CMD_REALPATH, b(path)), _name)
+
+    def stat(self, path):
+        """
+        Retrieve information about a file on the server, following symbolic
+        links, like `.SFTPClient.stat`.
+
+        :return: a future of an `.SFTPAttributes` object
+        """
+        self._log(DEBUG, "stat(%r)", path)
+        return _then(self.loop, self._request(CMD_STAT, b(path)), _attrs)
+
+    def lstat(self, path):
+        """
+        Retrieve information about a file on the server, without following
+        symbolic links, like `.SFTPClient.lstat`.
+
+        :return: a future of an `.SFTPAttributes` object
+        """
+        self._log(DEBUG, "lstat(%r)", path)
+        return _then(self.loop, self._request(CMD_LSTAT, b(path)), _attrs)
+
+    def listdir(self, path='.'):
+        """
+        List the names of the entries in ``path`` on the server (not
+        including ``'.'`` and ``'..'``), in arbitrary order.
+
+        :return: a future of a `list` of `str`
+        """
+        return _then(self.loop, self.listdir_attr(path),
+                     lambda attrs: [a.filename for a in attrs])
+
+    def listdir_attr(self, path='.'):
+        """
+        List the entries in ``path`` on the server, like
+        `.SFTPClient.listdir_attr`.
+
+        :return: a future of a `list` of `.SFTPAttributes`
+        """
+        self._log(DEBUG, "listdir(%r)", path)
+        results = []
+
+        def opened(response):
+            handle = _handle(response)
+
+            def read_more():
+                return _then(self.loop, self._request(CMD_READDIR, handle),
+                             got, done)
+
+            def got(response):
+                t, msg = response
+                if t != CMD_NAME:
+                    raise SFTPError('Expected name response')
+                for i in range(msg.get_int()):
+                    filename = msg.get_text()
+                    longname = msg.get_string()
+                    attr = SFTPAttributes._from_msg(msg, filename, longname)
+                    if (filename != '.') and (filename != '..'):
+                        results.append(attr)
+                return read_more()
+
+            def done(e):
+                if isinstance(e, EOFError):
+                    return results
+                raise e
+
+            return _finally(self.loop, read_more(),
+                            lambda: self._request(CMD_CLOSE, handle))
+
+        return _then(self.loop, self._request(CMD_OPENDIR, b(path)), opened)
+
+    def open(self, filename, mode='r'):
+        """
+        Open a file on the server.  The ``mode`` is as for `.SFTPClient.open`
+        (``'b'`` is implied: data is always `bytes`).
+
+        :return: a future of an `.AsyncSFTPFile`
+        """
+        self._log(DEBUG, "open(%r, %r)", filename, mode)
+        opening = self._request(
+            CMD_OPEN, b(filename), _open_flags(mode), SFTPAttributes())
+        return _then(self.loop, opening,
+                     lambda response: AsyncSFTPFile(self, _handle(response)))
+
+    def remove(self, path):
+        """
+        Remove the file at the given path (not a directory).
+
+        :return: a future which completes once it's done
+        """
+        self._log(DEBUG, "remove(%r)", path)
+        return _then(self.loop, self._request(CMD_REMOVE, b(path)), _none)
+
+    def rename(self, oldpath, newpath):
+        """
+        Rename a file or folder from ``oldpath`` to ``newpath``.
+
+        :return: a future which completes once it's done
+        """
+        self._log(DEBUG, "rename(%r, %r)", oldpath, newpath)
+        return _then(self.loop,
+                     self._request(CMD_RENAME, b(oldpath), b(newpath)), _none)
+
+    def mkdir(self, path, mode=o777):
+        """
+        Create a folder named ``path`` with numeric mode ``mode``.
+
+        :return: a future which completes once it's done
+        """
+        self._log(DEBUG, "mkdir(%r, %r)", path, mode)
+        attr = SFTPAttributes()
+        attr.st_mode = mode
+        return _then(self.loop, self._request(CMD_MKDIR, b(path), attr),
+                     _none)
+
+    def rmdir(self, path):
+        """
+        Remove the folder named ``path``.
+
+        :return: a future which completes once it's done
+        """
+        self._log(DEBUG, "rmdir(%r)", path)
+        return _then(self.loop, self._request(CMD_RMDIR, b(path)), _none)
+
+    def get(self, remotepath, localpath, callback=None,
+            max_concurrent_requests=64):
+        """
+        Copy a remote file to the local host, with up to
+        ``max_concurrent_requests`` reads in flight at once.
+
+        :param str remotepath: the remote file to copy
+        :param str localpath: the destination path on the local host
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``) that accepts
+            the bytes transferred so far and the total bytes to be transferred
+
+        :return: a future which completes once the file is copied
+        """
+        self._log(DEBUG, "get(%r, %r)", remotepath, localpath)
+
+        def opened(fr):
+            def got_size(attrs):
+                fl = open(localpath, 'wb')
+                download = _AsyncDownload(
+                    fr, fl, attrs.st_size, callback)
+                copying = _Pump(self.loop, download.next_request,
+                                max_concurrent_requests).start()
+                return _then(self.loop, _finally(self.loop, copying, fl.close),
+                             lambda _: _check_size(localpath, attrs.st_size))
+
+            return _finally(self.loop, _then(self.loop, fr.stat(), got_size),
+                            fr.close)
+
+        return _then(self.loop, self.open(remotepath, 'rb'), opened)
+
+    def put(self, localpath, remotepath, callback=None,
+            max_concurrent_requests=64):
+        """
+        Copy a local file to the server as ``remotepath``, with up to
+        ``max_concurrent_requests`` writes in flight at once.
+
+        :param str localpath: the local file to copy
+        :param str remotepath: the destination path on the server
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``) that accepts
+            the bytes transferred so far and the total bytes to be transferred
+
+        :return: a future of an `.SFTPAttributes` object of the new file
+        """
+        self._log(DEBUG, "put(%r, %r)", localpath, remotepath)
+
+        def start(_):
+            fl = open(localpath, 'rb')
+
+            def opened(fw):
+                upload = _AsyncUpload(fw, fl, callback)
+                copying = _Pump(self.loop, upload.next_request,
+                                max_concurrent_requests).start()
+                return _finally(self.loop, copying, fw.close)
+
+            def confirm(attrs):
+                size = os.fstat(fl.fileno()).st_size
+                if attrs.st_size != size:
+                    raise IOError('size mismatch in put!  {} != {}'.format(
+                        attrs.st_size, size))
+                return attrs
+
+            copied = _then(self.loop, self.open(remotepath, 'wb'), opened)
+            confirmed = _then(
+                self.loop, copied,
+                lambda _: _then(self.loop, self.stat(remotepath), confirm))
+            return _finally(self.loop, confirmed, fl.close)
+
+        # (so that an error opening the local file fails the future)
+        return _then(self.loop, _resolved(self.loop, None), start)
+
+    # ...internals...
+
+    def _request(self, t, *arg):
+        """
+        send a request, and return a future of its ``(type, msg)`` (which
+        raises the error, if it's an error status)
+        """
+        future = asyncio.Future(loop=self.loop)
+        if self._error is not None:
+            future.set_exception(self._error)
+            return future
+        num = self.request_number
+        self.request_number += 1
+        self._expecting[num] = future
+        self._send_packet(t, _request_message(num, arg))
+        return _then(self.loop, future, self._check_status)
+
+    def _check_status(self, response):
+        t, msg = response
+        if t == CMD_STATUS:
+            self._convert_status(msg)
+        return response
+
+    def _set_limits(self, response):
+        t, msg = response
+        if t == CMD_EXTENDED_REPLY:
+            read_size, write_size = _parse_limits(msg)
+            self._max_read_size = read_size or self._max_read_size
+            self._max_write_size = write_size or self._max_write_size
+            self._log(DEBUG, "Server limits: read %s, write %s",
+                      self._max_read_size, self._max_write_size)
+        return self
+
+    def _read_ready(self):
+        """called by the event loop when there's something to read"""
+        try:
+            while self.sock.recv_ready():
+                self._incoming += self.sock.recv(65536)
+            while self._packet_ready():
+                t, data = self._read_packet()
+                self._dispatch(t, data)
+        except Exception as e:
+            self._stop(e)
+            return
+        if self.sock.closed or self.sock.eof_received:
+            if not self.sock.recv_ready():
+                self._stop(SSHException('Server connection dropped'))
+
+    def _packet_ready(self):
+        if len(self._incoming) < 4:
+            return False
+        if self._incoming[0]:
+            # garbage: let _read_packet complain about it
+            return True
+        size = struct.unpack('>I', bytes(self._incoming[:4]))[0]
+        return len(self._incoming) >= 4 + size
+
+    def _read_all(self, n, wait=False):
+        # only called for complete packets
+        data = bytes(self._incoming[:n])
+        del self._incoming[:n]
+        return data
+
+    def _write_all(self, out):
+        self._outgoing.append(memoryview(out))
+        if self._retry is None:
+            self._flush()
+
+    def _flush(self):
+        self._retry = None
+        while self._outgoing:
+            data = self._outgoing[0]
+            try:
+                n = self.sock.send(data)
+            except socket.timeout:
+                # the channel's send window is full, and there's nothing to
+                # wait on for it to open up again: try again shortly
+                self._retry = self.loop.call_later(0.01, self._flush)
+                return
+            except Exception as e:
+                self._stop(e)
+                return
+            if n <= 0:
+                self._stop(SSHException('Server connection dropped'))
+                return
+            if n < len(data):
+                self._outgoing[0] = data[n:]
+            else:
+                self._outgoing.popleft()
+
+    def _dispatch(self, t, data):
+        if self._version is not None:
+            future, self._version = self._version, None
+            try:
+                future.set_result(self._parse_version(t, data))
+            except SFTPError as e:
+                future.set_exception(e)
+            return
+        msg = Message(data)
+        num = msg.get_int()
+        future = self._expecting.pop(num, None)
+        if future is None:
+            self._log(DEBUG, "Unexpected response #%s", num)
+        elif not future.cancelled():
+            future.set_result((t, msg))
+
+    def _stop(self, e):
+        """fail everything in progress, and anything requested later"""
+        if self._error is not None:
+            return
+        if not isinstance(e, (IOError, SSHException, SFTPError)):
+            self._log(DEBUG, "sftp session failed: %r", e)
+        self._error = e
+        if self._reading:
+            self.loop.remove_reader(self.sock.fileno())
+            self._reading = False
+        if self._retry is not None:
+            self._retry.cancel()
+            self._retry = None
+        self._outgoing.clear()
+        futures = list(self._expecting.values())
+        self._expecting.clear()
+        if self._version is not None:
+            futures.append(self._version)
+            self._version = None
+        for future in futures:
+            if not future.done():
+                future.set_exception(e)
+
+
+class AsyncSFTPFile (object):
+    """
+    A file on the server, opened with `.AsyncSFTPClient.open`.  Reads and
+    writes return futures; bigger ones are split into several requests, which
+    are all sent at once.  Each read or write starts at the file position
+    when it's called.
+
+    Instances of this class may be used as asynchronous context managers.
+    """
+
+    def __init__(self, sftp, handle):
+        self.sftp = sftp
+        self.handle = handle
+        self._pos = 0
+
+    def __aenter__(self):
+        return _resolved(self.sftp.loop, self)
+
+    def __aexit__(self, *exc_info):
+        return self.close()
+
+    def tell(self):
+        """
+        Return the file's current position.
+        """
+        return self._pos
+
+    def seek(self, offset):
+        """
+        Set the file's current position, for the next read or write.
+
+        :param int offset: the new position, from the start of the file
+        """
+        self._pos = offset
+
+    def read(self, size=None):
+        """
+        Read up to ``size`` bytes from the file (less only at EOF), or
+        everything up to EOF if ``size`` is omitted.
+
+        :return: a future of the data read, as `bytes`
+        """
+        offset = self._pos
+        if size is not None:
+            return self._read(offset, size)
+        remaining = _then(self.sftp.loop, self.stat(),
+                          lambda attrs: max(0, attrs.st_size - offset))
+        return _then(self.sftp.loop, remaining,
+                     lambda size: self._read(offset, size))
+
+    def write(self, data):
+        """
+        Write ``data`` to the file.
+
+        :param bytes data: the data to write
+        :return: a future which completes once it's all written
+        """
+        offset = self._pos
+        self._pos += len(data)
+        chunk = self.sftp._max_write_size
+        writes = [self._write_at(offset + i, data[i:i + chunk])
+                  for i in range(0, len(data), chunk)]
+        return _then(self.sftp.loop, _gather(self.sftp.loop, writes), _none)
+
+    def stat(self):
+        """
+        Retrieve information about this file, like `.SFTPFile.stat`.
+
+        :return: a future of an `.SFTPAttributes` object
+        """
+        return _then(self.sftp.loop, self.sftp._request(CMD_FSTAT, self.handle),
+                     _attrs)
+
+    def close(self):
+        """
+        Close the file.
+
+        :return: a future which completes once it's closed
+        """
+        return _then(self.sftp.loop, self.sftp._request(CMD_CLOSE, self.handle),
+                     _none)
+
+    def _read(self, offset, size):
+        chunk = self.sftp._max_read_size
+        lengths = [min(chunk, size - i) for i in range(0, size, chunk)]
+        reads = [self._read_at(offset + i * chunk, length)
+                 for i, length in enumerate(lengths)]
+
+        def joined(chunks):
+            data = bytes()
+            for length, got in zip(lengths, chunks):
+                data += got
+                if len(got) < length:
+                    break
+            self._pos = offset + len(data)
+            if chunks and got and len(data) < size:
+                # a short read before EOF: read the rest
+                rest = self._read(self._pos, size - len(data))
+                return _then(self.sftp.loop, rest, lambda rest: data + rest)
+            return data
+
+        return _then(self.sftp.loop, _gather(self.sftp.loop, reads), joined)
+
+    def _read_at(self, offset, length):
+        """a future of up to ``length`` bytes at ``offset`` (``b''`` at EOF)"""
+        def got(response):
+            t, msg = response
+            if t != CMD_DATA:
+                raise SFTPError('Expected data')
+            return msg.get_string()
+
+        def eof(e):
+            if isinstance(e, EOFError):
+                return bytes()
+            raise e
+
+        reading = self.sftp._request(
+            CMD_READ, self.handle, long(offset), int(length))
+        return _then(self.sftp.loop, reading, got, eof)
+
+    def _write_at(self, offset, data):
+        return self.sftp._request(CMD_WRITE, self.handle, long(offset), data)
+
+
+class _AsyncDownload (object):
+    def __init__(self, fr, fl, size, callback):
+        self._file = fr
+        self._fd = fl.fileno()
+        self._size = size
+        self._callback = callback
+        self._chunk = fr.sftp._max_read_size
+        self._offset = 0
+        self._eof = False
+        self._retry = deque()  # (offset, length) left over from short reads
+        self._transferred = 0
+
+    def next_request(self):
+        if self._retry:
+            offset, length = self._retry.popleft()
+        elif self._eof or self._offset >= self._size:
+            return None
+        else:
+            offset = self._offset
+            length = min(self._chunk, self._size - offset)
+            self._offset += length
+        return _then(self._file.sftp.loop, self._file._read_at(offset, length),
+                     functools.partial(self._got, offset, length))
+
+    def _got(self, offset, length, data):
+        if not data:
+            # the file got shorter
+            self._eof = True
+            return
+        _write_at(self._fd, data, offset)
+        if len(data) < length:
+            self._retry.append((offset + len(data), length - len(data)))
+        self._transferred += len(data)
+        if self._callback is not None:
+            self._callback(self._transferred, self._size)
+
+
+class _AsyncUpload (object):
+    def __init__(self, fw, fl, callback):
+        self._file = fw
+        self._local = fl
+        self._size = os.fstat(fl.fileno()).st_size
+        self._callback = callback
+        self._chunk = fw.sftp._max_write_size
+        self._offset = 0
+        self._transferred = 0
+
+    def next_request(self):
+        data = self._local.read(self._chunk)
+        if not data:
+            return None
+        offset = self._offset
+        self._offset += len(data)
+        return _then(self._file.sftp.loop, self._file._write_at(offset, data),
+                     functools.partial(self._sent, len(data)))
+
+    def _sent(self, length, response):
+        self._transferred += length
+        if self._callback is not None:
+            self._callback(self._transferred, self._size)
+
+
+class _Pump (object):
+    """
+    keep up to ``limit`` futures from ``produce()`` in progress at once,
+    until it returns ``None`` and they're all done (or one fails)
+    """
+
+    def __init__(self, loop, produce, limit):
+        self._produce = produce
+        self._limit = max(1, limit)
+        self._in_flight = 0
+        self.done = asyncio.Future(loop=loop)
+
+    def start(self):
+        self._fill()
+        return self.done
+
+    def _fill(self):
+        while self._in_flight < self._limit:
+            try:
+                future = self._produce()
+            except Exception as e:
+                self._fail(e)
+                return
+            if future is None:
+                break
+            self._in_flight += 1
+            future.add_done_callback(self._finished)
+        if not self._in_flight and not self.done.done():
+            self.done.set_result(None)
+
+    def _finished(self, future):
+        self._in_flight -= 1
+        e = future.exception()
+        if e is not None:
+            self._fail(e)
+        elif not self.done.done():
+            self._fill()
+
+    def _fail(self, e):
+        if not self.done.done():
+            self.done.set_exception(e)
+
+
+def _then(loop, future, callback, errback=None):
+    """
+    a future of ``callback(result)`` -- or ``errback(exception)`` -- once
+    ``future`` is done, or of its result if that's a future too
+    """
+    out = asyncio.Future(loop=loop)
+
+    def done(f):
+        if out.cancelled():
+            return
+        if f.cancelled():
+            out.cancel()
+            return
+        try:
+            e = f.exception()
+            if e is None:
+                value = callback(f.result())
+            elif errback is not None:
+                value = errback(e)
+            else:
+                out.set_exception(e)
+                return
+        except Exception as e:
+            out.set_exception(e)
+            return
+        if isinstance(value, asyncio.Future):
+            value.add_done_callback(functools.partial(_copy, out))
+        else:
+            out.set_result(value)
+
+    future.add_done_callback(done)
+    return out
+
+
+def _finally(loop, future, cleanup):
+    """
+    ``future``'s outcome, once ``cleanup()`` (which may return a future) has
+    been done too.  An error from the cleanup only counts if ``future``
+    succeeded.
+    """
+    def after(outcome, keep_outcome):
+        cleaning = cleanup()
+        if not isinstance(cleaning, asyncio.Future):
+            return outcome()
+        errback = (lambda e: outcome()) if keep_outcome else None
+        return _then(loop, cleaning, lambda _: outcome(), errback)
+
+    def failed(e):
+        def reraise():
+            raise e
+        return after(reraise, True)
+
+    return _then(loop, future, lambda value: after(lambda: value, False),
+                 failed)
+
+
+def _finally_on_error(loop, future, cleanup):
+    """``future``, but calling ``cleanup()`` first if it fails"""
+    def failed(e):
+        cleanup()
+        raise e
+    return _then(loop, future, lambda value: value, failed)
+
+
+def _gather(loop, futures):
+    """
+    a future of a list of the results of ``futures``, or of the first error,
+    once they're all done
+    """
+    out = asyncio.Future(loop=loop)
+    results = [None] * len(futures)
+    errors = []
+    remaining = [len(futures)]
+
+    def done(i, f):
+        if f.cancelled():
+            errors.append(asyncio.CancelledError())
+        elif f.exception() is not None:
+            errors.append(f.exception())
+        else:
+            results[i] = f.result()
+        remaining[0] -= 1
+        if remaining[0] or out.done():
+            return
+        if errors:
+            out.set_exception(errors[0])
+        else:
+            out.set_result(results)
+
+    if not futures:
+        out.set_result(results)
+    for i, future in enumerate(futures):
+        future.add_done_callback(functools.partial(done, i))
+    return out
+
+
+def _copy(dst, src):
+    if dst.done():
+        return
+    if src.cancelled():
+        dst.cancel()
+    elif src.exception() is not None:
+        dst.set_exception(src.exception())
+    else:
+        dst.set_result(src.result())
+
+
+def _resolved(loop, value):
+    future = asyncio.Future(loop=loop)
+    future.set_result(value)
+    return future
+
+
+def _none(response):
+    return None
+
+
+def _attrs(response):
+    t, msg = response
+    if t != CMD_ATTRS:
+        raise SFTPError('Expected attributes')
+    return SFTPAttributes._from_msg(msg)
+
+
+def _handle(response):
+    t, msg = response
+    if t != CMD_HANDLE:
+        raise SFTPError('Expected handle')
+    return msg.get_binary()
+
+
+def _name(response):
+    t, msg = response
+    if t != CMD_NAME:
+        raise SFTPError('Expected name response')
+    count = msg.get_int()
+    if count != 1:
+        raise SFTPError('Realpath returned {} results'.format(count))
+    return msg.get_text()
+
+
+def _check_size(localpath, size):
+    s = os.stat(localpath)
+    if s.st_size != size:
+        raise IOError(
+            'size mismatch in get!  {} != {}'.format(s.st_size, size))
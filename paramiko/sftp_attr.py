@@ -17,9 +17,11 @@
 # 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
 
 import stat
+import struct
 import time
 from paramiko.common import x80000000, o700, o70, xffffffff
-from paramiko.py3compat import long, b
+from paramiko.message import Message
+from paramiko.py3compat import long, b, u
 
 
 class SFTPAttributes (object):
@@ -37,10 +39,20 @@ class SFTPAttributes (object):
         - ``st_mtime``
 
     Because SFTP allows flags to have other arbitrary named attributes, these
-    are stored in a dict named ``attr``.  Occasionally, the filename is also
-    stored, in ``filename``.
+    are stored in a dict named ``attr`` (decoded from the server's response
+    only when first used).  Occasionally, the filename is also stored, in
+    ``filename``; and in a folder listing, the server's ``ls -l`` style
+    description of the file, in ``longname``.
+
+    To keep large folder listings small, instances have no ``__dict__``: only
+    the fields above may be set on them (subclasses may add more).
     """
 
+    __slots__ = (
+        '_flags', 'st_size', 'st_uid', 'st_gid', 'st_mode', 'st_atime',
+        'st_mtime', 'filename', '_attr', '_longname',
+    )
+
     FLAG_SIZE = 1
     FLAG_UIDGID = 2
     FLAG_PERMISSIONS = 4
@@ -58,7 +70,44 @@ class SFTPAttributes (object):
         self.st_mode = None
         self.st_atime = None
         self.st_mtime = None
-        self.attr = {}
+        # the extended attributes: a dict once decoded (or set), until then
+        # the raw extended section of the message they came in (or None)
+        self._attr = None
+
+    @property
+    def attr(self):
+        if not isinstance(self._attr, dict):
+            attr = {}
+            if self._attr is not None:
+                msg = Message(self._attr)
+                for i in range(msg.get_int()):
+                    key = msg.get_string()
+                    attr[key] = msg.get_string()
+            self._attr = attr
+        return self._attr
+
+    @attr.setter
+    def attr(self, value):
+        self._attr = value
+
+    @property
+    def longname(self):
+        """
+        The server's description of the file, if it came from a folder
+        listing; otherwise, the same as ``str()``.
+        """
+        try:
+            longname = self._longname
+        except AttributeError:
+            return str(self)
+        if isinstance(longname, bytes):
+            # only decoded if it's actually used
+            longname = self._longname = u(longname)
+        return longname
+
+    @longname.setter
+    def longname(self, value):
+        self._longname = value
 
     @classmethod
     def from_stat(cls, obj, filename=None):
@@ -87,30 +136,40 @@ class SFTPAttributes (object):
     # ...internals...
     @classmethod
     def _from_msg(cls, msg, filename=None, longname=None):
+        """
+        ``longname`` may be given as the `bytes` from the message, to be
+        decoded only if it's used.
+        """
         attr = cls()
         attr._unpack(msg)
         if filename is not None:
             attr.filename = filename
         if longname is not None:
-            attr.longname = longname
+            attr._longname = longname
         return attr
 
     def _unpack(self, msg):
-        self._flags = msg.get_int()
-        if self._flags & self.FLAG_SIZE:
-            self.st_size = msg.get_int64()
-        if self._flags & self.FLAG_UIDGID:
-            self.st_uid = msg.get_int()
-            self.st_gid = msg.get_int()
-        if self._flags & self.FLAG_PERMISSIONS:
-            self.st_mode = msg.get_int()
-        if self._flags & self.FLAG_AMTIME:
-            self.st_atime = msg.get_int()
-            self.st_mtime = msg.get_int()
-        if self._flags & self.FLAG_EXTENDED:
-            count = msg.get_int()
-            for i in range(count):
-                self.attr[msg.get_string()] = msg.get_string()
+        self._flags = flags = msg.get_int()
+        layout, fields = _LAYOUTS[flags & 15]
+        if len(fields) == 6:
+            # the usual case
+            (self.st_size, self.st_uid, self.st_gid, self.st_mode,
+             self.st_atime, self.st_mtime) = layout.unpack(
+                msg.get_bytes(layout.size))
+        elif fields:
+            values = layout.unpack(msg.get_bytes(layout.size))
+            for field, value in zip(fields, values):
+                setattr(self, field, value)
+        if flags & self.FLAG_EXTENDED:
+            # just find the end of the extended attributes, and keep them
+            # undecoded for now
+            packet = msg.packet
+            start = packet.tell()
+            for i in range(msg.get_int() * 2):
+                packet.seek(msg.get_int(), 1)
+            end = packet.tell()
+            packet.seek(start)
+            self._attr = packet.read(end - start)
 
     def _pack(self, msg):
         self._flags = 0
@@ -122,7 +181,7 @@ class SFTPAttributes (object):
             self._flags |= self.FLAG_PERMISSIONS
         if (self.st_atime is not None) and (self.st_mtime is not None):
             self._flags |= self.FLAG_AMTIME
-        if len(self.attr) > 0:
+        if self._attr:
             self._flags |= self.FLAG_EXTENDED
         msg.add_int(self._flags)
         if self._flags & self.FLAG_SIZE:
@@ -136,9 +195,12 @@ class SFTPAttributes (object):
             # throw away any fractional seconds
             msg.add_int(long(self.st_atime))
             msg.add_int(long(self.st_mtime))
-        if self._flags & self.FLAG_EXTENDED:
-            msg.add_int(len(self.attr))
-            for key, val in self.attr.items():
+        if isinstance(self._attr, bytes):
+            # passed through as received
+            msg.add_bytes(self._attr)
+        elif self._flags & self.FLAG_EXTENDED:
+            msg.add_int(len(self._attr))
+            for key, val in self._attr.items():
                 msg.add_string(key)
                 msg.add_string(val)
         return
@@ -231,3 +293,26 @@ class SFTPAttributes (object):
 
     def asbytes(self):
         return b(str(self))
+
+
+def _layout(flags):
+    fmt = '>'
+    fields = []
+    if flags & SFTPAttributes.FLAG_SIZE:
+        fmt += 'Q'
+        fields.append('st_size')
+    if flags & SFTPAttributes.FLAG_UIDGID:
+        fmt += 'II'
+        fields += ['st_uid', 'st_gid']
+    if flags & SFTPAttributes.FLAG_PERMISSIONS:
+        fmt += 'I'
+        fields.append('st_mode')
+    if flags & SFTPAttributes.FLAG_AMTIME:
+        fmt += 'II'
+        fields += ['st_atime', 'st_mtime']
+    return struct.Struct(fmt), tuple(fields)
+
+
+# the fixed-size fields present for each combination of the basic flags, so
+# that they can all be read at once
+_LAYOUTS = [_layout(flags) for flags in range(16)]
@@ -0,0 +1,216 @@
+# This file is part of paramiko.
+#
+# Paramiko is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# Paramiko is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Paramiko; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
+
+"""
+Caching remote file metadata on the client.
+"""
+
+import posixpath
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+from paramiko.py3compat import b
+from paramiko.sftp import (
+    CMD_CLOSE, CMD_EXTENDED, CMD_FSETSTAT, CMD_MKDIR, CMD_OPEN, CMD_REMOVE,
+    CMD_RENAME, CMD_RMDIR, CMD_SETSTAT, CMD_SYMLINK, CMD_WRITE,
+    SFTP_FLAG_APPEND, SFTP_FLAG_CREATE, SFTP_FLAG_TRUNC, SFTP_FLAG_WRITE,
+)
+
+_WRITE_FLAGS = (
+    SFTP_FLAG_WRITE | SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC | SFTP_FLAG_APPEND
+)
+
+
+class SFTPCache (object):
+    """
+    A cache of the results of `.SFTPClient.stat`, `~.SFTPClient.lstat`,
+    `~.SFTPClient.listdir_attr` (and so `~.SFTPClient.listdir`) and
+    `~.SFTPClient.normalize`, as enabled with `.SFTPClient.enable_cache`.
+
+    Each result is kept for up to ``ttl`` seconds, and only the
+    ``max_entries`` most recently used are kept.  Listing a folder also
+    caches the `~.SFTPClient.lstat` (and, except for symlinks, the
+    `~.SFTPClient.stat`) of each entry.  Entries are dropped as soon as the
+    same client changes the paths they're for: by removing, renaming or
+    creating them, changing their attributes, or writing to them.  Changes
+    made any other way (by other clients, or through a symlink) are only seen
+    once the affected entries expire.
+
+    Paths are matched as they're given (relative to the `~.SFTPClient.chdir`
+    folder, if any), without resolving ``..`` or symlinks.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        #: The number of lookups answered from the cache
+        self.hits = 0
+        #: The number of lookups which had to ask the server
+        self.misses = 0
+        self._lock = threading.Lock()
+        # (kind, path) -> (expiry time, value), least recently used first
+        self._entries = OrderedDict()
+        # open handle -> (path, whether it was opened for writing)
+        self._handles = {}
+        # bumped by every invalidation, so that results requested before
+        # one aren't stored after it
+        self._generation = 0
+
+    def __repr__(self):
+        return '<paramiko.SFTPCache {} entries, {} hits, {} misses>'.format(
+            len(self._entries), self.hits, self.misses)
+
+    def clear(self):
+        """
+        Drop every cached entry (the counters are kept).
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def get(self, kind, path):
+        """
+        Look up a cached result, as ``(value, generation)``; the value is
+        ``None`` if it isn't cached, and the generation is to be passed on to
+        `put` along with the result from the server.
+        """
+        key = (kind, _key(path))
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and entry[0] > time.time():
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1], self._generation
+            self.misses += 1
+            return None, self._generation
+
+    def put(self, kind, path, value, generation):
+        """
+        Cache a result from the server, unless anything has been invalidated
+        since `get` returned ``generation``.
+        """
+        with self._lock:
+            if generation == self._generation:
+                self._store((kind, _key(path)), value, time.time() + self.ttl)
+
+    def put_listing(self, path, attrs, generation):
+        """
+        Cache the result of listing a folder, and the attributes of each
+        entry in it.
+        """
+        path = _key(path)
+        with self._lock:
+            if generation != self._generation:
+                return
+            expires = time.time() + self.ttl
+            for attr in attrs:
+                child = _child(path, b(attr.filename))
+                self._store(('lstat', child), attr, expires)
+                if attr.st_mode is not None and not stat.S_ISLNK(attr.st_mode):
+                    self._store(('stat', child), attr, expires)
+            self._store(('listdir', path), attrs, expires)
+
+    def invalidate(self, path, tree=False):
+        """
+        Drop everything cached about ``path``, and the listing of its parent
+        folder; and, with ``tree``, about everything under it too.
+        """
+        path = _key(path)
+        with self._lock:
+            self._invalidate(path, tree)
+
+    def opened(self, handle, path, flags):
+        """
+        Note that ``handle`` is an open file at ``path``, so that changes
+        through it invalidate the path.
+        """
+        with self._lock:
+            self._handles[handle] = (_key(path), bool(flags & _WRITE_FLAGS))
+
+    def request(self, t, args):
+        """
+        Invalidate whatever a request (of type ``t``, with ``args``) about to
+        be sent to the server may change.
+        """
+        if t == CMD_WRITE or t == CMD_FSETSTAT:
+            self._invalidate_handle(args[0], False)
+        elif t == CMD_CLOSE:
+            self._invalidate_handle(args[0], True)
+        elif t in (CMD_REMOVE, CMD_SETSTAT, CMD_MKDIR):
+            self.invalidate(args[0])
+        elif t == CMD_OPEN:
+            if args[1] & _WRITE_FLAGS:
+                self.invalidate(args[0])
+        elif t == CMD_RMDIR:
+            self.invalidate(args[0], tree=True)
+        elif t == CMD_RENAME:
+            self.invalidate(args[0], tree=True)
+            self.invalidate(args[1], tree=True)
+        elif t == CMD_SYMLINK:
+            self.invalidate(args[1])
+        elif t == CMD_EXTENDED:
+            if args[0] == 'posix-rename@openssh.com':
+                self.invalidate(args[1], tree=True)
+                self.invalidate(args[2], tree=True)
+            elif args[0] in ('copy-file', 'hardlink@openssh.com'):
+                self.invalidate(args[2])
+            elif args[0] == 'copy-data':
+                self._invalidate_handle(args[4], False)
+
+    def _invalidate_handle(self, handle, closing):
+        with self._lock:
+            if closing:
+                path, writable = self._handles.pop(handle, (None, False))
+            else:
+                path, writable = self._handles.get(handle, (None, False))
+            # closing a file only changes anything if it was written to
+            if path is not None and (writable or not closing):
+                self._invalidate(path, False)
+
+    def _invalidate(self, path, tree):
+        self._generation += 1
+        for kind in ('stat', 'lstat', 'listdir', 'normalize'):
+            self._entries.pop((kind, path), None)
+        self._entries.pop(('listdir', _parent(path)), None)
+        if tree:
+            prefix = path.rstrip(b'/') + b'/'
+            for key in [k for k in self._entries if k[1].startswith(prefix)]:
+                del self._entries[key]
+
+    def _store(self, key, value, expires):
+        self._entries.pop(key, None)
+        self._entries[key] = (expires, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+def _key(path):
+    path = b(path)
+    if len(path) > 1:
+        path = path.rstrip(b'/') or b'/'
+    return path or b'.'
+
+
+def _parent(path):
+    return posixpath.dirname(path) or b'.'
+
+
+def _child(path, filename):
+    if path == b'.':
+        return filename
+    return posixpath.join(path, filename)
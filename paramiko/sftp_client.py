@@ -18,8 +18,14 @@
 
 
 from binascii import hexlify
+from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 import errno
+import hashlib
+import mmap
 import os
+import posixpath
+import socket
 import stat
 import threading
 import time
@@ -36,11 +42,19 @@ from paramiko.sftp import (
     SFTP_FLAG_TRUNC, SFTP_FLAG_APPEND, SFTP_FLAG_EXCL, CMD_OPEN, CMD_REMOVE,
     CMD_RENAME, CMD_MKDIR, CMD_RMDIR, CMD_STAT, CMD_ATTRS, CMD_LSTAT,
     CMD_SYMLINK, CMD_SETSTAT, CMD_READLINK, CMD_REALPATH, CMD_STATUS,
-    CMD_EXTENDED, SFTP_OK, SFTP_EOF, SFTP_NO_SUCH_FILE, SFTP_PERMISSION_DENIED,
+    CMD_EXTENDED, SFTP_NO_SUCH_FILE,
+    CMD_EXTENDED_REPLY, _MAX_MSG_LENGTH,
 )
 from paramiko.sftp_attr import SFTPAttributes
+from paramiko.sftp_cache import SFTPCache
 from paramiko.ssh_exception import SSHException
 from paramiko.sftp_file import SFTPFile
+from paramiko.sftp_transfer import (
+    TransferResult, _blocks, _changed_blocks, _local_block_hashes,
+    _remote_block_hashes, _run_requests, _run_transfer, _run_transfers,
+    _settable, _set_local_attrs, _stat, _unchanged, _write_at, _Download,
+    _Progress, _TransferJob, _Transfers, _Upload, _Walker,
+)
 from paramiko.util import ClosingContextManager
 
 
@@ -71,7 +85,7 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
 
     Instances of this class may be used as context managers.
     """
-    def __init__(self, sock):
+    def __init__(self, sock, reader_thread=False):
         """
         Create an SFTP client from an existing `.Channel`.  The channel
         should already have requested the ``"sftp"`` subsystem.
@@ -79,7 +93,16 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         An alternate way to create an SFTP client context is by using
         `from_transport`.
 
+        By default, responses from the server are read by whichever thread
+        is waiting for one, which is fine for a client used by one thread at
+        a time.  With ``reader_thread``, a dedicated thread reads all the
+        responses instead, and hands each one straight to the thread which
+        made the request, so any number of threads can use the client at
+        once without waiting on each other.
+
         :param .Channel sock: an open `.Channel` using the ``"sftp"`` subsystem
+        :param bool reader_thread:
+            whether to read responses in a dedicated thread
 
         :raises:
             `.SSHException` -- if there's an exception while negotiating sftp
@@ -91,8 +114,22 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         # lock for request_number
         self._lock = threading.Lock()
         self._cwd = None
-        # request # -> SFTPFile
+        # request # -> SFTPFile (or Future, or type(None) to ignore it)
         self._expecting = weakref.WeakValueDictionary()
+        # with the reader thread: responses for files (and such), waiting to
+        # be passed on by whichever thread calls _read_response() next, and
+        # how many have been passed on so far
+        self._reader = None
+        self._reader_error = None
+        self._responses = deque()
+        self._dispatched = 0
+        self._cv = threading.Condition(self._lock)
+        # read/write request sizes agreed with the server (None if it didn't
+        # tell us, so `.SFTPFile.MAX_REQUEST_SIZE` applies)
+        self._max_read_size = None
+        self._max_write_size = None
+        # metadata cache (see enable_cache)
+        self._cache = None
         if type(sock) is Channel:
             # override default logger
             transport = self.sock.get_transport()
@@ -104,9 +141,16 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         except EOFError:
             raise SSHException('EOF during negotiation')
         self._log(INFO, "Opened sftp connection (server version %s)", server_version)
+        if 'limits@openssh.com' in self._extensions:
+            self._get_limits()
+        if reader_thread:
+            self._reader = threading.Thread(target=self._run_reader)
+            self._reader.daemon = True
+            self._reader.start()
 
     @classmethod
-    def from_transport(cls, t, window_size=None, max_packet_size=None):
+    def from_transport(cls, t, window_size=None, max_packet_size=None,
+                       reader_thread=False):
         """
         Create an SFTP client channel from an open `.Transport`.
 
@@ -121,6 +165,9 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
             optional window size for the `.SFTPClient` session.
         :param int max_packet_size:
             optional max packet size for the `.SFTPClient` session..
+        :param bool reader_thread:
+            whether to read responses in a dedicated thread (see
+            `.SFTPClient`)
 
         :return:
             a new `.SFTPClient` object, referring to an sftp session (channel)
@@ -132,7 +179,7 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         chan = t.open_session(window_size=window_size,
                               max_packet_size=max_packet_size)
         chan.invoke_subsystem('sftp')
-        return cls(chan)
+        return cls(chan, reader_thread)
 
     def _log(self, level, msg, *args, **kwargs):
         super(SFTPClient, self)._log(level, "[chan %s] " + msg,
@@ -156,6 +203,37 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         """
         return self.sock
 
+    def enable_cache(self, ttl=5.0, max_entries=10000):
+        """
+        Start caching the results of `stat`, `lstat`, `listdir_attr` (and
+        `listdir`) and `normalize`, so that asking again about the same path
+        within ``ttl`` seconds doesn't take a round trip to the server.
+        Listing a folder caches the attributes of its entries too.
+
+        Entries are dropped when this client changes their paths (see
+        `.SFTPCache`); changes made by anyone else only show up once they
+        expire.  So this is meant for read-heavy use where slightly stale
+        metadata is acceptable.  Files opened before the cache was enabled
+        don't invalidate it when written to.
+
+        Cached `.SFTPAttributes` objects are shared between callers, and
+        shouldn't be modified.
+
+        :param float ttl: how many seconds to keep each result for
+        :param int max_entries:
+            how many results to keep, dropping the least recently used first
+        :return:
+            the `.SFTPCache`, which counts its ``hits`` and ``misses``
+        """
+        self._cache = SFTPCache(ttl, max_entries)
+        return self._cache
+
+    def disable_cache(self):
+        """
+        Stop caching metadata, and drop everything cached by `enable_cache`.
+        """
+        self._cache = None
+
     def listdir(self, path='.'):
         """
         Return a list containing the names of the entries in the given
@@ -188,6 +266,11 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         .. versionadded:: 1.2
         """
         path = self._adjust_cwd(path)
+        cache = self._cache
+        if cache is not None:
+            filelist, generation = cache.get('listdir', path)
+            if filelist is not None:
+                return list(filelist)
         self._log(DEBUG, "listdir(%r)", path)
         t, msg = self._request(CMD_OPENDIR, path)
         if t != CMD_HANDLE:
@@ -205,11 +288,13 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
             count = msg.get_int()
             for i in range(count):
                 filename = msg.get_text()
-                longname = msg.get_text()
+                longname = msg.get_string()
                 attr = SFTPAttributes._from_msg(msg, filename, longname)
                 if (filename != '.') and (filename != '..'):
                     filelist.append(attr)
         self._request(CMD_CLOSE, handle)
+        if cache is not None:
+            cache.put_listing(path, list(filelist), generation)
         return filelist
 
     def listdir_iter(self, path='.', read_aheads=10):
@@ -236,23 +321,22 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         handle = msg.get_string()
 
         while True:
-            nums = list()
+            futures = list()
             results = list()
             try:
                 # Send out a bunch of readdir requests so that we can read the responses later
                 # Section 6.7 of the SSH file transfer RFC explains this
                 # http://filezilla-project.org/specs/draft-ietf-secsh-filexfer-02.txt
                 for i in range(read_aheads):
-                    num = self._async_request(type(None), CMD_READDIR, handle)
-                    nums.append(num)
+                    futures.append(self._async_future(CMD_READDIR, handle))
 
                 # need to read whole batch before yielding any
-                for num in nums:
-                    t, msg = self._read_response(num)
+                for future in futures:
+                    t, msg = self._wait_response(future)
                     count = msg.get_int()
                     for i in range(count):
                         filename = msg.get_text()
-                        longname = msg.get_text()
+                        longname = msg.get_string()
                         attr = SFTPAttributes._from_msg(msg, filename, longname)
                         if (filename != '.') and (filename != '..'):
                             results.append(attr)
@@ -266,6 +350,61 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
                     yield a
                 return
 
+    def walk(self, top='.', max_dirs=16, onerror=None):
+        """
+        Generate the listings of a remote directory tree, like `os.walk`.
+
+        For each directory, a 3-tuple ``(dirpath, dirs, files)`` is yielded:
+        ``dirs`` and ``files`` are lists of `.SFTPAttributes` (with their
+        ``filename`` set) for the subdirectories, and for everything else
+        (including symbolic links, which aren't followed), in ``dirpath``.
+        Removing entries from ``dirs`` before resuming the generator prunes
+        those subdirectories from the walk.
+
+        Up to ``max_dirs`` directories are opened and read at once, so
+        listings come in whichever order the server finishes them: a
+        directory always comes before its subdirectories, but otherwise the
+        order isn't defined.  Only directories which have been yielded (and
+        the queue of their subdirectories) are held in memory, not the whole
+        tree.
+
+        :param str top: the remote directory to start from
+        :param int max_dirs: how many directories to read at once
+        :param callable onerror:
+            optional ``func(IOError)``, called for each directory which
+            can't be listed (with the exception's ``filename`` set to the
+            directory).  By default such directories are silently skipped.
+        """
+        self._log(DEBUG, "walk(%r)", top)
+        walker = _Walker(self, max(1, max_dirs))
+        walker.add(top)
+        try:
+            while True:
+                while walker.errors:
+                    path, e = walker.errors.popleft()
+                    if getattr(e, 'filename', False) is None:
+                        e.filename = path
+                    if onerror is not None:
+                        onerror(e)
+                while walker.results:
+                    path, entries = walker.results.popleft()
+                    dirs = [a for a in entries if stat.S_ISDIR(a.st_mode or 0)]
+                    files = [a for a in entries
+                             if not stat.S_ISDIR(a.st_mode or 0)]
+                    yield path, dirs, files
+                    for attr in dirs:
+                        walker.add(posixpath.join(path, attr.filename))
+                    walker.fill()
+                walker.fill()
+                if walker.done:
+                    break
+                self._read_response()
+        finally:
+            # if the caller stopped early, close whatever is still open
+            walker.cancel()
+            while walker.in_flight:
+                self._read_response()
+
     def open(self, filename, mode='r', bufsize=-1):
         """
         Open a file on the remote server.  The arguments are the same as for
@@ -300,22 +439,14 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         """
         filename = self._adjust_cwd(filename)
         self._log(DEBUG, "open(%r, %r)", filename, mode)
-        imode = 0
-        if ('r' in mode) or ('+' in mode):
-            imode |= SFTP_FLAG_READ
-        if ('w' in mode) or ('+' in mode) or ('a' in mode):
-            imode |= SFTP_FLAG_WRITE
-        if 'w' in mode:
-            imode |= SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC
-        if 'a' in mode:
-            imode |= SFTP_FLAG_CREATE | SFTP_FLAG_APPEND
-        if 'x' in mode:
-            imode |= SFTP_FLAG_CREATE | SFTP_FLAG_EXCL
         attrblock = SFTPAttributes()
-        t, msg = self._request(CMD_OPEN, filename, imode, attrblock)
+        flags = _open_flags(mode)
+        t, msg = self._request(CMD_OPEN, filename, flags, attrblock)
         if t != CMD_HANDLE:
             raise SFTPError('Expected handle')
         handle = msg.get_binary()
+        if self._cache is not None:
+            self._cache.opened(handle, filename, flags)
         self._log(DEBUG, "open(%r, %r) -> %s", filename, mode, hexlify(handle).decode())
         return SFTPFile(self, handle, mode, bufsize)
 
@@ -337,6 +468,27 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
 
     unlink = remove
 
+    def remove_many(self, paths, max_concurrent_requests=64):
+        """
+        Remove many files at once.  All the requests are sent without waiting
+        for each other's responses (up to ``max_concurrent_requests`` at a
+        time), so this takes roughly one round trip in total rather than one
+        per file.
+
+        Failures are reported per path, in the results, rather than raised.
+
+        :param list paths: paths of the files to remove
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once
+        :return:
+            a `list` with, for each path in the same order, ``None`` if it was
+            removed, or the exception (usually an ``IOError``) if not
+        """
+        self._log(DEBUG, "remove_many(%d paths)", len(paths))
+        return self._request_many(
+            [(CMD_REMOVE, self._adjust_cwd(path)) for path in paths],
+            max_concurrent_requests)
+
     def rename(self, oldpath, newpath):
         """
         Rename a file or folder from ``oldpath`` to ``newpath``.
@@ -360,6 +512,24 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         self._log(DEBUG, "rename(%r, %r)", oldpath, newpath)
         self._request(CMD_RENAME, oldpath, newpath)
 
+    def rename_many(self, paths, max_concurrent_requests=64):
+        """
+        Rename many files or folders at once, as `remove_many` does for
+        `rename`.  The renames may be carried out in any order.
+
+        :param list paths: ``(oldpath, newpath)`` pairs
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once
+        :return:
+            a `list` with, for each pair in the same order, ``None`` if it was
+            renamed, or the exception if not
+        """
+        self._log(DEBUG, "rename_many(%d paths)", len(paths))
+        return self._request_many(
+            [(CMD_RENAME, self._adjust_cwd(oldpath), self._adjust_cwd(newpath))
+             for oldpath, newpath in paths],
+            max_concurrent_requests)
+
     def posix_rename(self, oldpath, newpath):
         """
         Rename a file or folder from ``oldpath`` to ``newpath``, following
@@ -382,6 +552,44 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
             CMD_EXTENDED, "posix-rename@openssh.com", oldpath, newpath
         )
 
+    def copy(self, remotesrc, remotedst, overwrite=True):
+        """
+        Copy the contents of the file ``remotesrc`` to ``remotedst``, both on
+        the SFTP server (like `shutil.copyfile`: permissions and times aren't
+        copied).
+
+        If the server supports the "copy-file" or "copy-data" extension, the
+        data is copied by the server itself, without being sent over the
+        network.  Otherwise, it's read and written back through this client.
+
+        :param str remotesrc: the existing file to copy
+        :param str remotedst: the file to copy it to
+        :param bool overwrite:
+            whether to replace ``remotedst`` if it already exists
+
+        :raises: ``IOError`` -- if either file can't be opened, or the copy
+            fails
+        """
+        remotesrc = self._adjust_cwd(remotesrc)
+        remotedst = self._adjust_cwd(remotedst)
+        self._log(DEBUG, "copy(%r, %r)", remotesrc, remotedst)
+        if 'copy-file' in self._extensions:
+            self._request(
+                CMD_EXTENDED, 'copy-file', remotesrc, remotedst, overwrite)
+            return
+        with self.open(remotesrc, 'rb') as fr:
+            with self.open(remotedst, 'wb' if overwrite else 'xb') as fw:
+                if 'copy-data' in self._extensions:
+                    fr.copy_data(fw)
+                    return
+                fr.prefetch()
+                fw.set_pipelined(True)
+                while True:
+                    data = fr.read(32768)
+                    if not data:
+                        break
+                    fw.write(data)
+
     def mkdir(self, path, mode=o777):
         """
         Create a folder (directory) named ``path`` with numeric mode ``mode``.
@@ -426,7 +634,9 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
             an `.SFTPAttributes` object containing attributes about the given
             file
         """
-        path = self._adjust_cwd(path)
+        return self._cached('stat', self._adjust_cwd(path), self._stat)
+
+    def _stat(self, path):
         self._log(DEBUG, "stat(%r)", path)
         t, msg = self._request(CMD_STAT, path)
         if t != CMD_ATTRS:
@@ -444,13 +654,44 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
             an `.SFTPAttributes` object containing attributes about the given
             file
         """
-        path = self._adjust_cwd(path)
+        return self._cached('lstat', self._adjust_cwd(path), self._lstat)
+
+    def _lstat(self, path):
         self._log(DEBUG, "lstat(%r)", path)
         t, msg = self._request(CMD_LSTAT, path)
         if t != CMD_ATTRS:
             raise SFTPError('Expected attributes')
         return SFTPAttributes._from_msg(msg)
 
+    def stat_many(self, paths, max_concurrent_requests=64):
+        """
+        Retrieve information about many files at once, as `remove_many` does
+        for `stat`.
+
+        :param list paths: the filenames to stat
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once
+        :return:
+            a `list` with, for each path in the same order, an
+            `.SFTPAttributes` object, or the exception (usually an
+            ``IOError``) if the file couldn't be stat'd
+        """
+        self._log(DEBUG, "stat_many(%d paths)", len(paths))
+        return self._request_many(
+            [(CMD_STAT, self._adjust_cwd(path)) for path in paths],
+            max_concurrent_requests, attrs=True)
+
+    def lstat_many(self, paths, max_concurrent_requests=64):
+        """
+        Retrieve information about many files at once, without following
+        symbolic links.  This otherwise behaves exactly the same as
+        `stat_many`.
+        """
+        self._log(DEBUG, "lstat_many(%d paths)", len(paths))
+        return self._request_many(
+            [(CMD_LSTAT, self._adjust_cwd(path)) for path in paths],
+            max_concurrent_requests, attrs=True)
+
     def symlink(self, source, dest):
         """
         Create a symbolic link to the ``source`` path at ``destination``.
@@ -478,6 +719,26 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         attr.st_mode = mode
         self._request(CMD_SETSTAT, path, attr)
 
+    def chmod_many(self, modes, max_concurrent_requests=64):
+        """
+        Change the mode (permissions) of many files at once, as `remove_many`
+        does for `chmod`.
+
+        :param list modes: ``(path, mode)`` pairs
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once
+        :return:
+            a `list` with, for each pair in the same order, ``None`` if the
+            mode was changed, or the exception if not
+        """
+        self._log(DEBUG, "chmod_many(%d paths)", len(modes))
+        requests = []
+        for path, mode in modes:
+            attr = SFTPAttributes()
+            attr.st_mode = mode
+            requests.append((CMD_SETSTAT, self._adjust_cwd(path), attr))
+        return self._request_many(requests, max_concurrent_requests)
+
     def chown(self, path, uid, gid):
         """
         Change the owner (``uid``) and group (``gid``) of a file.  As with
@@ -565,7 +826,10 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
 
         :raises: ``IOError`` -- if the path can't be resolved on the server
         """
-        path = self._adjust_cwd(path)
+        return self._cached(
+            'normalize', self._adjust_cwd(path), self._normalize)
+
+    def _normalize(self, path):
         self._log(DEBUG, "normalize(%r)", path)
         t, msg = self._request(CMD_REALPATH, path)
         if t != CMD_NAME:
@@ -612,10 +876,11 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         # TODO: make class initialize with self._cwd set to self.normalize('.')
         return self._cwd and u(self._cwd)
 
-    def _transfer_with_callback(self, reader, writer, file_size, callback):
+    def _transfer_with_callback(self, reader, writer, file_size, callback,
+                                chunk_size=32768):
         size = 0
         while True:
-            data = reader.read(32768)
+            data = reader.read(chunk_size)
             writer.write(data)
             size += len(data)
             if len(data) == 0:
@@ -624,13 +889,15 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
                 callback(size, file_size)
         return size
 
-    def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True):
+    def putfo(self, fl, remotepath, file_size=0, callback=None, confirm=True,
+              max_concurrent_requests=None):
         """
         Copy the contents of an open file object (``fl``) to the SFTP server as
         ``remotepath``. Any exception raised by operations will be passed
         through.
 
-        The SFTP operations use pipelining for speed.
+        The SFTP operations use pipelining for speed (see
+        `.SFTPFile.set_pipelined`).
 
         :param fl: opened file or file-like object to copy
         :param str remotepath: the destination path on the SFTP server
@@ -644,6 +911,8 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         :param bool confirm:
             whether to do a stat() on the file afterwards to confirm the file
             size (since 1.7.7)
+        :param int max_concurrent_requests:
+            how many writes may await acknowledgement at once
 
         :return:
             an `.SFTPAttributes` object containing attributes about the given
@@ -652,10 +921,14 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         .. versionadded:: 1.10
         """
         with self.file(remotepath, 'wb') as fr:
-            fr.set_pipelined(True)
+            fr.set_pipelined(True, max_concurrent_requests)
             size = self._transfer_with_callback(
-                reader=fl, writer=fr, file_size=file_size, callback=callback
+                reader=fl, writer=fr, file_size=file_size, callback=callback,
+                chunk_size=fr._write_size,
             )
+        return self._confirm_put(remotepath, size, confirm)
+
+    def _confirm_put(self, remotepath, size, confirm):
         if confirm:
             try:
                 s = self.stat(remotepath)
@@ -673,13 +946,15 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
             s = SFTPAttributes()
         return s
 
-    def put(self, localpath, remotepath, callback=None, confirm=True):
+    def put(self, localpath, remotepath, callback=None, confirm=True,
+            max_concurrent_requests=None):
         """
         Copy a local file (``localpath``) to the SFTP server as ``remotepath``.
         Any exception raised by operations will be passed through.  This
         method is primarily provided as a convenience.
 
-        The SFTP operations use pipelining for speed.
+        The SFTP operations use pipelining for speed.  The local file is
+        memory-mapped where possible, and sent straight from the mapping.
 
         :param str localpath: the local file to copy
         :param str remotepath: the destination path on the SFTP server. Note
@@ -691,6 +966,8 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         :param bool confirm:
             whether to do a stat() on the file afterwards to confirm the file
             size
+        :param int max_concurrent_requests:
+            how many writes may await acknowledgement at once
 
         :return: an `.SFTPAttributes` object containing attributes about the
             given file
@@ -703,9 +980,13 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         """
         file_size = os.stat(localpath).st_size
         with open(localpath, 'rb') as fl:
-            return self.putfo(fl, remotepath, file_size, callback, confirm)
+            with self.file(remotepath, 'wb') as fr:
+                size = self._upload(fr, fl, file_size, callback,
+                                    max_concurrent_requests)
+        return self._confirm_put(remotepath, size, confirm)
 
-    def getfo(self, remotepath, fl, callback=None):
+    def getfo(self, remotepath, fl, callback=None,
+              max_concurrent_prefetch_requests=None):
         """
         Copy a remote file (``remotepath``) from the SFTP server and write to
         an open file or file-like object, ``fl``.  Any exception raised by
@@ -717,63 +998,614 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         :param callable callback:
             optional callback function (form: ``func(int, int)``) that accepts
             the bytes transferred so far and the total bytes to be transferred
+        :param int max_concurrent_prefetch_requests:
+            the number of read requests to keep ahead of the transfer (see
+            `.SFTPFile.prefetch`)
         :return: the `number <int>` of bytes written to the opened file object
 
         .. versionadded:: 1.10
         """
         file_size = self.stat(remotepath).st_size
         with self.open(remotepath, 'rb') as fr:
-            fr.prefetch(file_size)
+            fr.prefetch(file_size, max_concurrent_prefetch_requests)
             return self._transfer_with_callback(
-                reader=fr, writer=fl, file_size=file_size, callback=callback
+                reader=fr, writer=fl, file_size=file_size, callback=callback,
+                chunk_size=fr._read_size,
             )
 
-    def get(self, remotepath, localpath, callback=None):
+    def get(self, remotepath, localpath, callback=None,
+            max_concurrent_prefetch_requests=None):
         """
         Copy a remote file (``remotepath``) from the SFTP server to the local
         host as ``localpath``.  Any exception raised by operations will be
         passed through.  This method is primarily provided as a convenience.
 
+        A window of read requests is kept in flight, and each chunk is written
+        to its place in ``localpath`` as soon as it arrives (whatever the order
+        of the responses), so memory use doesn't depend on the file size.
+
         :param str remotepath: the remote file to copy
         :param str localpath: the destination path on the local host
         :param callable callback:
             optional callback function (form: ``func(int, int)``) that accepts
             the bytes transferred so far and the total bytes to be transferred
+        :param int max_concurrent_prefetch_requests:
+            the number of read requests to keep in flight (default
+            `.SFTPFile.MAX_PREFETCH_REQUESTS`)
 
         .. versionadded:: 1.4
         .. versionchanged:: 1.7.4
             Added the ``callback`` param
         """
+        file_size = self.stat(remotepath).st_size
         with open(localpath, 'wb') as fl:
-            size = self.getfo(remotepath, fl, callback)
+            with self.open(remotepath, 'rb') as fr:
+                size = self._download(fr, fl.fileno(), file_size, callback,
+                                      max_concurrent_prefetch_requests)
         s = os.stat(localpath)
         if s.st_size != size:
             raise IOError(
                 'size mismatch in get!  {} != {}'.format(s.st_size, size))
 
+    def sync_put(self, localpath, remotepath, block_size=65536, callback=None,
+                 confirm=True):
+        """
+        Update ``remotepath`` on the SFTP server to match ``localpath``,
+        sending only the blocks which differ.
+
+        Each ``block_size`` bytes of the two files are compared by hash (using
+        the "check-file" extension on the remote file); the blocks which
+        differ, and any beyond the end of the remote file, are written in
+        place, and the remote file is truncated if it's longer.  If the remote
+        file doesn't exist yet, or the server doesn't support "check-file",
+        this does a full `put` instead.
+
+        :param str localpath: the local file to copy
+        :param str remotepath: the destination path on the SFTP server
+        :param int block_size:
+            the size of the blocks to compare (at least 256)
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``) that accepts
+            the bytes sent so far and the total bytes to be sent
+        :param bool confirm:
+            whether to do a stat() on the file afterwards to confirm the file
+            size
+
+        :return: an `.SFTPAttributes` object containing attributes about the
+            given file
+        """
+        algorithm = self._check_file_algorithm()
+        fr = None
+        if algorithm is not None:
+            try:
+                fr = self.open(remotepath, 'r+b')
+            except IOError:
+                pass
+        if fr is None:
+            return self.put(localpath, remotepath, callback, confirm)
+
+        self._log(DEBUG, "sync_put(%r, %r)", localpath, remotepath)
+        with fr:
+            with open(localpath, 'rb') as fl:
+                size = os.fstat(fl.fileno()).st_size
+                remote_size = fr.stat().st_size
+                common = min(size, remote_size)
+                blocks = self._diff_blocks(
+                    fr, fl, algorithm, common, block_size)
+                blocks += _blocks(common, size, block_size)
+                total = sum(length for offset, length in blocks)
+                sent = 0
+                fr.set_pipelined(True)
+                for offset, length in blocks:
+                    fl.seek(offset)
+                    fr.seek(offset)
+                    fr.write(fl.read(length))
+                    sent += length
+                    if callback is not None:
+                        callback(sent, total)
+                if remote_size > size:
+                    fr.truncate(size)
+        return self._confirm_put(remotepath, size, confirm)
+
+    def sync_get(self, remotepath, localpath, block_size=65536,
+                 callback=None):
+        """
+        Update ``localpath`` to match ``remotepath`` on the SFTP server,
+        fetching only the blocks which differ.  This works like `sync_put`,
+        the other way around: if the local file doesn't exist yet, or the
+        server doesn't support "check-file", this does a full `get` instead.
+
+        :param str remotepath: the remote file to copy
+        :param str localpath: the destination path on the local host
+        :param int block_size:
+            the size of the blocks to compare (at least 256)
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``) that accepts
+            the bytes received so far and the total bytes to be received
+        """
+        algorithm = self._check_file_algorithm()
+        if algorithm is None or not os.path.isfile(localpath):
+            return self.get(remotepath, localpath, callback)
+
+        self._log(DEBUG, "sync_get(%r, %r)", remotepath, localpath)
+        with self.open(remotepath, 'rb') as fr:
+            with open(localpath, 'r+b') as fl:
+                size = os.fstat(fl.fileno()).st_size
+                remote_size = fr.stat().st_size
+                common = min(size, remote_size)
+                blocks = self._diff_blocks(
+                    fr, fl, algorithm, common, block_size)
+                blocks += _blocks(common, remote_size, block_size)
+                total = sum(length for offset, length in blocks)
+                received = 0
+                if blocks:
+                    for (offset, length), data in zip(blocks, fr.readv(blocks)):
+                        _write_at(fl.fileno(), data, offset)
+                        received += len(data)
+                        if callback is not None:
+                            callback(received, total)
+                if size > remote_size:
+                    fl.truncate(remote_size)
+        s = os.stat(localpath)
+        if s.st_size != remote_size:
+            raise IOError('size mismatch in get!  {} != {}'.format(
+                s.st_size, remote_size))
+
+    def get_many(self, paths, max_files=16, max_concurrent_requests=None,
+                 callback=None):
+        """
+        Copy many remote files from the SFTP server to the local host at once.
+
+        Up to ``max_files`` files are open at a time, and the requests for all
+        of them (opening, reading and closing) are interleaved on this
+        session, with at most ``max_concurrent_requests`` awaiting a response.
+        So for many small files, the cost is bounded by bandwidth rather than
+        by several round trips per file.  Each file is downloaded as by `get`.
+
+        Failures are reported per file, in the results, rather than raised.
+
+        :param list paths: ``(remotepath, localpath)`` pairs to copy
+        :param int max_files: how many files to work on at once
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once, for all the files
+            together (default `.SFTPFile.MAX_PREFETCH_REQUESTS`)
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``) that accepts
+            the bytes transferred so far, for all files, and the total bytes to
+            be transferred (which grows as the sizes of the files opened so
+            far become known)
+        :return:
+            a `list` of `.TransferResult`, in the same order as ``paths``
+        """
+        return self._transfer_many(
+            [TransferResult(remotepath, localpath)
+             for remotepath, localpath in paths],
+            False, max_files, max_concurrent_requests, callback)
+
+    def put_many(self, paths, max_files=16, max_concurrent_requests=None,
+                 callback=None):
+        """
+        Copy many local files to the SFTP server at once.
+
+        Up to ``max_files`` files are open at a time, and the requests for all
+        of them (opening, writing and closing) are interleaved on this
+        session, with at most ``max_concurrent_requests`` awaiting a response.
+        Each file is uploaded as by `put` (without the ``confirm`` check; the
+        server's acknowledgement of every write and of the close is checked).
+
+        Failures are reported per file, in the results, rather than raised.
+
+        :param list paths: ``(localpath, remotepath)`` pairs to copy
+        :param int max_files: how many files to work on at once
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once, for all the files
+            together (default `.SFTPFile.MAX_PIPELINED_REQUESTS`)
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``) that accepts
+            the bytes transferred so far, for all files, and the total bytes to
+            be transferred (which grows as the local files are opened)
+        :return:
+            a `list` of `.TransferResult`, in the same order as ``paths``
+        """
+        return self._transfer_many(
+            [TransferResult(remotepath, localpath)
+             for localpath, remotepath in paths],
+            True, max_files, max_concurrent_requests, callback)
+
+    def get_tree(self, remotepath, localpath, preserve=False,
+                 skip_unchanged=False, max_files=16,
+                 max_concurrent_requests=None, callback=None):
+        """
+        Copy a remote directory tree to the local host, creating
+        ``localpath`` (and any missing directories below it) as needed.
+
+        Several directories are listed at once, and files are downloaded as
+        soon as they're found (as by `get_many`), with the requests for all of
+        them interleaved on this session.  Symbolic links and special files
+        are skipped.
+
+        Failures are reported per file, or per directory which couldn't be
+        listed or created, in the results, rather than raised.
+
+        :param str remotepath: the remote directory to copy
+        :param str localpath: the local directory to copy it into
+        :param bool preserve:
+            whether to give the copies the permissions and access and
+            modification times of the originals
+        :param bool skip_unchanged:
+            whether to leave alone local files which have the same size and
+            modification time (to the second) as the remote file
+        :param int max_files:
+            how many files to work on, and how many directories to list, at
+            once
+        :param int max_concurrent_requests:
+            how many file requests may be in flight at once
+            (default `.SFTPFile.MAX_PREFETCH_REQUESTS`)
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``), as for
+            `get_many`
+        :return:
+            a `list` of `.TransferResult`, one for each file copied and each
+            directory that failed
+
+        :raises: ``IOError`` -- if ``remotepath`` can't be listed
+        """
+        if max_concurrent_requests is None:
+            max_concurrent_requests = SFTPFile.MAX_PREFETCH_REQUESTS
+        max_files = max(1, max_files)
+        max_concurrent_requests = max(1, max_concurrent_requests)
+        self._log(DEBUG, "get_tree(%r, %r)", remotepath, localpath)
+        if not os.path.isdir(localpath):
+            os.makedirs(localpath)
+        results = []
+        dirs = []  # (local path, SFTPAttributes) of each directory below
+        localdirs = {remotepath: localpath}  # for directories being listed
+        walker = _Walker(self, max_files)
+        walker.add(remotepath)
+        transfers = _Transfers(max_files, max_concurrent_requests, callback)
+
+        while True:
+            while walker.errors:
+                path, e = walker.errors.popleft()
+                if path == remotepath:
+                    raise e
+                result = TransferResult(path, localdirs.pop(path))
+                result.exception = e
+                results.append(result)
+            while walker.results:
+                path, entries = walker.results.popleft()
+                localdir = localdirs.pop(path)
+                for attr in entries:
+                    rpath = posixpath.join(path, attr.filename)
+                    lpath = os.path.join(localdir, attr.filename)
+                    mode = attr.st_mode or 0
+                    if stat.S_ISDIR(mode):
+                        try:
+                            if not os.path.isdir(lpath):
+                                os.mkdir(lpath)
+                        except OSError as e:
+                            result = TransferResult(rpath, lpath)
+                            result.exception = e
+                            results.append(result)
+                            continue
+                        localdirs[rpath] = lpath
+                        walker.add(rpath)
+                        dirs.append((lpath, attr))
+                    elif stat.S_ISREG(mode):
+                        if skip_unchanged and _unchanged(_stat(lpath), attr):
+                            continue
+                        result = TransferResult(rpath, lpath)
+                        results.append(result)
+                        transfers.add(_TransferJob(
+                            self, result, False, max_concurrent_requests,
+                            attr if preserve else None))
+            walker.fill()
+            transfers.fill()
+            if walker.done and transfers.done:
+                break
+            self._read_response()
+
+        if preserve:
+            # after everything inside them is written, deepest first
+            for lpath, attr in reversed(dirs):
+                try:
+                    _set_local_attrs(lpath, attr)
+                except EnvironmentError as e:
+                    result = TransferResult(None, lpath)
+                    result.exception = e
+                    results.append(result)
+        return results
+
+    def put_tree(self, localpath, remotepath, preserve=False,
+                 skip_unchanged=False, max_files=16,
+                 max_concurrent_requests=None, callback=None):
+        """
+        Copy a local directory tree to the SFTP server, creating
+        ``remotepath`` (and any missing directories below it) as needed.
+
+        The remote directories are created a level at a time, with all the
+        ``mkdir`` requests for a level sent at once; then the files are
+        uploaded as by `put_many`.  Symbolic links and special files are
+        skipped.  Errors creating directories are ignored (most likely they
+        already exist), but would show up as failures to upload the files in
+        them.
+
+        :param str localpath: the local directory to copy
+        :param str remotepath: the remote directory to copy it into
+        :param bool preserve:
+            whether to give the copies the permissions and access and
+            modification times of the originals
+        :param bool skip_unchanged:
+            whether to leave alone remote files which have the same size and
+            modification time (to the second) as the local file.  The remote
+            tree is listed first, to find them.
+        :param int max_files:
+            how many files to work on, and how many directories to list, at
+            once
+        :param int max_concurrent_requests:
+            how many requests may be in flight at once
+            (default `.SFTPFile.MAX_PIPELINED_REQUESTS`)
+        :param callable callback:
+            optional callback function (form: ``func(int, int)``), as for
+            `put_many`
+        :return:
+            a `list` of `.TransferResult`, one for each file copied and each
+            directory that failed
+
+        :raises: ``OSError`` -- if ``localpath`` can't be listed
+        """
+        if max_concurrent_requests is None:
+            max_concurrent_requests = SFTPFile.MAX_PIPELINED_REQUESTS
+        max_files = max(1, max_files)
+        max_concurrent_requests = max(1, max_concurrent_requests)
+        self._log(DEBUG, "put_tree(%r, %r)", localpath, remotepath)
+        results = []
+        levels = [[(localpath, remotepath, os.stat(localpath))]]
+        files = []  # (local path, remote path, os.stat result)
+
+        def remote(path):
+            rel = os.path.relpath(path, localpath)
+            return posixpath.join(remotepath, *rel.split(os.sep))
+
+        def onerror(e):
+            result = TransferResult(remote(e.filename), e.filename)
+            result.exception = e
+            results.append(result)
+
+        for root, dirnames, filenames in os.walk(localpath, onerror=onerror):
+            depth = len(os.path.relpath(root, localpath).split(os.sep))
+            if root == localpath:
+                depth = 0
+            subdirs = []
+            for name in dirnames + filenames:
+                lpath = os.path.join(root, name)
+                try:
+                    st = os.lstat(lpath)
+                except OSError as e:
+                    onerror(e)
+                    continue
+                if stat.S_ISDIR(st.st_mode):
+                    subdirs.append(name)
+                    while len(levels) <= depth + 1:
+                        levels.append([])
+                    levels[depth + 1].append((lpath, remote(lpath), st))
+                elif stat.S_ISREG(st.st_mode):
+                    files.append((lpath, remote(lpath), st))
+            # don't follow symbolic links to directories
+            dirnames[:] = subdirs
+
+        existing = {}  # remote path -> SFTPAttributes
+        if skip_unchanged:
+            for path, subdirs, entries in self.walk(remotepath, max_files):
+                for attr in subdirs + entries:
+                    existing[posixpath.join(path, attr.filename)] = attr
+
+        for level in levels:
+            _run_requests(self, [
+                (CMD_MKDIR, self._adjust_cwd(rpath), SFTPAttributes())
+                for lpath, rpath, st in level
+                if rpath not in existing
+            ], max_concurrent_requests)
+
+        jobs = []
+        for lpath, rpath, st in files:
+            if skip_unchanged and _unchanged(st, existing.get(rpath)):
+                continue
+            result = TransferResult(rpath, lpath)
+            results.append(result)
+            attrs = SFTPAttributes.from_stat(st) if preserve else None
+            jobs.append(_TransferJob(
+                self, result, True, max_concurrent_requests, attrs))
+        _run_transfers(self, jobs, max_files, max_concurrent_requests,
+                       callback)
+
+        if preserve:
+            dirs = [d for level in levels for d in level]
+            responses = _run_requests(self, [
+                (CMD_SETSTAT, self._adjust_cwd(rpath),
+                 _settable(SFTPAttributes.from_stat(st)))
+                for lpath, rpath, st in dirs
+            ], max_concurrent_requests)
+            for (lpath, rpath, st), response in zip(dirs, responses):
+                if isinstance(response, Exception):
+                    result = TransferResult(rpath, lpath)
+                    result.exception = response
+                    results.append(result)
+        return results
+
     # ...internals...
 
+    def _check_file_algorithm(self):
+        """
+        the hash to compare files with, using the "check-file" extension, or
+        ``None`` if the server doesn't offer a suitable one
+        """
+        offered = self._extensions.get('check-file')
+        if offered is None:
+            return None
+        offered = u(offered).split(',')
+        for algorithm in ('sha256', 'sha1', 'md5'):
+            if algorithm not in offered:
+                continue
+            try:
+                hashlib.new(algorithm)
+            except ValueError:
+                # not available locally (e.g. md5 in FIPS mode)
+                continue
+            return algorithm
+        return None
+
+    def _diff_blocks(self, fr, fl, algorithm, length, block_size):
+        """
+        the blocks, up to ``length``, which differ between the remote file
+        ``fr`` and the local file ``fl``
+        """
+        if not length:
+            return []
+        try:
+            remote = _remote_block_hashes(
+                self, fr.handle, algorithm, length, block_size,
+                SFTPFile.MAX_PIPELINED_REQUESTS)
+        except IOError:
+            # the server couldn't hash it after all: copy everything
+            remote = []
+        local = _local_block_hashes(fl, algorithm, length, block_size)
+        return _changed_blocks(local, remote, length, block_size)
+
+    def _request_many(self, requests, max_concurrent_requests, attrs=False):
+        """
+        Send ``requests`` (tuples of a request type and its arguments) as by
+        `_run_requests`.  For each, return the exception it failed with; or if
+        it succeeded, its `.SFTPAttributes` if ``attrs`` is true, otherwise
+        ``None``.
+        """
+        results = []
+        responses = _run_requests(
+            self, requests, max(1, max_concurrent_requests))
+        for response in responses:
+            if isinstance(response, Exception):
+                results.append(response)
+            elif not attrs:
+                results.append(None)
+            elif response[0] != CMD_ATTRS:
+                results.append(SFTPError('Expected attributes'))
+            else:
+                results.append(SFTPAttributes._from_msg(response[1]))
+        return results
+
+    def _transfer_many(self, results, upload, max_files,
+                       max_concurrent_requests, callback):
+        if max_concurrent_requests is None:
+            if upload:
+                max_concurrent_requests = SFTPFile.MAX_PIPELINED_REQUESTS
+            else:
+                max_concurrent_requests = SFTPFile.MAX_PREFETCH_REQUESTS
+        self._log(DEBUG, "%s_many(%d files)", 'put' if upload else 'get',
+                  len(results))
+        jobs = [_TransferJob(self, result, upload, max_concurrent_requests)
+                for result in results]
+        _run_transfers(self, jobs, max(1, max_files),
+                      max(1, max_concurrent_requests), callback)
+        return results
+
+    def _download(self, fr, fd, file_size, callback=None,
+                  max_concurrent_requests=None):
+        """
+        Copy the open remote file ``fr`` into the local file descriptor
+        ``fd``, returning the number of bytes copied.
+        """
+        if max_concurrent_requests is None:
+            max_concurrent_requests = SFTPFile.MAX_PREFETCH_REQUESTS
+        progress = _Progress(callback)
+        progress.expect(file_size)
+        return _run_transfer(self, _Download(
+            self, fr.handle, fd, file_size, max_concurrent_requests,
+            fr._read_size, progress))
+
+    def _upload(self, fr, fl, file_size, callback=None,
+                max_concurrent_requests=None):
+        """
+        Copy the local file ``fl`` into the open remote file ``fr``, returning
+        the number of bytes copied.
+        """
+        try:
+            data = mmap.mmap(fl.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            # empty, or not a regular file
+            fr.set_pipelined(True, max_concurrent_requests)
+            return self._transfer_with_callback(
+                reader=fl, writer=fr, file_size=file_size, callback=callback,
+                chunk_size=fr._write_size,
+            )
+        if max_concurrent_requests is None:
+            max_concurrent_requests = SFTPFile.MAX_PIPELINED_REQUESTS
+        try:
+            try:
+                view = memoryview(data)
+            except TypeError:
+                # python 2 can't make a memoryview of an mmap
+                view = data
+            progress = _Progress(callback)
+            progress.expect(len(view))
+            return _run_transfer(self, _Upload(
+                self, fr.handle, view, max_concurrent_requests,
+                fr._write_size, progress))
+        finally:
+            view = None
+            try:
+                data.close()
+            except BufferError:
+                # a slice is still referenced somewhere; the garbage
+                # collector will unmap it
+                pass
+
+    def _get_limits(self):
+        """
+        Ask the server for its read and write length limits, so that larger
+        requests than the traditional 32kB can be used.
+        """
+        try:
+            t, msg = self._request(CMD_EXTENDED, 'limits@openssh.com')
+        except (IOError, SFTPError):
+            return
+        if t != CMD_EXTENDED_REPLY:
+            return
+        self._max_read_size, self._max_write_size = _parse_limits(msg)
+        self._log(DEBUG, "Server limits: read %s, write %s",
+                  self._max_read_size, self._max_write_size)
+
+    def _cached(self, kind, path, fetch):
+        """
+        return ``fetch(path)``, or its cached result if the cache is enabled
+        and has one
+        """
+        cache = self._cache
+        if cache is None:
+            return fetch(path)
+        value, generation = cache.get(kind, path)
+        if value is None:
+            value = fetch(path)
+            cache.put(kind, path, value, generation)
+        return value
+
     def _request(self, t, *arg):
-        num = self._async_request(type(None), t, *arg)
-        return self._read_response(num)
+        return self._wait_response(self._async_future(t, *arg))
+
+    def _async_future(self, t, *arg):
+        """send a request, and return a `Future` of its ``(type, msg)``"""
+        future = Future()
+        self._async_request(future, t, *arg)
+        return future
 
     def _async_request(self, fileobj, t, *arg):
         # this method may be called from other threads (prefetch)
+        if self._cache is not None:
+            self._cache.request(t, arg)
         self._lock.acquire()
         try:
-            msg = Message()
-            msg.add_int(self.request_number)
-            for item in arg:
-                if isinstance(item, long):
-                    msg.add_int64(item)
-                elif isinstance(item, int):
-                    msg.add_int(item)
-                elif isinstance(item, SFTPAttributes):
-                    item._pack(msg)
-                else:
-                    # For all other types, rely on as_string() to either coerce
-                    # to bytes before writing or raise a suitable exception.
-                    msg.add_string(item)
+            if self._reader_error is not None:
+                raise self._reader_error
+            msg = _request_message(self.request_number, arg)
             num = self.request_number
             self._expecting[num] = fileobj
             self.request_number += 1
@@ -782,65 +1614,126 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         self._send_packet(t, msg)
         return num
 
-    def _read_response(self, waitfor=None):
-        while True:
-            try:
-                t, data = self._read_packet()
-            except EOFError as e:
-                raise SSHException('Server connection dropped: {}'.format(e))
-            msg = Message(data)
-            num = msg.get_int()
-            self._lock.acquire()
+    def _wait_response(self, future):
+        """
+        wait for the response to a request sent with `_async_future`, and
+        return it (raising the error, if it's an error status)
+        """
+        if self._reader is None:
+            while not future.done():
+                self._read_response()
+            t, msg = future.result()
+        else:
             try:
-                if num not in self._expecting:
-                    # might be response for a file that was closed before
-                    # responses came back
-                    self._log(DEBUG, "Unexpected response #%s", num)
-                    if waitfor is None:
-                        # just doing a single check
-                        break
+                t, msg = future.result(self.sock.gettimeout())
+            except FutureTimeout:
+                raise socket.timeout()
+        if t == CMD_STATUS:
+            self._convert_status(msg)
+        return t, msg
+
+    def _read_response(self):
+        """
+        Read one response, and pass it on to whatever is waiting for it.  With
+        the reader thread, wait until a response (for a file or such) can be
+        passed on, or another thread has passed one on.
+        """
+        if self._reader is not None:
+            self._dispatch_response()
+            return
+        try:
+            t, data = self._read_packet()
+        except EOFError as e:
+            raise SSHException('Server connection dropped: {}'.format(e))
+        msg = Message(data)
+        num = msg.get_int()
+        with self._lock:
+            fileobj = self._expecting.pop(num, None)
+        if fileobj is None:
+            # might be response for a file that was closed before
+            # responses came back
+            self._log(DEBUG, "Unexpected response #%s", num)
+        elif isinstance(fileobj, Future):
+            _resolve(fileobj, (t, msg))
+        # can not rewrite this to deal with E721
+        elif fileobj is not type(None):  # noqa: E721
+            fileobj._async_response(t, msg, num)
+
+    def _dispatch_response(self):
+        timeout = self.sock.gettimeout()
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._cv:
+            dispatched = self._dispatched
+            while not self._responses and self._dispatched == dispatched:
+                if self._reader_error is not None:
+                    raise self._reader_error
+                if timeout is None:
+                    self._cv.wait()
                     continue
-                fileobj = self._expecting[num]
-                del self._expecting[num]
-            finally:
-                self._lock.release()
-            if num == waitfor:
-                # synchronous
-                if t == CMD_STATUS:
-                    self._convert_status(msg)
-                return t, msg
-
-            # can not rewrite this to deal with E721
-            if fileobj is not type(None):  # noqa: E721
-                fileobj._async_response(t, msg, num)
-            if waitfor is None:
-                # just doing a single check
-                break
-        return None, None
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise socket.timeout()
+                self._cv.wait(remaining)
+            if not self._responses:
+                # another thread passed one on, maybe the one we wanted
+                return
+            fileobj, t, msg, num = self._responses.popleft()
+        try:
+            fileobj._async_response(t, msg, num)
+        finally:
+            with self._cv:
+                # only now, so anyone waiting for this file's responses to be
+                # finished doesn't stop waiting too soon
+                if self._expecting.get(num) is fileobj:
+                    del self._expecting[num]
+                self._dispatched += 1
+                self._cv.notify_all()
+
+    def _run_reader(self):
+        """
+        the reader thread: resolve each request's `Future`, or queue the
+        response for its file
+        """
+        try:
+            while True:
+                # the channel's timeout is for those waiting for responses
+                t, data = self._read_packet(wait=True)
+                msg = Message(data)
+                num = msg.get_int()
+                with self._cv:
+                    fileobj = self._expecting.get(num)
+                    if fileobj is None:
+                        self._log(DEBUG, "Unexpected response #%s", num)
+                        continue
+                    if not isinstance(fileobj, Future) and \
+                            fileobj is not type(None):  # noqa: E721
+                        self._responses.append((fileobj, t, msg, num))
+                        self._cv.notify_all()
+                        continue
+                    del self._expecting[num]
+                if isinstance(fileobj, Future):
+                    _resolve(fileobj, (t, msg))
+        except Exception as e:
+            if isinstance(e, EOFError):
+                e = SSHException('Server connection dropped: {}'.format(e))
+            self._log(DEBUG, "Response reader stopped: %r", e)
+            with self._cv:
+                self._reader_error = e
+                futures = [f for f in self._expecting.values()
+                           if isinstance(f, Future)]
+                self._cv.notify_all()
+            for future in futures:
+                _resolve(future, exception=e)
 
     def _finish_responses(self, fileobj):
-        while fileobj in self._expecting.values():
+        while True:
+            with self._lock:
+                if fileobj not in self._expecting.values():
+                    break
             self._read_response()
             fileobj._check_exception()
 
-    def _convert_status(self, msg):
-        """
-        Raises EOFError or IOError on error status; otherwise does nothing.
-        """
-        code = msg.get_int()
-        text = msg.get_text()
-        if code == SFTP_OK:
-            return
-        elif code == SFTP_EOF:
-            raise EOFError(text)
-        elif code == SFTP_NO_SUCH_FILE:
-            # clever idea from john a. meinel: map the error codes to errno
-            raise IOError(errno.ENOENT, text)
-        elif code == SFTP_PERMISSION_DENIED:
-            raise IOError(errno.EACCES, text)
-        else:
-            raise IOError(text)
-
     def _adjust_cwd(self, path):
         """
         Return an adjusted path if we're emulating a "current working
@@ -857,6 +1750,69 @@ class SFTPClient(BaseSFTP, ClosingContextManager):
         return self._cwd + b_slash + path
 
 
+def _open_flags(mode):
+    """the SFTP open flags for a Python-style file ``mode``"""
+    imode = 0
+    if ('r' in mode) or ('+' in mode):
+        imode |= SFTP_FLAG_READ
+    if ('w' in mode) or ('+' in mode) or ('a' in mode):
+        imode |= SFTP_FLAG_WRITE
+    if 'w' in mode:
+        imode |= SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC
+    if 'a' in mode:
+        imode |= SFTP_FLAG_CREATE | SFTP_FLAG_APPEND
+    if 'x' in mode:
+        imode |= SFTP_FLAG_CREATE | SFTP_FLAG_EXCL
+    return imode
+
+
+def _request_message(num, args):
+    msg = Message()
+    msg.add_int(num)
+    for item in args:
+        if isinstance(item, bool):
+            msg.add_boolean(item)
+        elif isinstance(item, long):
+            msg.add_int64(item)
+        elif isinstance(item, int):
+            msg.add_int(item)
+        elif isinstance(item, SFTPAttributes):
+            item._pack(msg)
+        else:
+            # For all other types, rely on as_string() to either coerce
+            # to bytes before writing or raise a suitable exception.
+            msg.add_string(item)
+    return msg
+
+
+def _parse_limits(msg):
+    """
+    the read and write sizes to use (or ``None``), from a reply to the
+    "limits@openssh.com" extension
+    """
+    msg.get_int64()  # max packet length
+    read_length = msg.get_int64()
+    write_length = msg.get_int64()
+    msg.get_int64()  # max open handles
+    # leave room for the headers of a packet of the biggest size we'd send
+    cap = _MAX_MSG_LENGTH - 1024
+    read_size = write_size = None
+    if read_length > 0:
+        read_size = int(min(read_length, cap))
+    if write_length > 0:
+        write_size = int(min(write_length, cap))
+    return read_size, write_size
+
+
+def _resolve(future, result=None, exception=None):
+    if not future.set_running_or_notify_cancel():
+        return
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+
 class SFTP(SFTPClient):
     """
     An alias for `.SFTPClient` for backwards compatibility.
@@ -21,7 +21,8 @@ SFTP file object
 """
 
 from binascii import hexlify
-from collections import deque
+import bisect
+import itertools
 import socket
 import threading
 import time
@@ -45,22 +46,47 @@ class SFTPFile (BufferedFile):
     """
 
     # Some sftp servers will choke if you send read/write requests larger than
-    # this size.
+    # this size.  Larger requests are used if the server says it supports them
+    # (with the "limits@openssh.com" extension).
     MAX_REQUEST_SIZE = 32768
+    # How many reads `prefetch` keeps ahead of the reader, by default (in
+    # flight or buffered); the same as OpenSSH's sftp.
+    MAX_PREFETCH_REQUESTS = 64
+    # How many writes may await acknowledgement at once when pipelined, by
+    # default.
+    MAX_PIPELINED_REQUESTS = 64
 
     def __init__(self, sftp, handle, mode='r', bufsize=-1):
         BufferedFile.__init__(self)
         self.sftp = sftp
         self.handle = handle
         BufferedFile._set_mode(self, mode, bufsize)
+        self._read_size = sftp._max_read_size or self.MAX_REQUEST_SIZE
+        self._write_size = sftp._max_write_size or self.MAX_REQUEST_SIZE
         self.pipelined = False
+        self._max_pipelined = self.MAX_PIPELINED_REQUESTS
         self._prefetching = False
         self._prefetch_done = False
+        # prefetched data (as memoryviews, so that reading part of a chunk
+        # doesn't copy the rest), with its offsets in a sorted index, and how
+        # much memory each one holds on to (the whole chunk it's part of)
         self._prefetch_data = {}
+        self._prefetch_offsets = []
+        self._prefetch_held = {}
+        # outstanding prefetch requests, by request number and in a sorted
+        # (offset, length) index
         self._prefetch_extents = {}
+        self._prefetch_ranges = []
+        # requests whose data was skipped by a seek, and won't be buffered
+        self._prefetch_discarded = set()
         self._prefetch_lock = threading.Lock()
+        self._prefetch_pending = None
+        self._prefetch_window = 0
+        self._prefetch_inflight = 0
+        self._prefetch_buffered = 0
         self._saved_exception = None
-        self._reqs = deque()
+        # outstanding write requests (guarded by the prefetch lock too)
+        self._write_reqs = set()
 
     def __del__(self):
         self._close(async_=True)
@@ -100,73 +126,123 @@ class SFTPFile (BufferedFile):
             pass
 
     def _data_in_prefetch_requests(self, offset, size):
-        k = [x for x in list(self._prefetch_extents.values())
-             if x[0] <= offset]
-        if len(k) == 0:
-            return False
-        k.sort(key=lambda x: x[0])
-        buf_offset, buf_size = k[-1]
-        if buf_offset + buf_size <= offset:
-            # prefetch request ends before this one begins
-            return False
-        if buf_offset + buf_size >= offset + size:
-            # inclusive
-            return True
-        # well, we have part of the request.  see if another chunk has
-        # the rest.
-        return self._data_in_prefetch_requests(
-            buf_offset + buf_size,
-            offset + size - buf_offset - buf_size)
+        """
+        whether outstanding prefetch requests cover ``size`` bytes at
+        ``offset``.  the prefetch lock must be held.
+        """
+        while True:
+            # the request starting last, at or before offset
+            i = bisect.bisect_left(self._prefetch_ranges, (offset + 1,))
+            if i == 0:
+                return False
+            buf_offset, buf_size = self._prefetch_ranges[i - 1]
+            if buf_offset + buf_size <= offset:
+                # prefetch request ends before this one begins
+                return False
+            if buf_offset + buf_size >= offset + size:
+                # inclusive
+                return True
+            # well, we have part of the request.  see if another chunk has
+            # the rest.
+            size = offset + size - buf_offset - buf_size
+            offset = buf_offset + buf_size
 
     def _data_in_prefetch_buffers(self, offset):
         """
         if a block of data is present in the prefetch buffers, at the given
         offset, return the offset of the relevant prefetch buffer.  otherwise,
         return None.  this guarantees nothing about the number of bytes
-        collected in the prefetch buffer so far.
+        collected in the prefetch buffer so far.  the prefetch lock must be
+        held.
         """
-        k = [i for i in self._prefetch_data.keys() if i <= offset]
-        if len(k) == 0:
+        i = bisect.bisect_right(self._prefetch_offsets, offset)
+        if i == 0:
             return None
-        index = max(k)
+        index = self._prefetch_offsets[i - 1]
         buf_offset = offset - index
         if buf_offset >= len(self._prefetch_data[index]):
             # it's not here
             return None
         return index
 
+    def _add_prefetch_buffer(self, offset, data, held=None):
+        if held is None:
+            held = len(data)
+        if offset in self._prefetch_data:
+            self._prefetch_buffered -= self._prefetch_held[offset]
+        else:
+            bisect.insort(self._prefetch_offsets, offset)
+        self._prefetch_data[offset] = data
+        self._prefetch_held[offset] = held
+        self._prefetch_buffered += held
+
+    def _pop_prefetch_buffer(self, offset):
+        """return the buffer at ``offset``, and how much memory it holds"""
+        data = self._prefetch_data.pop(offset)
+        held = self._prefetch_held.pop(offset)
+        del self._prefetch_offsets[
+            bisect.bisect_left(self._prefetch_offsets, offset)]
+        self._prefetch_buffered -= held
+        return data, held
+
+    def _discard_prefetch_before(self, pos):
+        """
+        drop prefetched data which ends before ``pos`` (having been skipped by
+        a seek), and ignore the data still on its way for such requests, so
+        that it doesn't hold up the prefetch window.  the prefetch lock must
+        be held.
+        """
+        while self._prefetch_offsets:
+            offset = self._prefetch_offsets[0]
+            if offset + len(self._prefetch_data[offset]) > pos:
+                break
+            self._pop_prefetch_buffer(offset)
+        for num, (offset, length) in self._prefetch_extents.items():
+            if offset + length <= pos and num not in self._prefetch_discarded:
+                self._prefetch_discarded.add(num)
+                del self._prefetch_ranges[bisect.bisect_left(
+                    self._prefetch_ranges, (offset, length))]
+
     def _read_prefetch(self, size):
         """
         read data out of the prefetch buffer, if possible.  if the data isn't
         in the buffer, return None.  otherwise, behaves like a normal read.
         """
-        # while not closed, and haven't fetched past the current position,
-        # and haven't reached EOF...
+        self._prefetch_more()
+        # wait while the data at the current position is on its way
         while True:
-            offset = self._data_in_prefetch_buffers(self._realpos)
-            if offset is not None:
-                break
-            if self._prefetch_done or self._closed:
-                break
+            with self._prefetch_lock:
+                offset = self._data_in_prefetch_buffers(self._realpos)
+                if offset is not None:
+                    break
+                if (
+                    self._closed or
+                    not self._data_in_prefetch_requests(self._realpos, 1)
+                ):
+                    break
             self.sftp._read_response()
             self._check_exception()
+        self._check_exception()
         if offset is None:
-            self._prefetching = False
+            if self._prefetch_done and not self._prefetch_data:
+                self._prefetching = False
             return None
-        prefetch = self._prefetch_data[offset]
-        del self._prefetch_data[offset]
-
-        buf_offset = self._realpos - offset
-        if buf_offset > 0:
-            self._prefetch_data[offset] = prefetch[:buf_offset]
-            prefetch = prefetch[buf_offset:]
-        if size < len(prefetch):
-            self._prefetch_data[self._realpos + size] = prefetch[size:]
-            prefetch = prefetch[:size]
-        return prefetch
+        with self._prefetch_lock:
+            prefetch, held = self._pop_prefetch_buffer(offset)
+            # anything before the current position has been skipped over
+            prefetch = prefetch[self._realpos - offset:]
+            if size < len(prefetch):
+                rest = prefetch[size:]
+                if len(rest) * 4 < held:
+                    # don't keep a whole chunk in memory for a little of it
+                    rest = memoryview(rest.tobytes())
+                    held = len(rest)
+                self._add_prefetch_buffer(self._realpos + size, rest, held)
+                prefetch = prefetch[:size]
+        return prefetch.tobytes()
 
     def _read(self, size):
-        size = min(size, self.MAX_REQUEST_SIZE)
+        size = min(size, self._read_size)
         if self._prefetching:
             data = self._read_prefetch(size)
             if data is not None:
@@ -183,25 +259,27 @@ class SFTPFile (BufferedFile):
 
     def _write(self, data):
         # may write less than requested if it would exceed max packet size
-        chunk = min(len(data), self.MAX_REQUEST_SIZE)
-        sftp_async_request = self.sftp._async_request(
-            type(None),
+        chunk = min(len(data), self._write_size)
+        num = self.sftp._async_request(
+            self,
             CMD_WRITE,
             self.handle,
             long(self._realpos),
             data[:chunk]
         )
-        self._reqs.append(sftp_async_request)
-        if (
-            not self.pipelined or
-            (len(self._reqs) > 100 and self.sftp.sock.recv_ready())
+        with self._prefetch_lock:
+            self._write_reqs.add(num)
+        if self.pipelined:
+            # collect whatever acknowledgements have arrived, so the window
+            # keeps moving, and wait for more only if it's full
+            limit = self._max_pipelined
+        else:
+            limit = 1
+        while self._write_reqs and (
+            len(self._write_reqs) >= limit or self.sftp.sock.recv_ready()
         ):
-            while len(self._reqs):
-                req = self._reqs.popleft()
-                t, msg = self.sftp._read_response(req)
-                if t != CMD_STATUS:
-                    raise SFTPError('Expected status')
-                # convert_status already called
+            self.sftp._read_response()
+            self._check_exception()
         return chunk
 
     def settimeout(self, timeout):
@@ -263,6 +341,9 @@ class SFTPFile (BufferedFile):
         else:
             self._realpos = self._pos = self._get_size() + offset
         self._rbuffer = bytes()
+        if self._prefetching:
+            with self._prefetch_lock:
+                self._discard_prefetch_before(self._realpos)
 
     def stat(self):
         """
@@ -339,6 +420,22 @@ class SFTPFile (BufferedFile):
         attr.st_size = size
         self.sftp._request(CMD_FSETSTAT, self.handle, attr)
 
+    def fsync(self):
+        """
+        Ask the server to commit this file's contents to stable storage (like
+        `os.fsync`), with the ``fsync@openssh.com`` extension.  Any buffered
+        data is written out, and any pipelined writes acknowledged, first.
+
+        :raises:
+            ``IOError`` -- if the server doesn't support the extension, or
+            the sync fails
+        """
+        self.flush()
+        if self.pipelined:
+            self.sftp._finish_responses(self)
+        self.sftp._log(DEBUG, "fsync(%s)", hexlify(self.handle).decode())
+        self.sftp._request(CMD_EXTENDED, 'fsync@openssh.com', self.handle)
+
     def check(self, hash_algorithm, offset=0, length=0, block_size=0):
         """
         Ask the server for a hash of a section of this file.  This can be used
@@ -393,37 +490,84 @@ class SFTPFile (BufferedFile):
         data = msg.get_remainder()
         return data
 
-    def set_pipelined(self, pipelined=True):
+    def copy_data(self, dst, offset=0, length=0, dst_offset=0):
+        """
+        Ask the server to copy a section of this file into another open file,
+        with the "copy-data" extension, so the data isn't sent over the
+        network.  Any buffered data in both files is written out, and any
+        pipelined writes acknowledged, first.
+
+        The file is copied from ``offset``, for ``length`` bytes (or up to
+        EOF, if ``length`` is 0), and written to ``dst`` at ``dst_offset``.
+        Both files may be the same, if the two sections don't overlap.
+
+        :param .SFTPFile dst:
+            the file to copy into, opened for writing on the same server
+        :param offset: position in this file to start copying from
+        :param length: number of bytes to copy (0 means up to EOF)
+        :param dst_offset: position in ``dst`` to write the data to
+
+        :raises:
+            ``IOError`` -- if the server doesn't support the "copy-data"
+            extension, or the copy fails
+        """
+        for f in (self, dst):
+            f.flush()
+            if f.pipelined:
+                f.sftp._finish_responses(f)
+        self.sftp._log(
+            DEBUG, "copy_data(%s, %r, %r, %s, %r)",
+            hexlify(self.handle).decode(), offset, length,
+            hexlify(dst.handle).decode(), dst_offset)
+        self.sftp._request(
+            CMD_EXTENDED, 'copy-data', self.handle, long(offset),
+            long(length), dst.handle, long(dst_offset))
+
+    def set_pipelined(self, pipelined=True, max_concurrent_requests=None):
         """
         Turn on/off the pipelining of write operations to this file.  When
         pipelining is on, paramiko won't wait for the server response after
-        each write operation.  Instead, they're collected as they come in. At
-        the first non-write operation (including `.close`), all remaining
-        server responses are collected.  This means that if there was an error
-        with one of your later writes, an exception might be thrown from within
-        `.close` instead of `.write`.
+        each write operation.  Instead, they're collected as they come in,
+        and a write only blocks when ``max_concurrent_requests`` writes are
+        awaiting a response. At `.close`, all remaining server responses are
+        collected.  This means that if there was an error with one of your
+        later writes, an exception might be thrown from within `.close`
+        instead of `.write`.
 
         By default, files are not pipelined.
 
         :param bool pipelined:
             ``True`` if pipelining should be turned on for this file; ``False``
             otherwise
+        :param int max_concurrent_requests:
+            how many writes (of up to the request size in use) may be in
+            flight at once (default `MAX_PIPELINED_REQUESTS`).  Raise this for
+            fast links with high latency.
 
         .. versionadded:: 1.5
         """
         self.pipelined = pipelined
+        if max_concurrent_requests is None:
+            max_concurrent_requests = self.MAX_PIPELINED_REQUESTS
+        self._max_pipelined = max(1, max_concurrent_requests)
 
-    def prefetch(self, file_size=None):
+    def prefetch(self, file_size=None, max_concurrent_requests=None):
         """
         Pre-fetch the remaining contents of this file in anticipation of future
         `.read` calls.  If reading the entire file, pre-fetching can
         dramatically improve the download speed by avoiding roundtrip latency.
-        The file's contents are incrementally buffered in a background thread.
+
+        Read requests are kept going ahead of the current position, up to a
+        window of ``max_concurrent_requests`` chunks either in flight or
+        received but not read yet; more are sent as the data is read.  So
+        memory use stays bounded, however big the file is.
 
         The prefetched data is stored in a buffer until read via the `.read`
         method.  Once data has been read, it's removed from the buffer.  The
-        data may be read in a random order (using `.seek`); chunks of the
-        buffer that haven't been read will continue to be buffered.
+        data may be read in a random order (using `.seek`): chunks of the
+        buffer after the current position that haven't been read will
+        continue to be buffered (and take up room in the window), while those
+        left behind by seeking forward are dropped.
 
         :param int file_size:
             When this is ``None`` (the default), this method calls `stat` to
@@ -432,6 +576,10 @@ class SFTPFile (BufferedFile):
             <https://github.com/paramiko/paramiko/pull/562>`_); as a
             workaround, one may call `stat` explicitly and pass its value in
             via this parameter.
+        :param int max_concurrent_requests:
+            the size of the prefetch window, in read requests (of
+            `MAX_REQUEST_SIZE` bytes, or the larger size agreed with the
+            server); default `MAX_PREFETCH_REQUESTS`
 
         .. versionadded:: 1.5.1
         .. versionchanged:: 1.16.0
@@ -443,22 +591,17 @@ class SFTPFile (BufferedFile):
         if file_size is None:
             file_size = self.stat().st_size
 
-        # queue up async reads for the rest of the file
-        chunks = []
-        n = self._realpos
-        while n < file_size:
-            chunk = min(self.MAX_REQUEST_SIZE, file_size - n)
-            chunks.append((n, chunk))
-            n += chunk
-        if len(chunks) > 0:
-            self._start_prefetch(chunks)
+        if self._realpos < file_size:
+            self._start_prefetch(
+                self._chunks_ahead(self._realpos, file_size),
+                max_concurrent_requests)
 
     def readv(self, chunks):
         """
         Read a set of blocks from the file by (offset, length).  This is more
         efficient than doing a series of `.seek` and `.read` calls, since the
-        prefetch machinery is used to retrieve all the requested blocks at
-        once.
+        prefetch machinery is used to keep requests for the blocks in flight
+        ahead of the reads.
 
         :param chunks:
             a list of ``(offset, length)`` tuples indicating which sections of
@@ -472,15 +615,16 @@ class SFTPFile (BufferedFile):
         read_chunks = []
         for offset, size in chunks:
             # don't fetch data that's already in the prefetch buffer
-            if (
-                self._data_in_prefetch_buffers(offset) or
-                self._data_in_prefetch_requests(offset, size)
-            ):
-                continue
+            with self._prefetch_lock:
+                if (
+                    self._data_in_prefetch_buffers(offset) is not None or
+                    self._data_in_prefetch_requests(offset, size)
+                ):
+                    continue
 
             # break up anything larger than the max read size
             while size > 0:
-                chunk_size = min(size, self.MAX_REQUEST_SIZE)
+                chunk_size = min(size, self._read_size)
                 read_chunks.append((offset, chunk_size))
                 offset += chunk_size
                 size -= chunk_size
@@ -488,7 +632,11 @@ class SFTPFile (BufferedFile):
         self._start_prefetch(read_chunks)
         # now we can just devolve to a bunch of read()s :)
         for x in chunks:
-            self.seek(x[0])
+            # not seek(), which would drop what's prefetched for any chunks
+            # still to come before this one
+            self.flush()
+            self._realpos = self._pos = x[0]
+            self._rbuffer = bytes()
             yield self.read(x[1])
 
     # ...internals...
@@ -499,18 +647,60 @@ class SFTPFile (BufferedFile):
         except:
             return 0
 
-    def _start_prefetch(self, chunks):
-        self._prefetching = True
-        self._prefetch_done = False
+    def _chunks(self, start, end):
+        while start < end:
+            chunk = min(self._read_size, end - start)
+            yield start, chunk
+            start += chunk
 
-        t = threading.Thread(target=self._prefetch_thread, args=(chunks,))
-        t.daemon = True
-        t.start()
-
-    def _prefetch_thread(self, chunks):
-        # do these read requests in a temporary thread because there may be
-        # a lot of them, so it may block.
-        for offset, length in chunks:
+    def _chunks_ahead(self, start, end):
+        """
+        like `_chunks`, but skipping ahead past whatever a seek has skipped
+        """
+        while True:
+            start = max(start, self._realpos)
+            if start >= end:
+                return
+            chunk = min(self._read_size, end - start)
+            yield start, chunk
+            start += chunk
+
+    def _start_prefetch(self, chunks, max_concurrent_requests=None):
+        if max_concurrent_requests is None:
+            max_concurrent_requests = self.MAX_PREFETCH_REQUESTS
+        with self._prefetch_lock:
+            self._prefetching = True
+            self._prefetch_done = False
+            window = max_concurrent_requests * self._read_size
+            self._prefetch_window = max(self._prefetch_window, window)
+            # new chunks (from readv) go ahead of any still pending, since
+            # they're about to be read
+            if self._prefetch_pending is not None:
+                chunks = itertools.chain(chunks, self._prefetch_pending)
+            self._prefetch_pending = iter(chunks)
+        self._prefetch_more()
+
+    def _prefetch_more(self):
+        """
+        Send more of the pending prefetch reads, while the data in flight plus
+        the data buffered (but not read yet) fits in the prefetch window.
+        """
+        while True:
+            with self._prefetch_lock:
+                if self._prefetch_pending is None:
+                    return
+                room = (self._prefetch_window - self._prefetch_inflight -
+                        self._prefetch_buffered)
+                if room < self._read_size:
+                    return
+                chunk = next(self._prefetch_pending, None)
+                if chunk is None:
+                    self._prefetch_pending = None
+                    if not self._prefetch_extents:
+                        self._prefetch_done = True
+                    return
+                offset, length = chunk
+                self._prefetch_inflight += length
             num = self.sftp._async_request(
                 self,
                 CMD_READ,
@@ -519,8 +709,41 @@ class SFTPFile (BufferedFile):
                 int(length))
             with self._prefetch_lock:
                 self._prefetch_extents[num] = (offset, length)
+                bisect.insort(self._prefetch_ranges, (offset, length))
 
     def _async_response(self, t, msg, num):
+        while True:
+            with self._prefetch_lock:
+                # spin if in race with _prefetch_more or _write in another
+                # thread
+                if num in self._write_reqs:
+                    self._write_reqs.remove(num)
+                    if t != CMD_STATUS:
+                        self._saved_exception = SFTPError('Expected status')
+                        return
+                    break
+                if num in self._prefetch_extents:
+                    offset, length = self._prefetch_extents.pop(num)
+                    self._prefetch_inflight -= length
+                    if num in self._prefetch_discarded:
+                        self._prefetch_discarded.remove(num)
+                        if (
+                            not self._prefetch_extents and
+                            self._prefetch_pending is None
+                        ):
+                            self._prefetch_done = True
+                        return
+                    del self._prefetch_ranges[bisect.bisect_left(
+                        self._prefetch_ranges, (offset, length))]
+                    if t == CMD_DATA:
+                        self._add_prefetch_buffer(
+                            offset, memoryview(msg.get_string()))
+                    if (
+                        not self._prefetch_extents and
+                        self._prefetch_pending is None
+                    ):
+                        self._prefetch_done = True
+                    break
         if t == CMD_STATUS:
             # save exception and re-raise it on next file operation
             try:
@@ -530,17 +753,6 @@ class SFTPFile (BufferedFile):
             return
         if t != CMD_DATA:
             raise SFTPError('Expected data')
-        data = msg.get_string()
-        while True:
-            with self._prefetch_lock:
-                # spin if in race with _prefetch_thread
-                if num in self._prefetch_extents:
-                    offset, length = self._prefetch_extents[num]
-                    self._prefetch_data[offset] = data
-                    del self._prefetch_extents[num]
-                    if len(self._prefetch_extents) == 0:
-                        self._prefetch_done = True
-                    break
 
     def _check_exception(self):
         """if there's a saved exception, raise & clear it"""
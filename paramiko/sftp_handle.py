@@ -20,11 +20,18 @@
 Abstraction of an SFTP file handle (for server mode).
 """
 
+import itertools
 import os
-from paramiko.sftp import SFTP_OP_UNSUPPORTED, SFTP_OK
+import threading
+
+from paramiko.sftp import SFTP_OP_UNSUPPORTED, SFTP_OK, SFTP_EOF
 from paramiko.util import ClosingContextManager
 
 
+# how much to copy at a time, for the "copy-data" extension
+_COPY_SIZE = 1024 * 1024
+
+
 class SFTPHandle (ClosingContextManager):
     """
     Abstract object representing a handle to an open file (or folder) in an
@@ -48,8 +55,10 @@ class SFTPHandle (ClosingContextManager):
         self.__flags = flags
         self.__name = None
         # only for handles to folders:
-        self.__files = {}
+        self.__files = iter(())
         self.__tell = None
+        # only for emulating pread/pwrite on ``fd``, where they're missing
+        self.__fd_lock = threading.Lock()
 
     def close(self):
         """
@@ -57,12 +66,20 @@ class SFTPHandle (ClosingContextManager):
         Normally you would use this method to close the underlying OS level
         file object(s).
 
-        The default implementation checks for attributes on ``self`` named
+        The default implementation closes the file descriptor in an attribute
+        on ``self`` named ``fd``, if present; and checks for attributes named
         ``readfile`` and/or ``writefile``, and if either or both are present,
         their ``close()`` methods are called.  This means that if you are
         using the default implementations of `read` and `write`, this
         method's default implementation should be fine also.
         """
+        fd = getattr(self, 'fd', None)
+        if fd is not None:
+            os.close(fd)
+        # a folder listing may be a generator holding the folder open
+        files_close = getattr(self.__files, 'close', None)
+        if files_close is not None:
+            files_close()
         readfile = getattr(self, 'readfile', None)
         if readfile is not None:
             readfile.close()
@@ -80,14 +97,25 @@ class SFTPHandle (ClosingContextManager):
         empty string to signify EOF, or it may also return ``SFTP_EOF``.
 
         The default implementation checks for an attribute on ``self`` named
-        ``readfile``, and if present, performs the read operation on the Python
-        file-like object found there.  (This is meant as a time saver for the
-        common case where you are wrapping a Python file object.)
+        ``fd``, and if present, reads from that OS-level file descriptor (as
+        returned by `os.open`) with `os.pread`.  Otherwise it checks for an
+        attribute named ``readfile``, and if present, performs the read
+        operation on the Python file-like object found there.  (This is meant
+        as a time saver for the common case where you are wrapping a Python
+        file object.)  The ``fd`` way takes just one system call per request,
+        and doesn't depend on a shared file position, so it's also safe to
+        call from several threads at once.
 
         :param offset: position in the file to start reading from.
         :param int length: number of bytes to attempt to read.
         :return: data read from the file, or an SFTP error code, as a `str`.
         """
+        fd = getattr(self, 'fd', None)
+        if fd is not None:
+            try:
+                return self._pread(fd, length, offset)
+            except (IOError, OSError) as e:
+                return SFTPServer.convert_errno(e.errno)
         readfile = getattr(self, 'readfile', None)
         if readfile is None:
             return SFTP_OP_UNSUPPORTED
@@ -112,16 +140,32 @@ class SFTPHandle (ClosingContextManager):
         write all of ``data`` or else return an error.
 
         The default implementation checks for an attribute on ``self`` named
-        ``writefile``, and if present, performs the write operation on the
-        Python file-like object found there.  The attribute is named
-        differently from ``readfile`` to make it easy to implement read-only
-        (or write-only) files, but if both attributes are present, they should
-        refer to the same file.
+        ``fd``, and if present, writes to that OS-level file descriptor with
+        `os.pwrite`.  The data isn't flushed to disk; clients can ask for that
+        with `.SFTPFile.fsync` (see `fsync`).  Otherwise it checks for an
+        attribute named ``writefile``, and if present, performs the write
+        operation on the Python file-like object found there, flushing it
+        after each write.  The attribute is named differently from
+        ``readfile`` to make it easy to implement read-only (or write-only)
+        files, but if both attributes are present, they should refer to the
+        same file.
 
         :param offset: position in the file to start reading from.
         :param str data: data to write into the file.
         :return: an SFTP error code like ``SFTP_OK``.
         """
+        fd = getattr(self, 'fd', None)
+        if fd is not None:
+            try:
+                if self.__flags & os.O_APPEND:
+                    # in append mode, don't care about the offset
+                    while data:
+                        data = data[os.write(fd, data):]
+                else:
+                    self._pwrite(fd, data, offset)
+            except (IOError, OSError) as e:
+                return SFTPServer.convert_errno(e.errno)
+            return SFTP_OK
         writefile = getattr(self, 'writefile', None)
         if writefile is None:
             return SFTP_OP_UNSUPPORTED
@@ -166,24 +210,113 @@ class SFTPHandle (ClosingContextManager):
         """
         return SFTP_OP_UNSUPPORTED
 
+    def fsync(self):
+        """
+        Commit everything written to this file to stable storage, as the
+        client asked with the ``fsync@openssh.com`` extension.
+
+        The default implementation calls `os.fsync` on the ``fd`` attribute,
+        or on ``writefile`` (after flushing it), whichever is present.
+
+        :return: an `int` error code like ``SFTP_OK``.
+        """
+        fd = getattr(self, 'fd', None)
+        writefile = getattr(self, 'writefile', None)
+        try:
+            if fd is not None:
+                os.fsync(fd)
+            elif writefile is not None:
+                writefile.flush()
+                os.fsync(writefile.fileno())
+            else:
+                return SFTP_OP_UNSUPPORTED
+        except (IOError, OSError) as e:
+            return SFTPServer.convert_errno(e.errno)
+        return SFTP_OK
+
+    def copy_data(self, offset, length, dst, dst_offset):
+        """
+        Copy ``length`` bytes of this file from position ``offset`` (or up to
+        EOF, if ``length`` is 0) into the open file ``dst`` at position
+        ``dst_offset``, as the client asked with the ``copy-data`` extension.
+
+        The default implementation uses `os.copy_file_range` (so the data
+        needn't even pass through this process) if both handles have an
+        ``fd`` attribute and the system supports it.  Otherwise it copies in
+        chunks, with `read` on this handle and `write` on ``dst``.
+
+        :param .SFTPHandle dst: the handle to copy into
+        :return: an `int` error code like ``SFTP_OK``.
+        """
+        end = offset + length if length else None
+        fd = getattr(self, 'fd', None)
+        dst_fd = getattr(dst, 'fd', None)
+        if fd is not None and dst_fd is not None and \
+                hasattr(os, 'copy_file_range') and \
+                not dst.__flags & os.O_APPEND:
+            try:
+                while end is None or offset < end:
+                    size = _copy_size(offset, end)
+                    n = os.copy_file_range(
+                        fd, dst_fd, size, offset, dst_offset)
+                    if not n:
+                        return SFTP_OK
+                    offset += n
+                    dst_offset += n
+                return SFTP_OK
+            except OSError:
+                # not possible between these files (e.g. across filesystems,
+                # on older kernels): copy the rest the slow way
+                pass
+        while end is None or offset < end:
+            data = self.read(offset, _copy_size(offset, end))
+            if not isinstance(data, bytes):
+                if data == SFTP_EOF:
+                    break
+                return data
+            if not data:
+                break
+            result = dst.write(dst_offset, data)
+            if result != SFTP_OK:
+                return result
+            offset += len(data)
+            dst_offset += len(data)
+        return SFTP_OK
+
     # ...internals...
 
+    def _pread(self, fd, length, offset):
+        if hasattr(os, 'pread'):
+            return os.pread(fd, length, offset)
+        with self.__fd_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            return os.read(fd, length)
+
+    def _pwrite(self, fd, data, offset):
+        while data:
+            if hasattr(os, 'pwrite'):
+                n = os.pwrite(fd, data, offset)
+            else:
+                with self.__fd_lock:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    n = os.write(fd, data)
+            data = data[n:]
+            offset += n
+
     def _set_files(self, files):
         """
-        Used by the SFTP server code to cache a directory listing.  (In
-        the SFTP protocol, listing a directory is a multi-stage process
-        requiring a temporary handle.)
+        Used by the SFTP server code to cache a directory listing (any
+        iterable).  (In the SFTP protocol, listing a directory is a
+        multi-stage process requiring a temporary handle.)
         """
-        self.__files = files
+        self.__files = iter(files)
 
-    def _get_next_files(self):
+    def _get_next_files(self, count=16):
         """
-        Used by the SFTP server code to retrieve a cached directory
-        listing.
+        Used by the SFTP server code to retrieve the next ``count`` entries
+        of a cached directory listing.
         """
-        fnlist = self.__files[:16]
-        self.__files = self.__files[16:]
-        return fnlist
+        return list(itertools.islice(self.__files, count))
 
     def _get_name(self):
         return self.__name
@@ -192,4 +325,10 @@ class SFTPHandle (ClosingContextManager):
         self.__name = name
 
 
+def _copy_size(offset, end):
+    if end is None:
+        return _COPY_SIZE
+    return min(_COPY_SIZE, end - offset)
+
+
 from paramiko.sftp_server import SFTPServer  # noqa: E402
@@ -22,8 +22,12 @@ Server-mode SFTP support.
 
 import os
 import errno
+import hashlib
+import struct
 import sys
-from hashlib import md5, sha1
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from paramiko import util
 from paramiko.sftp import (
@@ -44,13 +48,28 @@ from paramiko.sftp import (
     CMD_CLOSE, SFTP_OK, CMD_READ, CMD_DATA, CMD_WRITE, CMD_REMOVE, CMD_RENAME,
     CMD_MKDIR, CMD_RMDIR, CMD_OPENDIR, CMD_READDIR, CMD_STAT, CMD_ATTRS,
     CMD_LSTAT, CMD_FSTAT, CMD_SETSTAT, CMD_FSETSTAT, CMD_READLINK, CMD_SYMLINK,
-    CMD_REALPATH, CMD_EXTENDED, SFTP_OP_UNSUPPORTED,
+    CMD_REALPATH, CMD_EXTENDED, SFTP_OP_UNSUPPORTED, _MAX_MSG_LENGTH,
 )
 
 _hash_class = {
-    'sha1': sha1,
-    'md5': md5,
+    'sha1': hashlib.sha1,
+    'md5': hashlib.md5,
+    'sha224': hashlib.sha224,
+    'sha256': hashlib.sha256,
+    'sha384': hashlib.sha384,
+    'sha512': hashlib.sha512,
 }
+# python 3.6+
+if hasattr(hashlib, 'blake2b'):
+    _hash_class['blake2b'] = hashlib.blake2b
+    _hash_class['blake2s'] = hashlib.blake2s
+
+# requests (and extended requests) which refer to an open handle, which the
+# handle is the first field of; these are processed in order, per handle
+_HANDLE_REQUESTS = (
+    CMD_CLOSE, CMD_READ, CMD_WRITE, CMD_READDIR, CMD_FSTAT, CMD_FSETSTAT,
+)
+_HANDLE_EXTENSIONS = ('check-file', 'fsync@openssh.com', 'copy-data')
 
 
 class SFTPServer (BaseSFTP, SubsystemHandler):
@@ -60,6 +79,33 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
     Use `.Transport.set_subsystem_handler` to activate this class.
     """
 
+    # Limits advertised to clients with the "limits@openssh.com" extension.
+    # Longer reads are cut short.
+    MAX_READ_LENGTH = _MAX_MSG_LENGTH - 1024
+    MAX_WRITE_LENGTH = _MAX_MSG_LENGTH - 1024
+
+    # How many requests to process at once, in a pool of worker threads, with
+    # responses sent as each completes.  Requests on the same handle are still
+    # processed in the order they were received.  With the default of 0,
+    # requests are processed one at a time, in the channel's thread (except
+    # for the hashing described below).
+    # Set this in a subclass if your `.SFTPServerInterface` is safe to call
+    # from several threads at once.
+    MAX_WORKERS = 0
+
+    # How many entries to send in each reply to a client reading a folder.
+    MAX_READDIR_ENTRIES = 100
+
+    # For the "check-file" extension: how many blocks to hash at once, in
+    # separate threads, and how much to read from the file at a time.
+    # Even without MAX_WORKERS, files read with the default `.SFTPHandle.read`
+    # of an ``fd`` (which is safe from any thread) are read and hashed in the
+    # background, so the session carries on meanwhile; only later requests
+    # on the same handle wait for it.  Other files are read in the request
+    # loop, which is held up until they're hashed.
+    CHECK_FILE_THREADS = 4
+    CHECK_FILE_READ_SIZE = 1024 * 1024
+
     def __init__(self, channel, name, server, sftp_si=SFTPServerInterface, *largs, **kwargs):
         """
         The constructor for SFTPServer is meant to be called from within the
@@ -80,6 +126,17 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
         self.logger = util.get_logger(transport.get_log_channel() + '.sftp')
         self.ultra_debug = transport.get_hexdump()
         self.next_handle = 1
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._workers = None
+        self._slots = None
+        self._hash_pool = None
+        self._check_pool = None
+        # handle -> requests waiting for the one in progress on that handle
+        self._handle_queues = {}
+        # (processing serially) handle -> future of a check-file request
+        # being hashed in the background
+        self._checks = {}
         # map of handle-string to SFTPHandle for files & folders:
         self.file_table = {}
         self.folder_table = {}
@@ -92,28 +149,42 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
     def start_subsystem(self, name, transport, channel):
         self.sock = channel
         self._log(DEBUG, "Started sftp server on channel %r", channel)
-        self._send_server_version()
+        self._send_server_version([
+            'check-file', ','.join(sorted(_hash_class)),
+            'limits@openssh.com', '1',
+            'fsync@openssh.com', '1',
+            'copy-data', '1',
+            'copy-file', '1',
+        ])
         self.server.session_started()
-        while True:
-            try:
-                t, data = self._read_packet()
-            except EOFError:
-                self._log(DEBUG, 'EOF -- end of session')
-                return
-            except Exception as e:
-                self._log(DEBUG, "Exception on channel: %s", e, exc_info=True)
-                return
-            msg = Message(data)
-            request_number = msg.get_int()
-            try:
-                self._process(t, request_number, msg)
-            except Exception as e:
-                self._log(DEBUG, "Exception in server processing: %s", e, exc_info=True)
-                # send some kind of failure message, at least
+        if self.MAX_WORKERS > 0:
+            self._workers = ThreadPoolExecutor(max_workers=self.MAX_WORKERS)
+            # don't read requests much faster than they can be processed,
+            # so a client can't queue up unbounded work (and memory)
+            self._slots = threading.BoundedSemaphore(self.MAX_WORKERS * 4)
+        try:
+            while True:
                 try:
-                    self._send_status(request_number, SFTP_FAILURE)
-                except:
-                    pass
+                    t, data = self._read_packet()
+                except EOFError:
+                    self._log(DEBUG, 'EOF -- end of session')
+                    return
+                except Exception as e:
+                    self._log(DEBUG, "Exception on channel: %s", e, exc_info=True)
+                    return
+                if self._workers is not None:
+                    self._dispatch(t, data)
+                else:
+                    self._wait_for_checks(t, data)
+                    self._process_safely(t, data)
+        finally:
+            if self._workers is not None:
+                self._workers.shutdown(wait=True)
+            if self._check_pool is not None:
+                self._check_pool.shutdown(wait=True)
+            # (no more requests can start hashing)
+            if self._hash_pool is not None:
+                self._hash_pool.shutdown(wait=True)
 
     def finish_subsystem(self):
         self.server.session_ended()
@@ -173,8 +244,127 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
             with open(filename, 'w+') as f:
                 f.truncate(attr.st_size)
 
+    @staticmethod
+    def scan_folder(path):
+        """
+        List a folder on the local filesystem, for
+        `.SFTPServerInterface.list_folder`, without reading it all at once.
+        The folder is opened right away, but the entries are read (with
+        `os.scandir`, where available) and ``lstat``'d only as the result is
+        iterated over.  Entries which disappear meanwhile are skipped.  The
+        folder is closed once the result is exhausted or closed (as
+        `.SFTPHandle.close` does).
+
+        This is meant to be a handy helper function for translating SFTP
+        listing requests into local file operations.
+
+        :param str path:
+            name of the folder to list (should usually be an absolute path).
+        :return:
+            an iterator of `.SFTPAttributes`, with their ``filename`` set
+
+        :raises: ``OSError`` -- if the folder can't be opened
+        """
+        if hasattr(os, 'scandir'):
+            listing = _scan_entries(path)
+            # open the folder now, so that any error is raised now, and so
+            # that closing the listing closes the folder even if it's unread
+            next(listing)
+            return listing
+        return _scan_names(path, os.listdir(path))
+
     # ...internals...
 
+    def _send_packet(self, t, packet):
+        # responses may come from several worker threads
+        with self._send_lock:
+            super(SFTPServer, self)._send_packet(t, packet)
+
+    def _process_safely(self, t, data):
+        msg = Message(data)
+        request_number = msg.get_int()
+        try:
+            self._process(t, request_number, msg)
+        except Exception as e:
+            self._log(DEBUG, "Exception in server processing: %s", e, exc_info=True)
+            # send some kind of failure message, at least
+            try:
+                self._send_status(request_number, SFTP_FAILURE)
+            except:
+                pass
+
+    def _dispatch(self, t, data):
+        """
+        Queue a request for the worker pool, behind any others on the same
+        handle.
+        """
+        handle = self._get_request_handle(t, data)
+        self._slots.acquire()
+        if handle is not None:
+            with self._lock:
+                if handle in self._handle_queues:
+                    self._handle_queues[handle].append((t, data))
+                    return
+                self._handle_queues[handle] = deque()
+        self._workers.submit(self._work, handle, t, data)
+
+    def _work(self, handle, t, data):
+        while True:
+            self._process_safely(t, data)
+            self._slots.release()
+            if handle is None:
+                return
+            with self._lock:
+                queue = self._handle_queues[handle]
+                if not queue:
+                    del self._handle_queues[handle]
+                    return
+                t, data = queue.popleft()
+
+    def _wait_for_checks(self, t, data):
+        """
+        (processing serially) wait for any check-file request on the same
+        handle as this one to be done in the background
+        """
+        if not self._checks:
+            return
+        future = self._checks.pop(self._get_request_handle(t, data), None)
+        if future is not None:
+            future.result()
+
+    def _get_hash_pool(self):
+        """the threads for hashing "check-file" blocks, started when needed"""
+        with self._lock:
+            if self._hash_pool is None:
+                self._hash_pool = ThreadPoolExecutor(
+                    max_workers=self.CHECK_FILE_THREADS)
+            return self._hash_pool
+
+    def _get_check_pool(self):
+        """the threads for background check-file requests, likewise"""
+        with self._lock:
+            if self._check_pool is None:
+                self._check_pool = ThreadPoolExecutor(
+                    max_workers=self.CHECK_FILE_THREADS)
+            return self._check_pool
+
+    def _get_request_handle(self, t, data):
+        """
+        the handle a request refers to, or ``None`` if it isn't one (or is
+        malformed: processing it then sends the client an error)
+        """
+        msg = Message(data)
+        try:
+            msg.get_int()
+            if t == CMD_EXTENDED:
+                if msg.get_text() not in _HANDLE_EXTENSIONS:
+                    return None
+            elif t not in _HANDLE_REQUESTS:
+                return None
+            return msg.get_binary()
+        except (struct.error, ValueError):
+            return None
+
     def _response(self, request_number, t, *arg):
         msg = Message()
         msg.add_int(request_number)
@@ -198,8 +388,9 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
             # must be error code
             self._send_status(request_number, handle)
             return
-        handle._set_name(b('hx{:d}'.format(self.next_handle)))
-        self.next_handle += 1
+        with self._lock:
+            handle._set_name(b('hx{:d}'.format(self.next_handle)))
+            self.next_handle += 1
         if folder:
             self.folder_table[handle._get_name()] = handle
         else:
@@ -218,17 +409,17 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
 
     def _open_folder(self, request_number, path):
         resp = self.server.list_folder(path)
-        if isinstance(resp, list):
-            # got an actual list of filenames in the folder
-            folder = SFTPHandle()
-            folder._set_files(resp)
-            self._send_handle_response(request_number, folder, True)
+        if isinstance(resp, (int, long)):
+            # must be an error code
+            self._send_status(request_number, resp)
             return
-        # must be an error code
-        self._send_status(request_number, resp)
+        # got a list (or iterable) of the files in the folder
+        folder = SFTPHandle()
+        folder._set_files(resp)
+        self._send_handle_response(request_number, folder, True)
 
     def _read_folder(self, request_number, folder):
-        flist = folder._get_next_files()
+        flist = folder._get_next_files(self.MAX_READDIR_ENTRIES)
         if len(flist) == 0:
             self._send_status(request_number, SFTP_EOF)
             return
@@ -237,7 +428,7 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
         msg.add_int(len(flist))
         for attr in flist:
             msg.add_string(attr.filename)
-            msg.add_string(attr)
+            msg.add_string(attr.longname)
             attr._pack(msg)
         self._send_packet(CMD_NAME, msg)
 
@@ -271,31 +462,43 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
                 self._send_status(request_number, st, 'Unable to stat file')
                 return
             length = st.st_size - start
-        if block_size == 0:
-            block_size = length
-        if block_size < 256:
+        if block_size != 0 and block_size < 256:
             self._send_status(
                 request_number, SFTP_FAILURE, 'Block size too small')
             return
+        args = (request_number, f, alg, algname, start, length, block_size)
+        if (
+            self._workers is None and getattr(f, 'fd', None) is not None and
+            type(f).read == SFTPHandle.read
+        ):
+            # reading with pread is safe from another thread, so the request
+            # loop needn't wait for this
+            self._checks[handle] = self._get_check_pool().submit(
+                self._send_hashes_safely, *args)
+        else:
+            self._send_hashes(*args)
 
-        sum_out = bytes()
-        offset = start
-        while offset < start + length:
-            blocklen = min(block_size, start + length - offset)
-            # don't try to read more than about 64KB at a time
-            chunklen = min(blocklen, 65536)
-            count = 0
-            hash_obj = alg()
-            while count < blocklen:
-                data = f.read(offset, chunklen)
-                if not isinstance(data, bytes):
-                    self._send_status(
-                        request_number, data, 'Unable to hash file')
-                    return
-                hash_obj.update(data)
-                count += len(data)
-                offset += count
-            sum_out += hash_obj.digest()
+    def _send_hashes_safely(self, request_number, *args):
+        try:
+            self._send_hashes(request_number, *args)
+        except Exception as e:
+            self._log(DEBUG, "Exception in server processing: %s", e, exc_info=True)
+            try:
+                self._send_status(request_number, SFTP_FAILURE)
+            except:
+                pass
+
+    def _send_hashes(self, request_number, f, alg, algname, start, length,
+                     block_size):
+        if block_size == 0:
+            # one hash of everything, even if that's nothing
+            sum_out = self._hash_blocks(f, alg, start, length, length) or \
+                alg().digest()
+        else:
+            sum_out = self._hash_blocks(f, alg, start, length, block_size)
+        if not isinstance(sum_out, bytes):
+            self._send_status(request_number, sum_out, 'Unable to hash file')
+            return
 
         msg = Message()
         msg.add_int(request_number)
@@ -304,6 +507,102 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
         msg.add_bytes(sum_out)
         self._send_packet(CMD_EXTENDED_REPLY, msg)
 
+    def _hash_blocks(self, f, alg, start, length, block_size):
+        """
+        Hash each ``block_size`` bytes of the handle ``f``, from ``start`` for
+        ``length`` bytes (or up to EOF), and return the digests concatenated,
+        or an SFTP error code.  The file is read in order, but blocks are
+        hashed in parallel; a block too big to buffer is hashed as it's read.
+        """
+        digests = []  # digests, or futures of them
+        pending = deque()
+        offset = start
+        end = start + length
+        while offset < end:
+            size = min(block_size, end - offset)
+            streamed = size > self.CHECK_FILE_READ_SIZE
+            hash_obj = alg()
+            chunks = []
+            count = 0
+            while count < size:
+                data = f.read(
+                    offset + count,
+                    min(size - count, self.CHECK_FILE_READ_SIZE))
+                if not isinstance(data, bytes):
+                    if data == SFTP_EOF:
+                        break
+                    return data
+                if not data:
+                    break
+                if streamed:
+                    hash_obj.update(data)
+                else:
+                    chunks.append(data)
+                count += len(data)
+            if count and streamed:
+                digests.append(hash_obj.digest())
+            elif count:
+                if len(pending) >= 2 * self.CHECK_FILE_THREADS:
+                    pending.popleft().result()
+                future = self._get_hash_pool().submit(_digest, alg, chunks)
+                pending.append(future)
+                digests.append(future)
+            if count < size:
+                break
+            offset += size
+        return bytes().join(
+            d if isinstance(d, bytes) else d.result() for d in digests)
+
+    def _copy_data(self, request_number, msg):
+        handle = msg.get_binary()
+        offset = msg.get_int64()
+        length = msg.get_int64()
+        dst_handle = msg.get_binary()
+        dst_offset = msg.get_int64()
+        if handle not in self.file_table or dst_handle not in self.file_table:
+            self._send_status(
+                request_number, SFTP_BAD_MESSAGE, 'Invalid handle')
+            return
+        f = self.file_table[handle]
+        if handle == dst_handle and (
+            (length == 0 and dst_offset >= offset) or
+            (offset < dst_offset + length and dst_offset < offset + length)
+        ):
+            self._send_status(
+                request_number, SFTP_FAILURE, 'Overlapping ranges')
+            return
+        self._send_status(
+            request_number,
+            f.copy_data(offset, length, self.file_table[dst_handle],
+                        dst_offset))
+
+    def _copy_file(self, request_number, msg):
+        src = msg.get_text()
+        dst = msg.get_text()
+        overwrite = msg.get_boolean()
+        if self.server.canonicalize(src) == self.server.canonicalize(dst):
+            self._send_status(request_number, SFTP_FAILURE,
+                              'Source and destination are the same file')
+            return
+        fr = self.server.open(src, os.O_RDONLY, SFTPAttributes())
+        if not isinstance(fr, SFTPHandle):
+            self._send_status(request_number, fr)
+            return
+        try:
+            flags = os.O_WRONLY | os.O_CREAT
+            flags |= os.O_TRUNC if overwrite else os.O_EXCL
+            fw = self.server.open(dst, flags, SFTPAttributes())
+            if not isinstance(fw, SFTPHandle):
+                self._send_status(request_number, fw)
+                return
+            try:
+                result = fr.copy_data(0, 0, fw, 0)
+            finally:
+                fw.close()
+        finally:
+            fr.close()
+        self._send_status(request_number, result)
+
     def _convert_pflags(self, pflags):
         """convert SFTP-style open() flags to Python's os.open() flags"""
         if (pflags & SFTP_FLAG_READ) and (pflags & SFTP_FLAG_WRITE):
@@ -333,6 +632,7 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
         elif t == CMD_CLOSE:
             handle = msg.get_binary()
             if handle in self.folder_table:
+                self.folder_table[handle].close()
                 del self.folder_table[handle]
                 self._send_status(request_number, SFTP_OK)
                 return
@@ -346,7 +646,7 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
         elif t == CMD_READ:
             handle = msg.get_binary()
             offset = msg.get_int64()
-            length = msg.get_int()
+            length = min(msg.get_int(), self.MAX_READ_LENGTH)
             if handle not in self.file_table:
                 self._send_status(
                     request_number, SFTP_BAD_MESSAGE, 'Invalid handle')
@@ -458,6 +758,26 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
             tag = msg.get_text()
             if tag == 'check-file':
                 self._check_file(request_number, msg)
+            elif tag == 'limits@openssh.com':
+                self._response(
+                    request_number, CMD_EXTENDED_REPLY,
+                    long(_MAX_MSG_LENGTH),
+                    long(self.MAX_READ_LENGTH),
+                    long(self.MAX_WRITE_LENGTH),
+                    long(0),  # no limit on open handles
+                )
+            elif tag == 'fsync@openssh.com':
+                handle = msg.get_binary()
+                if handle not in self.file_table:
+                    self._send_status(
+                        request_number, SFTP_BAD_MESSAGE, 'Invalid handle')
+                    return
+                self._send_status(
+                    request_number, self.file_table[handle].fsync())
+            elif tag == 'copy-data':
+                self._copy_data(request_number, msg)
+            elif tag == 'copy-file':
+                self._copy_file(request_number, msg)
             elif tag == 'posix-rename@openssh.com':
                 oldpath = msg.get_text()
                 newpath = msg.get_text()
@@ -470,4 +790,39 @@ class SFTPServer (BaseSFTP, SubsystemHandler):
             self._send_status(request_number, SFTP_OP_UNSUPPORTED)
 
 
+def _digest(alg, chunks):
+    hash_obj = alg()
+    for chunk in chunks:
+        hash_obj.update(chunk)
+    return hash_obj.digest()
+
+
+def _scan_entries(path):
+    entries = os.scandir(path)
+    try:
+        yield None
+        for entry in entries:
+            try:
+                attr = SFTPAttributes.from_stat(
+                    entry.stat(follow_symlinks=False))
+            except OSError:
+                continue
+            attr.filename = entry.name
+            yield attr
+    finally:
+        # (only possible from python 3.6)
+        if hasattr(entries, 'close'):
+            entries.close()
+
+
+def _scan_names(path, names):
+    for name in names:
+        try:
+            attr = SFTPAttributes.from_stat(os.lstat(os.path.join(path, name)))
+        except OSError:
+            continue
+        attr.filename = name
+        yield attr
+
+
 from paramiko.sftp_handle import SFTPHandle  # noqa: E402
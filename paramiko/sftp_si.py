@@ -119,6 +119,11 @@ class SFTPServerInterface (object):
         not normally present in ``os.stat`` results.  The method
         `.SFTPAttributes.from_stat` will usually do what you want.
 
+        Instead of a list, any iterable (like a generator) may be returned.
+        It is consumed a batch at a time, as the client reads the listing, so
+        for large folders the files need only be stat'd as they're sent.
+        `.SFTPServer.scan_folder` does that for a local folder.
+
         In case of an error, you should return one of the ``SFTP_*`` error
         codes, such as ``SFTP_PERMISSION_DENIED``.
 
@@ -0,0 +1,784 @@
+# This file is part of paramiko.
+#
+# Paramiko is free software; you can redistribute it and/or modify it under the
+# terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation; either version 2.1 of the License, or (at your option)
+# any later version.
+#
+# Paramiko is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR
+# A PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with Paramiko; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA.
+
+"""
+Windowed file transfers, of one file or many at once, and pipelined directory
+walks over an `.SFTPClient`.
+"""
+
+from collections import deque
+import hashlib
+import mmap
+import os
+import stat
+
+from paramiko.py3compat import long
+from paramiko.sftp import (
+    CMD_OPEN, CMD_CLOSE, CMD_READ, CMD_WRITE, CMD_STAT, CMD_HANDLE, CMD_ATTRS,
+    CMD_DATA, CMD_STATUS, CMD_EXTENDED, CMD_EXTENDED_REPLY, CMD_FSETSTAT,
+    CMD_OPENDIR, CMD_READDIR, CMD_NAME,
+    SFTP_FLAG_READ, SFTP_FLAG_WRITE, SFTP_FLAG_CREATE,
+    SFTP_FLAG_TRUNC, SFTPError,
+)
+from paramiko.sftp_attr import SFTPAttributes
+from paramiko.sftp_file import SFTPFile
+
+
+class TransferResult (object):
+    """
+    The outcome of one file transferred by `.SFTPClient.get_many` or
+    `.SFTPClient.put_many`.
+    """
+
+    def __init__(self, remotepath, localpath):
+        #: The path on the server, as given
+        self.remotepath = remotepath
+        #: The local path, as given
+        self.localpath = localpath
+        #: How many bytes were transferred
+        self.size = 0
+        #: The exception which prevented the transfer from completing, if any
+        self.exception = None
+
+    def __repr__(self):
+        if self.exception is not None:
+            return '<paramiko.TransferResult {!r}: {!r}>'.format(
+                self.remotepath, self.exception)
+        return '<paramiko.TransferResult {!r}: {} bytes>'.format(
+            self.remotepath, self.size)
+
+
+def _run_transfer(sftp, transfer):
+    """
+    Drive a single `_Download` or `_Upload` to completion, returning the number
+    of bytes transferred.
+    """
+    transfer.fill()
+    while not transfer.done:
+        sftp._read_response()
+        transfer.fill()
+    if transfer.exception is not None:
+        raise transfer.exception
+    return transfer.size
+
+
+def _run_transfers(sftp, jobs, max_files, max_requests, callback=None):
+    """
+    Run many `_TransferJob` at once over ``sftp``: up to ``max_files`` of them
+    are open at a time, and their requests share a window of
+    ``max_requests`` in flight.
+    """
+    transfers = _Transfers(max_files, max_requests, callback)
+    for job in jobs:
+        transfers.add(job)
+    transfers.fill()
+    while not transfers.done:
+        sftp._read_response()
+        transfers.fill()
+
+
+class _Transfers (object):
+    """
+    The scheduler behind `_run_transfers`, for callers which add jobs as they
+    go (like a tree walk) and read the responses themselves.
+    """
+
+    def __init__(self, max_files, max_requests, callback=None):
+        self.max_files = max_files
+        self.max_requests = max_requests
+        self._progress = _Progress(callback)
+        self._todo = deque()
+        self._active = []
+
+    @property
+    def in_flight(self):
+        return sum(job.in_flight for job in self._active)
+
+    @property
+    def done(self):
+        return not self._todo and not self._active
+
+    def add(self, job):
+        self._todo.append(job)
+
+    def fill(self):
+        """start more jobs, and send more requests, as the limits allow"""
+        while True:
+            while self._todo and len(self._active) < self.max_files:
+                job = self._todo.popleft()
+                job.start(self._progress)
+                self._active.append(job)
+
+            room = self.max_requests - self.in_flight
+            for job in self._active:
+                if room <= 0:
+                    break
+                room -= job.fill(room)
+
+            finished = [job for job in self._active if job.done]
+            for job in finished:
+                self._active.remove(job)
+            # a job can finish without sending anything (e.g. if its local
+            # file can't be opened), so keep going until something is sent
+            if not finished or self.in_flight:
+                return
+
+
+def _run_requests(sftp, requests, max_requests):
+    """
+    Send many independent requests (each a tuple of the request type and its
+    arguments), with up to ``max_requests`` in flight at once.  Return a list
+    with the response to each, in the same order: ``(type, message)`` for a
+    successful request (already checked, for those answered by a status), or
+    the exception it failed with.
+    """
+    batch = _Requests(sftp, requests, max_requests)
+    batch.fill()
+    while batch.in_flight:
+        sftp._read_response()
+        batch.fill()
+    return batch.responses
+
+
+class _Requests (object):
+    """The request window behind `_run_requests`."""
+
+    def __init__(self, sftp, requests, max_requests):
+        self.sftp = sftp
+        self.requests = list(requests)
+        self.max_requests = max_requests
+        self.responses = [None] * len(self.requests)
+        self._next = 0
+        self._pending = {}  # request number -> index
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def fill(self):
+        while (
+            len(self._pending) < self.max_requests and
+            self._next < len(self.requests)
+        ):
+            request = self.requests[self._next]
+            num = self.sftp._async_request(self, *request)
+            self._pending[num] = self._next
+            self._next += 1
+
+    def _async_response(self, t, msg, num):
+        i = self._pending.pop(num)
+        if t == CMD_STATUS:
+            try:
+                self.sftp._convert_status(msg)
+            except Exception as e:
+                self.responses[i] = e
+                return
+        self.responses[i] = (t, msg)
+
+
+class _Progress (object):
+    """Adds up the bytes moved by many transfers, for one callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+        self.size = 0
+        self.total = 0
+
+    def expect(self, size):
+        self.total += size
+
+    def __call__(self, size):
+        self.size += size
+        if self.callback is not None:
+            self.callback(self.size, self.total)
+
+
+def _write_at(fd, data, offset):
+    while data:
+        if hasattr(os, 'pwrite'):
+            n = os.pwrite(fd, data, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            n = os.write(fd, data)
+        data = data[n:]
+        offset += n
+
+
+class _Upload (object):
+    """
+    Writes ``data`` (a memoryview of a mapped local file) to a remote file,
+    with a window of write requests in flight.  Each request carries a slice
+    of the view, so the file's contents are only copied into the packets.
+    Errors are kept in ``exception`` (no more requests are sent after one).
+    """
+
+    def __init__(self, sftp, handle, data, max_requests, chunk_size,
+                 callback=None):
+        self.sftp = sftp
+        self.handle = handle
+        self.data = data
+        self.max_requests = max_requests
+        self.chunk_size = chunk_size
+        # called with the size of each acknowledged write
+        self.callback = callback
+        self.size = 0
+        self.exception = None
+        self._next = 0
+        self._pending = {}  # request number -> length
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    @property
+    def done(self):
+        if self._pending:
+            return False
+        return self.exception is not None or self._next >= len(self.data)
+
+    def fill(self, room=None):
+        """send more requests, at most ``room``; return how many were sent"""
+        sent = 0
+        while (
+            len(self._pending) < self.max_requests and
+            (room is None or sent < room) and
+            self.exception is None and
+            self._next < len(self.data)
+        ):
+            offset = self._next
+            length = min(self.chunk_size, len(self.data) - offset)
+            num = self.sftp._async_request(
+                self, CMD_WRITE, self.handle, long(offset),
+                self.data[offset:offset + length])
+            self._pending[num] = length
+            self._next += length
+            sent += 1
+        return sent
+
+    def _async_response(self, t, msg, num):
+        length = self._pending.pop(num)
+        if t != CMD_STATUS:
+            if self.exception is None:
+                self.exception = SFTPError('Expected status')
+            return
+        try:
+            self.sftp._convert_status(msg)
+        except Exception as e:
+            if self.exception is None:
+                self.exception = e
+            return
+        self.size += length
+        if self.callback is not None:
+            self.callback(length)
+
+
+class _Download (object):
+    """
+    Reads a remote file with a window of read requests in flight, writing
+    each response straight to its offset in a local file as it arrives.
+
+    Reading goes on past ``file_size`` if the file turns out to have grown
+    (or if the size is ``None``), until EOF.  Short reads are re-requested for
+    the rest.  Errors are kept in ``exception`` (no more requests are sent
+    after one).
+    """
+
+    def __init__(self, sftp, handle, fd, file_size, max_requests, chunk_size,
+                 callback=None):
+        self.sftp = sftp
+        self.handle = handle
+        self.fd = fd
+        self.max_requests = max_requests
+        self.chunk_size = chunk_size
+        # called with the size of each chunk written
+        self.callback = callback
+        self.size = 0
+        self.exception = None
+        # don't read past this offset (None: read until EOF), except for one
+        # request to check for EOF there
+        self._limit = file_size
+        self._probed = False
+        self._eof = None
+        self._next = 0
+        self._retry = deque()
+        self._pending = {}  # request number -> (offset, length)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    @property
+    def done(self):
+        if self._pending:
+            return False
+        if self.exception is not None:
+            return True
+        if self._retry:
+            return False
+        return self._eof is not None
+
+    def fill(self, room=None):
+        """send more requests, at most ``room``; return how many were sent"""
+        sent = 0
+        while (
+            len(self._pending) < self.max_requests and
+            (room is None or sent < room)
+        ):
+            chunk = self._next_chunk()
+            if chunk is None:
+                break
+            offset, length = chunk
+            num = self.sftp._async_request(
+                self, CMD_READ, self.handle, long(offset), int(length))
+            self._pending[num] = chunk
+            sent += 1
+        return sent
+
+    def _next_chunk(self):
+        if self.exception is not None:
+            return None
+        if self._retry:
+            return self._retry.popleft()
+        if self._eof is not None:
+            return None
+        length = self.chunk_size
+        if self._limit is not None:
+            if self._next < self._limit:
+                length = min(length, self._limit - self._next)
+            elif self._probed:
+                return None
+            else:
+                self._probed = True
+        chunk = (self._next, length)
+        self._next += length
+        return chunk
+
+    def _async_response(self, t, msg, num):
+        offset, length = self._pending.pop(num)
+        if t == CMD_STATUS:
+            try:
+                self.sftp._convert_status(msg)
+            except EOFError:
+                if self._eof is None or offset < self._eof:
+                    self._eof = offset
+            except Exception as e:
+                if self.exception is None:
+                    self.exception = e
+            return
+        if t != CMD_DATA:
+            if self.exception is None:
+                self.exception = SFTPError('Expected data')
+            return
+        data = msg.get_string()
+        if not data:
+            if self._eof is None or offset < self._eof:
+                self._eof = offset
+            return
+        try:
+            _write_at(self.fd, data, offset)
+        except (IOError, OSError) as e:
+            if self.exception is None:
+                self.exception = e
+            return
+        self.size += len(data)
+        if len(data) < length:
+            self._retry.append((offset + len(data), length - len(data)))
+        if self._limit is not None and offset >= self._limit:
+            # the file has grown since its size was taken
+            self._limit = None
+        if self.callback is not None:
+            self.callback(len(data))
+
+
+class _TransferJob (object):
+    """
+    One file of a `_run_transfers` batch.  The remote file is opened (along
+    with a stat, for downloads), copied with a `_Download` or `_Upload`, and
+    closed, all without blocking, so many of these can be interleaved.
+
+    If ``attrs`` (an `.SFTPAttributes`) is given, its mode and times are set
+    on the copy: on the remote file before closing it, or on the local file
+    once it's complete.
+    """
+
+    def __init__(self, sftp, result, upload, max_requests, attrs=None):
+        self.sftp = sftp
+        self.result = result
+        self.upload = upload
+        self.max_requests = max_requests
+        self.attrs = attrs
+        self.done = False
+        # request number -> 'stat', 'open', 'setstat' or 'close'
+        self._pending = {}
+        self._size = None
+        self._path = None
+        self._flags = 0
+        self._handle = None
+        self._closing = False
+        self._file = None
+        self._map = None
+        self._transfer = None
+        self._progress = None
+
+    @property
+    def in_flight(self):
+        n = len(self._pending)
+        if self._transfer is not None:
+            n += self._transfer.in_flight
+        return n
+
+    def start(self, progress):
+        self._progress = progress
+        path = self.sftp._adjust_cwd(self.result.remotepath)
+        if self.upload:
+            try:
+                self._file = open(self.result.localpath, 'rb')
+                size = os.fstat(self._file.fileno()).st_size
+                if size:
+                    self._map = mmap.mmap(
+                        self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except EnvironmentError as e:
+                self._fail(e)
+                return
+            progress.expect(size)
+            flags = SFTP_FLAG_WRITE | SFTP_FLAG_CREATE | SFTP_FLAG_TRUNC
+        else:
+            self._send('stat', CMD_STAT, path)
+            flags = SFTP_FLAG_READ
+        self._path = path
+        self._flags = flags
+        self._send('open', CMD_OPEN, path, flags, SFTPAttributes())
+
+    def fill(self, room):
+        sent = 0
+        if self._transfer is not None:
+            sent = self._transfer.fill(room)
+            if self._transfer.done:
+                if self._transfer.exception is not None:
+                    self._set_exception(self._transfer.exception)
+                self.result.size = self._transfer.size
+                self._transfer = None
+                self._close_local()
+                if (
+                    self.upload and self.attrs is not None and
+                    self.result.exception is None
+                ):
+                    self._send('setstat', CMD_FSETSTAT, self._handle,
+                               _settable(self.attrs))
+                    sent += 1
+                self._close()
+                sent += 1
+        return sent
+
+    def _send(self, kind, t, *args):
+        num = self.sftp._async_request(self, t, *args)
+        self._pending[num] = kind
+
+    def _close(self):
+        self._closing = True
+        self._send('close', CMD_CLOSE, self._handle)
+
+    def _async_response(self, t, msg, num):
+        kind = self._pending.pop(num)
+        if t == CMD_STATUS:
+            try:
+                self.sftp._convert_status(msg)
+            except Exception as e:
+                self._set_exception(e)
+            if kind == 'stat':
+                self._set_exception(SFTPError('Expected attributes'))
+            elif kind == 'open':
+                self._set_exception(SFTPError('Expected handle'))
+        elif kind == 'stat' and t == CMD_ATTRS:
+            self._size = SFTPAttributes._from_msg(msg).st_size
+            self._progress.expect(self._size or 0)
+        elif kind == 'open' and t == CMD_HANDLE:
+            self._handle = msg.get_binary()
+            if self.sftp._cache is not None:
+                self.sftp._cache.opened(self._handle, self._path, self._flags)
+        else:
+            self._set_exception(SFTPError('Unexpected response'))
+
+        # the stat and open may be answered in either order, so nothing is
+        # decided until both are
+        if self._pending:
+            return
+        if self._closing:
+            self.done = True
+            if (
+                not self.upload and self.attrs is not None and
+                self.result.exception is None
+            ):
+                try:
+                    _set_local_attrs(self.result.localpath, self.attrs)
+                except EnvironmentError as e:
+                    self._set_exception(e)
+        elif self._handle is None:
+            self._fail(self.result.exception)
+        elif self.result.exception is not None:
+            # opened, but the stat failed
+            self._close_local()
+            self._close()
+        else:
+            self._begin()
+
+    def _begin(self):
+        try:
+            if self.upload:
+                data = bytes()
+                if self._map is not None:
+                    try:
+                        data = memoryview(self._map)
+                    except TypeError:
+                        # python 2 can't make a memoryview of an mmap
+                        data = self._map
+                self._transfer = _Upload(
+                    self.sftp, self._handle, data, self.max_requests,
+                    self.sftp._max_write_size or SFTPFile.MAX_REQUEST_SIZE,
+                    self._progress)
+            else:
+                self._file = open(self.result.localpath, 'wb')
+                self._transfer = _Download(
+                    self.sftp, self._handle, self._file.fileno(), self._size,
+                    self.max_requests,
+                    self.sftp._max_read_size or SFTPFile.MAX_REQUEST_SIZE,
+                    self._progress)
+        except EnvironmentError as e:
+            self._set_exception(e)
+            self._close_local()
+            self._close()
+
+    def _set_exception(self, e):
+        if self.result.exception is None:
+            self.result.exception = e
+
+    def _fail(self, e):
+        self._set_exception(e)
+        self._close_local()
+        self.done = True
+
+    def _close_local(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # a slice is still referenced somewhere; the garbage
+                # collector will unmap it
+                pass
+            self._map = None
+        if self._file is not None:
+            try:
+                self._file.close()
+            except EnvironmentError as e:
+                self._set_exception(e)
+            self._file = None
+
+
+# block digests to ask for in each "check-file" request, to keep the replies
+# reasonably small
+_CHECK_BLOCKS_PER_REQUEST = 2048
+
+
+def _blocks(start, end, block_size):
+    """``(offset, length)`` of each ``block_size`` block from start to end"""
+    return [(offset, min(block_size, end - offset))
+            for offset in range(start, end, block_size)]
+
+
+def _local_block_hashes(f, algorithm, length, block_size):
+    """digests of each block of the local file ``f``, up to ``length``"""
+    digests = []
+    f.seek(0)
+    for offset, size in _blocks(0, length, block_size):
+        data = f.read(size)
+        if not data:
+            break
+        digests.append(hashlib.new(algorithm, data).digest())
+    return digests
+
+
+def _remote_block_hashes(sftp, handle, algorithm, length, block_size,
+                         max_requests):
+    """
+    digests of each block of an open remote file, up to ``length``, with the
+    "check-file" extension (with several requests in flight, for big files)
+    """
+    step = block_size * _CHECK_BLOCKS_PER_REQUEST
+    requests = [
+        (CMD_EXTENDED, 'check-file', handle, algorithm, long(offset),
+         long(size), block_size)
+        for offset, size in _blocks(0, length, step)
+    ]
+    digest_size = hashlib.new(algorithm).digest_size
+    digests = []
+    for response in _run_requests(sftp, requests, max_requests):
+        if isinstance(response, Exception):
+            raise response
+        t, msg = response
+        if t != CMD_EXTENDED_REPLY:
+            raise SFTPError('Expected extended reply')
+        msg.get_text()  # ext
+        msg.get_text()  # alg
+        data = msg.get_remainder()
+        digests.extend(data[i:i + digest_size]
+                       for i in range(0, len(data), digest_size))
+    return digests
+
+
+def _changed_blocks(local, remote, length, block_size):
+    """the blocks, up to ``length``, whose digests aren't the same"""
+    return [
+        block for i, block in enumerate(_blocks(0, length, block_size))
+        if i >= len(local) or i >= len(remote) or local[i] != remote[i]
+    ]
+
+
+def _settable(attrs):
+    """the mode and times of ``attrs``, to set on a copy of the file"""
+    copy = SFTPAttributes()
+    if attrs.st_mode is not None:
+        copy.st_mode = stat.S_IMODE(attrs.st_mode)
+    if attrs.st_atime is not None and attrs.st_mtime is not None:
+        copy.st_atime = int(attrs.st_atime)
+        copy.st_mtime = int(attrs.st_mtime)
+    return copy
+
+
+def _set_local_attrs(path, attrs):
+    if attrs.st_atime is not None and attrs.st_mtime is not None:
+        os.utime(path, (attrs.st_atime, attrs.st_mtime))
+    if attrs.st_mode is not None:
+        os.chmod(path, stat.S_IMODE(attrs.st_mode))
+
+
+def _stat(path):
+    """`os.stat`, or ``None`` if the file can't be found"""
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _unchanged(st, attrs):
+    """
+    whether local and remote files (given a `os.stat` result and an
+    `.SFTPAttributes`) look the same, by size and modification time
+    """
+    return (
+        st is not None and attrs is not None and
+        attrs.st_size == st.st_size and
+        attrs.st_mtime is not None and
+        int(attrs.st_mtime) == int(st.st_mtime)
+    )
+
+
+class _Walker (object):
+    """
+    Lists remote directories, with up to ``max_dirs`` of them being opened
+    and read at once.  Directories to list are queued with `add`; as each
+    one is read completely, ``(path, [SFTPAttributes])`` is appended to
+    ``results`` (without ``.`` and ``..``), or ``(path, exception)`` to
+    ``errors`` if it couldn't be read.  Only one READDIR is outstanding per
+    directory, since each depends on the previous one reaching the server.
+    """
+
+    def __init__(self, sftp, max_dirs):
+        self.sftp = sftp
+        self.max_dirs = max_dirs
+        self.results = deque()
+        self.errors = deque()
+        self._todo = deque()
+        self._open = 0
+        self._cancelled = False
+        self._pending = {}  # request number -> (kind, _Listing)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    @property
+    def done(self):
+        return not self._todo and not self._pending
+
+    def add(self, path):
+        self._todo.append(path)
+
+    def cancel(self):
+        """
+        stop listing: directories already open are closed as soon as their
+        outstanding request is answered, and nothing more is reported
+        """
+        self._cancelled = True
+        self._todo.clear()
+
+    def fill(self):
+        while self._todo and self._open < self.max_dirs:
+            listing = _Listing(self._todo.popleft())
+            self._open += 1
+            self._send('opendir', listing, CMD_OPENDIR,
+                       self.sftp._adjust_cwd(listing.path))
+
+    def _send(self, kind, listing, t, *args):
+        num = self.sftp._async_request(self, t, *args)
+        self._pending[num] = (kind, listing)
+
+    def _async_response(self, t, msg, num):
+        kind, listing = self._pending.pop(num)
+        if kind == 'close':
+            return
+        more = False
+        error = SFTPError('Unexpected response')
+        if kind == 'opendir' and t == CMD_HANDLE:
+            listing.handle = msg.get_binary()
+            more = True
+        elif kind == 'readdir' and t == CMD_NAME:
+            for i in range(msg.get_int()):
+                filename = msg.get_text()
+                longname = msg.get_string()
+                attr = SFTPAttributes._from_msg(msg, filename, longname)
+                if filename not in ('.', '..'):
+                    listing.entries.append(attr)
+            more = True
+        elif t == CMD_STATUS:
+            # a status ends the listing: EOF after reading it, or an error
+            try:
+                self.sftp._convert_status(msg)
+            except EOFError as e:
+                error = None if kind == 'readdir' else e
+            except Exception as e:
+                error = e
+        if more and not self._cancelled:
+            self._send('readdir', listing, CMD_READDIR, listing.handle)
+            return
+
+        self._open -= 1
+        if listing.handle is not None:
+            self._send('close', listing, CMD_CLOSE, listing.handle)
+        if self._cancelled:
+            return
+        if error is None:
+            self.results.append((listing.path, listing.entries))
+        else:
+            self.errors.append((listing.path, error))
+
+
+class _Listing (object):
+    """a directory being read by a `_Walker`"""
+
+    def __init__(self, path):
+        self.path = path
+        self.handle = None
+        self.entries = []
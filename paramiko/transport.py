@@ -28,6 +28,7 @@ import threading
 import time
 import atexit
 import weakref
+from concurrent.futures import Future
 from getpass import getpass
 from hashlib import sha1, sha256, sha512
 
@@ -66,6 +67,7 @@ from paramiko.kex_curve25519 import KexCurve25519
 from paramiko.kex_gss import KexGSSGex, KexGSSGroup1, KexGSSGroup14
 from paramiko.message import Message
 from paramiko.packet import Packetizer, NeedRekeyException
+from paramiko.pipe import ReadySet
 from paramiko.primes import ModulusPack
 from paramiko.py3compat import string_types, long, byte_ord, b, input, PY2
 from paramiko.rsakey import RSAKey
@@ -364,6 +366,9 @@ class Transport(threading.Thread, ClosingContextManager):
         self._channels = ChannelMap()
         self.channel_events = {}       # (id -> Event)
         self.channels_seen = {}        # (id -> True)
+        self._channel_futures = {}     # (id -> (Future, Channel))
+        # channels with data/EOF waiting, for select_channels()
+        self._ready_channels = ReadySet()
         self._channel_counter = 0
         self.default_max_packet_size = default_max_packet_size
         self.default_window_size = default_window_size
@@ -690,6 +695,7 @@ class Transport(threading.Thread, ClosingContextManager):
         self.stop_thread()
         for chan in list(self._channels.values()):
             chan._unlink()
+        self._fail_channel_futures()
         self.sock.close()
 
     def get_remote_server_key(self):
@@ -841,29 +847,10 @@ class Transport(threading.Thread, ClosingContextManager):
         timeout = 3600 if timeout is None else timeout
         self.lock.acquire()
         try:
-            window_size = self._sanitize_window_size(window_size)
-            max_packet_size = self._sanitize_packet_size(max_packet_size)
-            chanid = self._next_channel()
-            m = Message()
-            m.add_byte(cMSG_CHANNEL_OPEN)
-            m.add_string(kind)
-            m.add_int(chanid)
-            m.add_int(window_size)
-            m.add_int(max_packet_size)
-            if (kind == 'forwarded-tcpip') or (kind == 'direct-tcpip'):
-                m.add_string(dest_addr[0])
-                m.add_int(dest_addr[1])
-                m.add_string(src_addr[0])
-                m.add_int(src_addr[1])
-            elif kind == 'x11':
-                m.add_string(src_addr[0])
-                m.add_int(src_addr[1])
-            chan = Channel(chanid)
-            self._channels.put(chanid, chan)
+            chan, m = self._prepare_channel_open(
+                kind, dest_addr, src_addr, window_size, max_packet_size)
+            chanid = chan.chanid
             self.channel_events[chanid] = event = threading.Event()
-            self.channels_seen[chanid] = True
-            chan._set_transport(self)
-            chan._set_window(window_size, max_packet_size)
         finally:
             self.lock.release()
         self._send_user_message(m)
@@ -887,6 +874,78 @@ class Transport(threading.Thread, ClosingContextManager):
             e = SSHException('Unable to open channel.')
         raise e
 
+    def open_session_async(self, window_size=None, max_packet_size=None):
+        """
+        Request a new channel to the server, of type ``"session"``, without
+        waiting for the server's reply.  This is just an alias for calling
+        `open_channel_async` with an argument of ``"session"``.
+
+        :param int window_size:
+            optional window size for this session.
+        :param int max_packet_size:
+            optional max packet size for this session.
+
+        :return:
+            a `concurrent.futures.Future` which resolves to the new `.Channel`
+        """
+        return self.open_channel_async('session',
+                                       window_size=window_size,
+                                       max_packet_size=max_packet_size)
+
+    def open_channel_async(self,
+                           kind,
+                           dest_addr=None,
+                           src_addr=None,
+                           window_size=None,
+                           max_packet_size=None):
+        """
+        Request a new channel to the server, like `open_channel`, but return
+        immediately after sending the request instead of waiting for the
+        server's reply.  Many channel opens can thus be in flight at once,
+        costing one round trip in total instead of one round trip each.
+
+        The returned future resolves to the new `.Channel` once the server
+        accepts it.  If the server rejects it, the future raises
+        `.ChannelException`; if the session ends first, it raises the
+        session's exception (or `.SSHException`).  The request cannot be
+        cancelled once sent.  Use ``future.result(timeout)`` to wait for it.
+
+        :param str kind:
+            the kind of channel requested (see `open_channel`)
+        :param tuple dest_addr:
+            the destination address, for ``"forwarded-tcpip"`` or
+            ``"direct-tcpip"`` channels
+        :param src_addr:
+            the source address, for ``"forwarded-tcpip"``, ``"direct-tcpip"``,
+            or ``"x11"`` channels
+        :param int window_size:
+            optional window size for this session.
+        :param int max_packet_size:
+            optional max packet size for this session.
+
+        :return:
+            a `concurrent.futures.Future` which resolves to the new `.Channel`
+
+        :raises:
+            `.SSHException` -- if the session is not active
+        """
+        if not self.active:
+            raise SSHException('SSH session not active')
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.lock.acquire()
+        try:
+            chan, m = self._prepare_channel_open(
+                kind, dest_addr, src_addr, window_size, max_packet_size)
+            # the pending future holds the only strong ref to the new channel
+            self._channel_futures[chan.chanid] = (future, chan)
+        finally:
+            self.lock.release()
+        self._send_user_message(m)
+        if not self.active:
+            self._fail_channel_futures()
+        return future
+
     def request_port_forward(self, address, port, handler=None):
         """
         Ask the server to forward TCP connections from a listening port on
@@ -1024,7 +1083,7 @@ class Transport(threading.Thread, ClosingContextManager):
             return x.global_request('keepalive@lag.net', wait=False)
         self.packetizer.set_keepalive(interval, _request)
 
-    def global_request(self, kind, data=None, wait=True):
+    def global_request(self, kind, data=None, wait=True, timeout=None):
         """
         Make a global request to the remote host.  These are normally
         extensions to the SSH2 protocol.
@@ -1036,10 +1095,16 @@ class Transport(threading.Thread, ClosingContextManager):
         :param bool wait:
             ``True`` if this method should not return until a response is
             received; ``False`` otherwise.
+        :param float timeout:
+            if ``wait`` is ``True``, how many seconds to wait for the response
+            (default: forever, or until the session ends)
         :return:
             a `.Message` containing possible additional data if the request was
             successful (or an empty `.Message` if ``wait`` was ``False``);
             ``None`` if the request was denied.
+
+        :raises:
+            `.SSHException` -- if ``timeout`` passed before any response
         """
         if wait:
             self.completion_event = threading.Event()
@@ -1053,12 +1118,15 @@ class Transport(threading.Thread, ClosingContextManager):
         self._send_user_message(m)
         if not wait:
             return None
+        start_ts = time.time()
         while True:
             self.completion_event.wait(0.1)
             if not self.active:
                 return None
             if self.completion_event.is_set():
                 break
+            if timeout is not None and start_ts + timeout < time.time():
+                raise SSHException('Timeout waiting for global request response.')
         return self.global_response
 
     def accept(self, timeout=None):
@@ -1086,6 +1154,36 @@ class Transport(threading.Thread, ClosingContextManager):
             self.lock.release()
         return chan
 
+    def select_channels(self, channels=None, timeout=None):
+        """
+        Wait until at least one of the given channels is ready to be read
+        from, and return the ready ones.  A channel is ready when it has data
+        buffered on its stdout or stderr stream, or has reached EOF or been
+        closed by the remote side.
+
+        Unlike ``select`` on `.Channel.fileno`, this needs no OS-level file
+        descriptors per channel: all channels of a transport share one
+        notifier, so it scales to many thousands of channels.  Channels which
+        you close yourself stop being reported.
+
+        :param list channels:
+            the `Channels <.Channel>` of this transport to wait on, or ``None``
+            (the default) to wait on all of its open channels
+        :param float timeout:
+            seconds to wait, or ``None`` to wait forever
+        :return:
+            a `list` of the ready `Channels <.Channel>`, in no particular
+            order; empty if the timeout expired first
+        """
+        if channels is None:
+            channels = self._channels.values()
+        wanted = set()
+        for chan in channels:
+            if chan._ready_flag is None:
+                chan._set_ready_flag(self._ready_channels.make_flag(chan))
+            wanted.add(chan)
+        return self._ready_channels.wait(wanted, timeout)
+
     def connect(
         self,
         hostkey=None,
@@ -1690,6 +1788,52 @@ class Transport(threading.Thread, ClosingContextManager):
         self._channel_counter = (self._channel_counter + 1) & 0xffffff
         return chanid
 
+    def _prepare_channel_open(self, kind, dest_addr, src_addr, window_size,
+                              max_packet_size):
+        """
+        you are holding the lock.  Create and register a new channel, and
+        return it along with the CHANNEL_OPEN message to send for it.
+        """
+        window_size = self._sanitize_window_size(window_size)
+        max_packet_size = self._sanitize_packet_size(max_packet_size)
+        chanid = self._next_channel()
+        m = Message()
+        m.add_byte(cMSG_CHANNEL_OPEN)
+        m.add_string(kind)
+        m.add_int(chanid)
+        m.add_int(window_size)
+        m.add_int(max_packet_size)
+        if (kind == 'forwarded-tcpip') or (kind == 'direct-tcpip'):
+            m.add_string(dest_addr[0])
+            m.add_int(dest_addr[1])
+            m.add_string(src_addr[0])
+            m.add_int(src_addr[1])
+        elif kind == 'x11':
+            m.add_string(src_addr[0])
+            m.add_int(src_addr[1])
+        chan = Channel(chanid)
+        self._channels.put(chanid, chan)
+        self.channels_seen[chanid] = True
+        chan._set_transport(self)
+        chan._set_window(window_size, max_packet_size)
+        return chan, m
+
+    def _fail_channel_futures(self):
+        """fail all pending open_channel_async futures (the session died)"""
+        self.lock.acquire()
+        try:
+            pending = list(self._channel_futures.values())
+            self._channel_futures.clear()
+            e = self.saved_exception
+        finally:
+            self.lock.release()
+        if isinstance(e, ChannelException):
+            # left over from an earlier open_channel(), not why we stopped
+            e = None
+        for future, chan in pending:
+            future.set_exception(
+                e or SSHException('Unable to open channel.'))
+
     def _unlink_channel(self, chanid):
         """used by a Channel to remove itself from the active channel list"""
         self._channels.delete(chanid)
@@ -1979,6 +2123,7 @@ class Transport(threading.Thread, ClosingContextManager):
                     self.auth_handler.abort()
                 for event in self.channel_events.values():
                     event.set()
+                self._fail_channel_futures()
                 try:
                     self.lock.acquire()
                     self.server_accept_cv.notify()
@@ -2468,8 +2613,11 @@ class Transport(threading.Thread, ClosingContextManager):
             if chanid in self.channel_events:
                 self.channel_events[chanid].set()
                 del self.channel_events[chanid]
+            pending = self._channel_futures.pop(chanid, None)
         finally:
             self.lock.release()
+        if pending is not None:
+            pending[0].set_result(chan)
         return
 
     def _parse_channel_open_failure(self, m):
@@ -2481,7 +2629,13 @@ class Transport(threading.Thread, ClosingContextManager):
         self._log(ERROR, "Secsh channel %d open FAILED: %s: %s", chanid, reason_str, reason_text)
         self.lock.acquire()
         try:
-            self.saved_exception = ChannelException(reason, reason_text)
+            pending = self._channel_futures.pop(chanid, None)
+            if pending is not None:
+                # reported through the future only: saved_exception is for
+                # whoever is waiting in open_channel()
+                self._channels.delete(chanid)
+            else:
+                self.saved_exception = ChannelException(reason, reason_text)
             if chanid in self.channel_events:
                 self._channels.delete(chanid)
                 if chanid in self.channel_events:
@@ -2489,6 +2643,8 @@ class Transport(threading.Thread, ClosingContextManager):
                     del self.channel_events[chanid]
         finally:
             self.lock.release()
+        if pending is not None:
+            pending[0].set_exception(ChannelException(reason, reason_text))
         return
 
     def _parse_channel_open(self, m):
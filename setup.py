@@ -87,6 +87,7 @@ setup(
     install_requires=[
         'bcrypt>=3',
         'cryptography>=2.6',
+        'futures;python_version<"3"',
     ],
     extras_require={
         'Ed25519': [],  # can be removed in 3.0
@@ -40,8 +40,11 @@ class StubServer (ServerInterface):
 
 class StubSFTPHandle (SFTPHandle):
     def stat(self):
+        fd = getattr(self, 'fd', None)
+        if fd is None:
+            fd = self.readfile.fileno()
         try:
-            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+            return SFTPAttributes.from_stat(os.fstat(fd))
         except OSError as e:
             return SFTPServer.convert_errno(e.errno)
 
@@ -59,6 +62,10 @@ class StubSFTPServer (SFTPServerInterface):
     # assume current folder is a fine root
     # (the tests always create and eventually delete a subfolder, so there shouldn't be any mess)
     ROOT = os.getcwd()
+    # give handles a raw file descriptor, instead of file objects
+    USE_FD = False
+    # list folders lazily with SFTPServer.scan_folder (which lstats entries)
+    SCAN_FOLDER = False
 
     def _realpath(self, path):
         return self.ROOT + self.canonicalize(path)
@@ -66,6 +73,8 @@ class StubSFTPServer (SFTPServerInterface):
     def list_folder(self, path):
         path = self._realpath(path)
         try:
+            if self.SCAN_FOLDER:
+                return SFTPServer.scan_folder(path)
             out = []
             flist = os.listdir(path)
             for fname in flist:
@@ -107,6 +116,11 @@ class StubSFTPServer (SFTPServerInterface):
         if (flags & os.O_CREAT) and (attr is not None):
             attr._flags &= ~attr.FLAG_PERMISSIONS
             SFTPServer.set_file_attr(path, attr)
+        if self.USE_FD:
+            fobj = StubSFTPHandle(flags)
+            fobj.filename = path
+            fobj.fd = fd
+            return fobj
         if flags & os.O_WRONLY:
             if flags & os.O_APPEND:
                 fstr = 'ab'
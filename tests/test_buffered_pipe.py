@@ -89,3 +89,17 @@ class BufferedPipeTest(unittest.TestCase):
         self.assertTrue(p._set)
         p2.clear()
         self.assertFalse(p._set)
+
+    def test_ready_set(self):
+        rs = pipe.ReadySet()
+        a, b = BufferedPipe(), BufferedPipe()
+        a.set_event(rs.make_flag(a))
+        b.set_event(rs.make_flag(b))
+        self.assertEqual([], rs.wait(timeout=0))
+        b.feed('x')
+        self.assertEqual([b], rs.wait(timeout=0))
+        self.assertEqual([], rs.wait(set([a]), timeout=0.1))
+        threading.Timer(0.1, a.close).start()
+        self.assertEqual([a], rs.wait(set([a]), timeout=1.0))
+        self.assertEqual(b'x', b.read(1))
+        self.assertEqual([a], rs.wait(timeout=0))
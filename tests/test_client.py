@@ -617,6 +617,88 @@ class SSHClientTest(ClientTest):
         self.assertEqual(target_env, getattr(schan, 'env', {}))
         schan.close()
 
+    def test_exec_commands(self):
+        """
+        Verify that a batch of commands runs over concurrent channels.
+        """
+        self._setup_for_env()
+        commands = ['yes'] * 7 + ['no']
+
+        def serve():
+            for i in range(len(commands)):
+                schan = self.ts.accept(5.0)
+                # client sends EOF right after the exec request
+                schan.recv(1)
+                try:
+                    schan.send('Hello there.\n')
+                    schan.send_stderr('This is on stderr.\n')
+                    schan.send_exit_status(3)
+                except socket.error:
+                    pass
+                schan.close()
+
+        server = threading.Thread(target=serve)
+        server.start()
+        done = []
+        results = self.tc.exec_commands(
+            commands, max_sessions=3, on_done=done.append)
+        server.join(5.0)
+
+        self.assertEqual(len(commands), len(done))
+        self.assertEqual(commands, [r.command for r in results])
+        for result in results[:-1]:
+            self.assertEqual(None, result.exception)
+            self.assertEqual(b'Hello there.\n', result.stdout)
+            self.assertEqual(b'This is on stderr.\n', result.stderr)
+            self.assertEqual(3, result.exit_status)
+        self.assertTrue(isinstance(results[-1].exception, SSHException))
+
+        # streamed output is not also collected
+        server = threading.Thread(target=serve)
+        server.start()
+        chunks = []
+        results = self.tc.exec_commands(
+            commands, on_stdout=lambda r, data: chunks.append((r, data)))
+        server.join(5.0)
+        self.assertEqual(b'', results[0].stdout)
+        self.assertEqual(b'This is on stderr.\n', results[0].stderr)
+        ok = [data for r, data in chunks if r.exception is None]
+        self.assertEqual(b'Hello there.\n' * 7, b''.join(ok))
+
+    def test_exec_commands_exit_status_timeout(self):
+        """
+        Verify that a command at EOF without an exit status times out, without
+        holding up the others.
+        """
+        self._setup_for_env()
+        hung = threading.Event()
+
+        def serve():
+            first = self.ts.accept(5.0)
+            first.recv(1)
+            first.send('Hello there.\n')
+            first.shutdown_write()
+            second = self.ts.accept(5.0)
+            second.recv(1)
+            second.send_exit_status(0)
+            second.close()
+            hung.wait(5.0)
+            first.close()
+
+        server = threading.Thread(target=serve)
+        server.start()
+        start = time.time()
+        try:
+            results = self.tc.exec_commands(['yes', 'yes'], timeout=1.0)
+        finally:
+            hung.set()
+            server.join(5.0)
+        self.assertTrue(time.time() - start < 3.0)
+        self.assertTrue(isinstance(results[0].exception, socket.timeout))
+        self.assertEqual(b'Hello there.\n', results[0].stdout)
+        self.assertEqual(None, results[1].exception)
+        self.assertEqual(0, results[1].exit_status)
+
     @unittest.skip("Clients normally fail silently, thus so do we, for now")
     def test_env_update_failures(self):
         self._setup_for_env()
@@ -689,3 +771,154 @@ class PasswordPassphraseTests(ClientTest):
             password='television',
             passphrase='wat? lol no',
         )
+
+
+class MultiConnectionTest(unittest.TestCase):
+    """
+    Base for tests which need a server accepting many connections.
+    """
+    def setUp(self):
+        self.sockl = socket.socket()
+        self.sockl.bind(('localhost', 0))
+        self.sockl.listen(5)
+        self.sockl.settimeout(0.1)
+        self.addr, self.port = self.sockl.getsockname()
+        self.transports = []
+        self.host_key = paramiko.RSAKey.from_private_key_file(_support('test_rsa.key'))
+        self.done = threading.Event()
+        self.server = threading.Thread(target=self._serve)
+        self.server.start()
+
+    def tearDown(self):
+        self.done.set()
+        self.server.join()
+        self.sockl.close()
+        for t in self.transports:
+            t.close()
+
+    def _serve(self):
+        while not self.done.is_set():
+            try:
+                socks, addr = self.sockl.accept()
+            except socket.timeout:
+                continue
+            socks.settimeout(None)
+            ts = paramiko.Transport(socks)
+            ts.add_server_key(self.host_key)
+            ts.start_server(server=NullServer())
+            self.transports.append(ts)
+            threading.Thread(target=self._respond, args=(ts,)).start()
+
+    def _respond(self, ts):
+        while True:
+            schan = ts.accept(5.0)
+            if schan is None:
+                return
+            # clients here send EOF after the exec request
+            schan.recv(1)
+            schan.send('Hello there.\n')
+            schan.send_exit_status(0)
+            schan.close()
+
+
+class HostExecutorTest(MultiConnectionTest):
+    def test_run(self):
+        # a port with nothing listening on it
+        unused = socket.socket()
+        unused.bind(('localhost', 0))
+        unused_port = unused.getsockname()[1]
+        unused.close()
+
+        config = paramiko.SSHConfig()
+        config.parse([
+            'Host unused\n',
+            '    Port {}\n'.format(unused_port),
+            'Host *\n',
+            '    HostName {}\n'.format(self.addr),
+            '    Port {}\n'.format(self.port),
+            '    User slowdive\n',
+        ])
+        with paramiko.HostExecutor(
+            max_workers=2, ssh_config=config, password='pygmalion',
+            allow_agent=False,
+        ) as executor:
+            executor.set_missing_host_key_policy(paramiko.AutoAddPolicy)
+            hosts = ['alias1', 'alias2', 'alias3', 'unused']
+            results = dict((r.host, r) for r in executor.run(hosts, 'yes'))
+            self.assertEqual(set(hosts), set(results))
+            for host in hosts[:3]:
+                self.assertEqual(None, results[host].exception)
+                self.assertEqual(b'Hello there.\n', results[host].value.stdout)
+                self.assertEqual(0, results[host].value.exit_status)
+            self.assertTrue(results['unused'].exception is not None)
+            # host keys are accepted into the shared HostKeys
+            self.assertEqual(
+                ['[{}]:{}'.format(self.addr, self.port)],
+                list(executor.get_host_keys().keys()),
+            )
+
+            def get_username(client):
+                return client.get_transport().get_username()
+            results = list(executor.run(['alias1'], get_username))
+            self.assertEqual('slowdive', results[0].value)
+
+
+class SSHConnectionPoolTest(MultiConnectionTest):
+    def _make_client(self):
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        return client
+
+    def _run_yes(self, pool):
+        with pool.session(self.addr, self.port, 'slowdive') as chan:
+            chan.exec_command('yes')
+            chan.shutdown_write()
+            self.assertEqual(b'Hello there.\n', chan.makefile().read())
+            self.assertEqual(0, chan.recv_exit_status())
+
+    def test_reuse(self):
+        with paramiko.SSHConnectionPool(
+            max_per_host=2, client_factory=self._make_client,
+            password='pygmalion', allow_agent=False, look_for_keys=False,
+        ) as pool:
+            for i in range(3):
+                self._run_yes(pool)
+            self.assertEqual(1, len(self.transports))
+
+            # limit reached: further borrowers wait, and may time out
+            c1 = pool.acquire(self.addr, self.port, 'slowdive')
+            c2 = pool.acquire(self.addr, self.port, 'slowdive')
+            self.assertTrue(c1 is not c2)
+            self.assertEqual(2, len(self.transports))
+            self.assertRaises(
+                SSHException, pool.acquire, self.addr, self.port,
+                'slowdive', 0.1,
+            )
+            threading.Timer(0.1, pool.release, args=(c2,)).start()
+            c3 = pool.acquire(self.addr, self.port, 'slowdive', 5.0)
+            self.assertTrue(c3 is c2)
+
+            # dead connections are dropped, not handed out
+            c3.get_transport().close()
+            pool.release(c3)
+            pool.release(c1)
+            c1.get_transport().close()
+            self._run_yes(pool)
+            self.assertEqual(3, len(self.transports))
+
+    def test_health_check_and_idle_eviction(self):
+        pool = paramiko.SSHConnectionPool(
+            check_after=0, idle_timeout=0.2, client_factory=self._make_client,
+            password='pygmalion', allow_agent=False, look_for_keys=False,
+        )
+        client = pool.acquire(self.addr, self.port, 'slowdive')
+        pool.release(client)
+        self.assertTrue(pool.acquire(self.addr, self.port, 'slowdive') is client)
+        pool.release(client)
+        for i in range(20):
+            if client.get_transport() is None:
+                break
+            time.sleep(0.1)
+        self.assertEqual(None, client.get_transport())
+        pool.close()
+        self.assertRaises(SSHException, pool.acquire, self.addr, self.port)
@@ -23,19 +23,32 @@ a real actual sftp server is contacted, and a new folder is created there to
 do test file operations in (so no existing files will be harmed).
 """
 
+import errno
+import gc
+import hashlib
 import os
+import shutil
 import socket
+import stat
 import sys
+import threading
+import time
 import warnings
 from binascii import hexlify
-from tempfile import mkstemp
+from tempfile import mkdtemp, mkstemp
 
 import pytest
 
+from paramiko import SFTP, SSHException
+from paramiko.message import Message
+from paramiko.sftp import CMD_EXTENDED, SFTP_OK, SFTPError
 from paramiko.py3compat import PY2, b, u, StringIO
 from paramiko.common import o777, o600, o666, o644
 from paramiko.sftp_attr import SFTPAttributes
+from paramiko.sftp_handle import SFTPHandle
+from paramiko.sftp_server import SFTPServer
 
+from .stub_sftp import StubSFTPHandle, StubSFTPServer
 from .util import needs_builtin
 from .util import slow
 
@@ -261,6 +274,62 @@ class TestSFTP(object):
             sftp.remove(sftp.FOLDER + '/fish.txt')
             sftp.remove(sftp.FOLDER + '/tertiary.py')
 
+    def test_listdir_streamed(self, sftp, monkeypatch):
+        """
+        verify that a large folder is listed in batches from a lazy listing,
+        and that entries which disappear before they're read are skipped.
+        """
+        monkeypatch.setattr(StubSFTPServer, 'SCAN_FOLDER', True)
+        names = set('file%03d' % i for i in range(250))
+        try:
+            for name in names:
+                open(os.path.join(sftp.FOLDER, name), 'w').close()
+            assert set(sftp.listdir(sftp.FOLDER)) == names
+
+            listing = SFTPServer.scan_folder(sftp.FOLDER)
+            first = next(listing)
+            os.remove(os.path.join(sftp.FOLDER, 'file249'))
+            rest = [attr.filename for attr in listing]
+            assert first.filename in names
+            assert set(rest) | set([first.filename]) == names - set(['file249'])
+            with pytest.raises(OSError):
+                SFTPServer.scan_folder(os.path.join(sftp.FOLDER, 'missing'))
+
+            # closing a folder handle closes the folder, read or not
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                for read in (0, 1):
+                    handle = SFTPHandle()
+                    handle._set_files(SFTPServer.scan_folder(sftp.FOLDER))
+                    assert len(handle._get_next_files(read)) == read
+                    handle.close()
+                    del handle
+                    gc.collect()
+            assert not [w for w in caught if 'scandir' in str(w.message)]
+        finally:
+            shutil.rmtree(sftp.FOLDER)
+            os.mkdir(sftp.FOLDER)
+
+    @pytest.mark.skipif("not hasattr(os, 'symlink')")  # on windows
+    def test_listdir_scanned_symlinks(self, sftp, monkeypatch):
+        """
+        verify that a folder listed with scan_folder describes symlinks
+        themselves, not what they point to.
+        """
+        monkeypatch.setattr(StubSFTPServer, 'SCAN_FOLDER', True)
+        try:
+            with sftp.open(sftp.FOLDER + '/original.txt', 'w') as f:
+                f.write('original\n')
+            sftp.symlink('original.txt', sftp.FOLDER + '/link.txt')
+            attrs = dict((attr.filename, attr)
+                         for attr in sftp.listdir_attr(sftp.FOLDER))
+            assert stat.S_ISREG(attrs['original.txt'].st_mode)
+            assert stat.S_ISLNK(attrs['link.txt'].st_mode)
+            assert attrs['link.txt'].st_size == len('original.txt')
+        finally:
+            sftp.remove(sftp.FOLDER + '/link.txt')
+            sftp.remove(sftp.FOLDER + '/original.txt')
+
     def test_listdir_iter_open(self, sftp):
         """
         open files while iterating over listdir_iter()
@@ -289,6 +358,48 @@ class TestSFTP(object):
             for i in range(60):
                 sftp.remove(sftp.FOLDER + "/file%02d.txt" % i)
 
+    def test_walk(self, sftp):
+        """
+        verify that walk() lists a whole tree, can be pruned, and can be
+        abandoned part way.
+        """
+        top = sftp.FOLDER + '/walk'
+        dirs = ['', '/a', '/a/x', '/b', '/b/y', '/b/y/z']
+        try:
+            for d in dirs:
+                sftp.mkdir(top + d)
+                for i in range(3):
+                    sftp.open(top + d + '/f%d' % i, 'w').close()
+
+            listing = {}
+            for dirpath, subdirs, files in sftp.walk(top, max_dirs=2):
+                listing[dirpath] = (sorted(a.filename for a in subdirs),
+                                    sorted(a.filename for a in files))
+            assert sorted(listing) == sorted(top + d for d in dirs)
+            assert listing[top] == (['a', 'b'], ['f0', 'f1', 'f2'])
+            assert listing[top + '/b/y'] == (['z'], ['f0', 'f1', 'f2'])
+            assert listing[top + '/b/y/z'] == ([], ['f0', 'f1', 'f2'])
+
+            seen = []
+            for dirpath, subdirs, files in sftp.walk(top):
+                seen.append(dirpath)
+                subdirs[:] = [a for a in subdirs if a.filename != 'b']
+            assert sorted(seen) == [top, top + '/a', top + '/a/x']
+
+            for dirpath, subdirs, files in sftp.walk(top):
+                break
+            assert sorted(sftp.listdir(top)) == ['a', 'b', 'f0', 'f1', 'f2']
+
+            errors = []
+            assert list(sftp.walk(top + '/missing', onerror=errors.append)) == []
+            assert errors[0].errno == errno.ENOENT
+            assert errors[0].filename == top + '/missing'
+        finally:
+            for d in reversed(dirs):
+                for i in range(3):
+                    sftp.remove(top + d + '/f%d' % i)
+                sftp.rmdir(top + d)
+
     def test_setstat(self, sftp):
         """
         verify that the setstat functions (chown, chmod, utime, truncate) work.
@@ -326,6 +437,40 @@ class TestSFTP(object):
         finally:
             sftp.remove(sftp.FOLDER + '/special')
 
+    def test_batch_metadata(self, sftp):
+        """
+        verify the batched stat, chmod, rename and remove operations, with
+        failures reported per path.
+        """
+        names = ['%s/batch%d' % (sftp.FOLDER, i) for i in range(100)]
+        for i, name in enumerate(names):
+            with sftp.open(name, 'w') as f:
+                f.write('x' * i)
+        missing = sftp.FOLDER + '/missing'
+        try:
+            results = sftp.stat_many(names + [missing],
+                                     max_concurrent_requests=8)
+            assert [r.st_size for r in results[:-1]] == list(range(100))
+            assert results[-1].errno == errno.ENOENT
+            assert sftp.lstat_many(names[:1])[0].st_size == 0
+
+            results = sftp.chmod_many([(name, o600) for name in names])
+            assert results == [None] * 100
+            if sys.platform != 'win32':
+                assert sftp.stat(names[-1]).st_mode & o777 == o600
+
+            results = sftp.rename_many(
+                [(name, name + '.old') for name in names] +
+                [(missing, missing + '.old')])
+            assert results[:-1] == [None] * 100
+            assert isinstance(results[-1], IOError)
+            names = [name + '.old' for name in names]
+        finally:
+            results = sftp.remove_many(names + [missing])
+            assert results[:-1] == [None] * 100
+            assert results[-1].errno == errno.ENOENT
+        assert sftp.listdir(sftp.FOLDER) == []
+
     def test_fsetstat(self, sftp):
         """
         verify that the fsetstat functions (chown, chmod, utime, truncate)
@@ -567,6 +712,144 @@ class TestSFTP(object):
         os.unlink(localname)
         sftp.unlink(sftp.FOLDER + '/bunny.txt')
 
+    def test_get_put_many(self, sftp):
+        """
+        verify that many files can be transferred at once, with failures
+        reported per file.
+        """
+        localdir = mkdtemp()
+        contents = [os.urandom(n * 1000) for n in range(20)]
+        try:
+            for i, data in enumerate(contents):
+                with open(os.path.join(localdir, 'up%d' % i), 'wb') as f:
+                    f.write(data)
+            names = ['%d' % i for i in range(len(contents))]
+            saved_progress = []
+
+            def progress(x, y):
+                saved_progress.append((x, y))
+            results = sftp.put_many(
+                [(os.path.join(localdir, 'up' + n), sftp.FOLDER + '/' + n)
+                 for n in names + ['missing']],
+                max_files=4, max_concurrent_requests=8, callback=progress)
+            assert [r.remotepath for r in results[:-1]] == \
+                [sftp.FOLDER + '/' + n for n in names]
+            assert [r.size for r in results[:-1]] == [len(c) for c in contents]
+            assert all(r.exception is None for r in results[:-1])
+            assert isinstance(results[-1].exception, IOError)
+            total = sum(len(c) for c in contents)
+            assert saved_progress[-1] == (total, total)
+
+            results = sftp.get_many(
+                [(sftp.FOLDER + '/' + n, os.path.join(localdir, 'down' + n))
+                 for n in ['missing'] + names],
+                max_files=4, max_concurrent_requests=8)
+            assert results[0].exception.errno == errno.ENOENT
+            for i, result in enumerate(results[1:]):
+                assert result.exception is None
+                assert result.size == len(contents[i])
+                with open(result.localpath, 'rb') as f:
+                    assert f.read() == contents[i]
+        finally:
+            shutil.rmtree(localdir)
+            for n in sftp.listdir(sftp.FOLDER):
+                sftp.remove(sftp.FOLDER + '/' + n)
+
+    def test_get_many_stat_failure(self, sftp, sftp_server, monkeypatch):
+        """
+        verify that a download fails if its stat does, and that it's only
+        finished once both its stat and open are answered.
+        """
+        stat = StubSFTPServer.stat
+
+        def slow_stat(self, path):
+            # answered after the open
+            time.sleep(0.5)
+            if path.endswith('/locked'):
+                return SFTPServer.convert_errno(errno.EACCES)
+            return stat(self, path)
+
+        monkeypatch.setattr(StubSFTPServer, 'stat', slow_stat)
+        monkeypatch.setattr(SFTPServer, 'MAX_WORKERS', 4)
+        client = SFTP.from_transport(sftp_server)
+        localdir = mkdtemp()
+        try:
+            with client.open(sftp.FOLDER + '/locked', 'w') as f:
+                f.write(b'secret')
+            results = client.get_many(
+                [(sftp.FOLDER + '/' + n, os.path.join(localdir, n))
+                 for n in ['missing', 'locked']])
+            assert results[0].exception.errno == errno.ENOENT
+            assert results[1].exception.errno == errno.EACCES
+            assert client.listdir(sftp.FOLDER) == ['locked']
+        finally:
+            shutil.rmtree(localdir)
+            client.remove(sftp.FOLDER + '/locked')
+            client.close()
+
+    def test_get_put_tree(self, sftp):
+        """
+        verify that directory trees can be copied both ways, preserving times
+        and skipping unchanged files.
+        """
+        localdir = mkdtemp()
+        src = os.path.join(localdir, 'src')
+        dst = os.path.join(localdir, 'dst')
+        remote = sftp.FOLDER + '/tree'
+        files = {
+            'a.txt': b'alpha\n',
+            os.path.join('sub', 'b.bin'): os.urandom(100000),
+            os.path.join('sub', 'deeper', 'c'): b'',
+        }
+        try:
+            os.makedirs(os.path.join(src, 'sub', 'deeper'))
+            os.mkdir(os.path.join(src, 'empty'))
+            for name, data in files.items():
+                with open(os.path.join(src, name), 'wb') as f:
+                    f.write(data)
+                os.utime(os.path.join(src, name), (1000000000, 1000000000))
+            os.chmod(os.path.join(src, 'a.txt'), o600)
+
+            results = sftp.put_tree(src, remote, preserve=True, max_files=2)
+            assert len(results) == 3
+            assert all(r.exception is None for r in results)
+            assert sftp.listdir(remote + '/empty') == []
+            attr = sftp.stat(remote + '/sub/b.bin')
+            assert attr.st_size == 100000
+            assert attr.st_mtime == 1000000000
+            assert sftp.stat(remote + '/a.txt').st_mode & o777 == o600
+
+            results = sftp.put_tree(src, remote, skip_unchanged=True)
+            assert results == []
+
+            results = sftp.get_tree(remote, dst, preserve=True, max_files=2)
+            assert sorted(r.remotepath for r in results) == \
+                sorted(remote + '/' + name.replace(os.sep, '/')
+                       for name in files)
+            assert all(r.exception is None for r in results)
+            assert os.path.isdir(os.path.join(dst, 'empty'))
+            for name, data in files.items():
+                with open(os.path.join(dst, name), 'rb') as f:
+                    assert f.read() == data
+                assert os.stat(os.path.join(dst, name)).st_mtime == 1000000000
+
+            with open(os.path.join(dst, 'a.txt'), 'wb') as f:
+                f.write(b'changed')
+            results = sftp.get_tree(remote, dst, skip_unchanged=True)
+            assert [r.remotepath for r in results] == [remote + '/a.txt']
+            with open(os.path.join(dst, 'a.txt'), 'rb') as f:
+                assert f.read() == b'alpha\n'
+
+            with pytest.raises(IOError):
+                sftp.get_tree(remote + '/missing', dst)
+        finally:
+            shutil.rmtree(localdir)
+            for path in ['sub/deeper/c', 'sub/b.bin', 'a.txt']:
+                sftp.remove(remote + '/' + path)
+            for path in ['sub/deeper', 'sub', 'empty']:
+                sftp.rmdir(remote + '/' + path)
+            sftp.rmdir(remote)
+
     def test_check(self, sftp):
         """
         verify that file.check() works against our own server.
@@ -587,6 +870,585 @@ class TestSFTP(object):
         finally:
             sftp.unlink(sftp.FOLDER + '/kitty.txt')
 
+    def test_check_blocks(self, sftp, sftp_server, monkeypatch):
+        """
+        verify check() with newer hashes, with many blocks hashed in parallel,
+        and with blocks bigger than the server reads at once.
+        """
+        monkeypatch.setattr(SFTPServer, 'CHECK_FILE_READ_SIZE', 100000)
+        threads = set()
+        read = StubSFTPHandle.read
+
+        def recorded_read(self, offset, length):
+            threads.add(threading.current_thread())
+            return read(self, offset, length)
+
+        monkeypatch.setattr(StubSFTPHandle, 'read', recorded_read)
+        client = SFTP.from_transport(sftp_server)
+        data = os.urandom(1000000)
+        path = sftp.FOLDER + '/blocks.bin'
+        try:
+            assert 'sha256' in client._extensions['check-file'].decode()
+            with client.open(path, 'wb') as f:
+                f.write(data)
+            with client.open(path, 'rb') as f:
+                sums = f.check('sha256', 0, 0, 4096)
+                assert sums == b''.join(
+                    hashlib.sha256(data[i:i + 4096]).digest()
+                    for i in range(0, len(data), 4096))
+                sums = f.check('sha512', 1000, 0, 300000)
+                assert sums == b''.join(
+                    hashlib.sha512(data[i:i + 300000]).digest()
+                    for i in range(1000, len(data), 300000))
+                assert f.check('sha1') == hashlib.sha1(data).digest()
+                # past EOF: only what's there is hashed
+                sums = f.check('md5', 900000, 200000, 65536)
+                assert sums == b''.join(
+                    hashlib.md5(data[i:i + 65536]).digest()
+                    for i in range(900000, len(data), 65536))
+                assert f.read(10) == data[:10]
+            # without MAX_WORKERS, all requests are processed in one thread
+            assert len(threads) == 1
+        finally:
+            client.remove(path)
+            client.close()
+
+    def test_check_background(self, sftp, sftp_server, monkeypatch):
+        """
+        verify that without MAX_WORKERS, check-file on a file descriptor
+        handle doesn't hold up the rest of the session, but does hold up
+        later requests on the same handle.
+        """
+        gate = threading.Event()
+        slow = threading.Event()
+        order = []  # 'stat', or the thread of each read
+        loop = []
+        pread = StubSFTPHandle._pread
+        stat = StubSFTPServer.stat
+
+        def gated_pread(self, fd, length, offset):
+            # only proceeds if the stat can be processed meanwhile
+            gate.wait(10)
+            if slow.is_set():
+                time.sleep(0.01)
+            order.append(threading.current_thread())
+            return pread(self, fd, length, offset)
+
+        def gated_stat(self, path):
+            gate.set()
+            order.append('stat')
+            loop.append(threading.current_thread())
+            return stat(self, path)
+
+        monkeypatch.setattr(StubSFTPServer, 'USE_FD', True)
+        monkeypatch.setattr(StubSFTPHandle, '_pread', gated_pread)
+        monkeypatch.setattr(StubSFTPServer, 'stat', gated_stat)
+        client = SFTP.from_transport(sftp_server, reader_thread=True)
+        path = sftp.FOLDER + '/background.bin'
+        data = os.urandom(100000)
+        sums = []
+        try:
+            with client.open(path, 'wb') as f:
+                f.write(data)
+            with client.open(path, 'rb') as f:
+                def check():
+                    sums.append(f.check('sha256', 0, 0, 4096))
+
+                thread = threading.Thread(target=check)
+                thread.start()
+                while not client._expecting:
+                    time.sleep(0.01)
+                client.stat(path)
+                thread.join(10)
+                assert order[0] == 'stat'
+                assert sums[0] == b''.join(
+                    hashlib.sha256(data[i:i + 4096]).digest()
+                    for i in range(0, len(data), 4096))
+
+                # a read sent meanwhile is only processed (by the request
+                # loop) once the check is done
+                del order[:]
+                slow.set()
+                thread = threading.Thread(target=check)
+                thread.start()
+                while not client._expecting:
+                    time.sleep(0.01)
+                assert f.read(10) == data[:10]
+                thread.join(10)
+                assert sums[1] == sums[0]
+                assert len(order) == 26
+                assert order[-1] is loop[0]
+                assert loop[0] not in order[:-1]
+        finally:
+            client.remove(path)
+            client.close()
+
+    def test_sync_put_get(self, sftp, monkeypatch):
+        """
+        verify that sync_put() and sync_get() only send the changed blocks,
+        and fall back to full transfers.
+        """
+        localdir = mkdtemp()
+        local = os.path.join(localdir, 'sync.bin')
+        remote = sftp.FOLDER + '/sync.bin'
+        data = bytearray(os.urandom(1000000))
+        progress = []
+
+        def callback(sent, total):
+            progress.append((sent, total))
+
+        def check(expected):
+            with open(local, 'rb') as f:
+                assert f.read() == expected
+            with sftp.open(remote, 'rb') as f:
+                assert f.read() == expected
+
+        try:
+            with open(local, 'wb') as f:
+                f.write(data)
+            # no remote file yet: everything is sent
+            sftp.sync_put(local, remote, 65536, callback)
+            assert progress[-1] == (1000000, 1000000)
+            check(data)
+
+            data[70000:70010] = b'x' * 10
+            data[500000] ^= 0xff
+            data += b'y' * 100
+            with open(local, 'wb') as f:
+                f.write(data)
+            del progress[:]
+            sftp.sync_put(local, remote, 65536, callback)
+            # two changed blocks, and the tail past the old end
+            assert progress[-1] == (65536 * 2 + 100, 65536 * 2 + 100)
+            check(data)
+
+            data = data[:300000]
+            with sftp.open(remote, 'wb') as f:
+                f.write(data)
+            del progress[:]
+            sftp.sync_get(remote, local, 65536, callback)
+            assert progress == []
+            check(data)
+
+            data[3] ^= 0xff
+            with sftp.open(remote, 'r+b') as f:
+                f.write(data[:4])
+            sftp.sync_get(remote, local, 65536, callback)
+            assert progress[-1] == (65536, 65536)
+            check(data)
+
+            # without "check-file", whole files are copied
+            monkeypatch.delitem(sftp._extensions, 'check-file')
+            data[200000] ^= 0xff
+            with open(local, 'wb') as f:
+                f.write(data)
+            del progress[:]
+            sftp.sync_put(local, remote, 65536, callback)
+            assert progress[-1] == (300000, 300000)
+            check(data)
+        finally:
+            sftp.remove(remote)
+            shutil.rmtree(localdir)
+
+    def test_copy(self, sftp, monkeypatch):
+        """
+        verify server-side copies with "copy-file" and "copy-data", and the
+        fallback through the client.
+        """
+        data = os.urandom(3000000)
+        src = sftp.FOLDER + '/copy-src.bin'
+        dst = sftp.FOLDER + '/copy-dst.bin'
+        try:
+            with sftp.open(src, 'wb') as f:
+                f.write(data)
+            sftp.copy(src, dst)
+            with sftp.open(dst, 'rb') as f:
+                assert f.read() == data
+            with pytest.raises(IOError):
+                sftp.copy(src, dst, overwrite=False)
+            with pytest.raises(IOError):
+                sftp.copy(src, src)
+
+            for use_fd in (False, True):
+                monkeypatch.setattr(StubSFTPServer, 'USE_FD', use_fd)
+                with sftp.open(src, 'rb') as fr:
+                    with sftp.open(dst, 'r+b') as fw:
+                        fw.write(b'hello')
+                        fr.copy_data(fw, 100, 1000, 2)
+                        fr.copy_data(fw, 2999000, 0, 5000)
+                        with pytest.raises(IOError):
+                            fw.copy_data(fw, 0, 100, 50)
+                with sftp.open(dst, 'rb') as f:
+                    assert f.read(6000) == b'he' + data[100:1100] + \
+                        data[1002:5000] + data[2999000:]
+                    assert sftp.stat(dst).st_size == 3000000
+
+            monkeypatch.delitem(sftp._extensions, 'copy-file')
+            sftp.remove(dst)
+            sftp.copy(src, dst)
+            with sftp.open(dst, 'rb') as f:
+                assert f.read() == data
+            monkeypatch.delitem(sftp._extensions, 'copy-data')
+            sftp.remove(dst)
+            sftp.copy(src, dst)
+            with sftp.open(dst, 'rb') as f:
+                assert f.read() == data
+        finally:
+            sftp.remove(src)
+            sftp.remove(dst)
+
+    def test_limits(self, sftp):
+        """
+        verify that larger read/write sizes are agreed on with our own server
+        via the "limits@openssh.com" extension.
+        """
+        assert sftp._max_read_size == SFTPServer.MAX_READ_LENGTH
+        assert sftp._max_write_size == SFTPServer.MAX_WRITE_LENGTH
+        data = os.urandom(300 * 1024)
+        try:
+            with sftp.open(sftp.FOLDER + '/big.bin', 'wb') as f:
+                assert f._write_size == SFTPServer.MAX_WRITE_LENGTH
+                f.write(data)
+            with sftp.open(sftp.FOLDER + '/big.bin', 'rb') as f:
+                chunk = f._read(len(data))
+                assert chunk == data[:SFTPServer.MAX_READ_LENGTH]
+                f.seek(len(chunk))
+                assert f.read() == data[len(chunk):]
+        finally:
+            sftp.remove(sftp.FOLDER + '/big.bin')
+
+    def test_server_workers(self, sftp, sftp_server, monkeypatch):
+        """
+        verify that the server can process requests concurrently, while
+        keeping those on the same handle in order.
+        """
+        gate = threading.Event()
+        order = []
+        stat = StubSFTPServer.stat
+
+        def gated_stat(self, path):
+            name = path.rsplit('/', 1)[-1]
+            if name == 'first':
+                # only proceeds if 'second' can be processed meanwhile
+                gate.wait(10)
+            elif name == 'second':
+                gate.set()
+            order.append(name)
+            return stat(self, path)
+
+        monkeypatch.setattr(StubSFTPServer, 'stat', gated_stat)
+        monkeypatch.setattr(SFTPServer, 'MAX_WORKERS', 4)
+        client = SFTP.from_transport(sftp_server)
+        names = [sftp.FOLDER + '/first', sftp.FOLDER + '/second']
+        data = os.urandom(1024 * 1024)
+        try:
+            for name in names:
+                client.open(name, 'w').close()
+            results = client.stat_many(names)
+            assert all(r.st_size == 0 for r in results)
+            assert order == ['second', 'first']
+
+            with client.open(names[0], 'wb') as f:
+                f.set_pipelined()
+                for i in range(0, len(data), 4096):
+                    f.write(data[i:i + 4096])
+            with client.open(names[0], 'rb') as f:
+                f.prefetch()
+                assert f.read() == data
+        finally:
+            client.remove_many(names)
+            client.close()
+
+    @pytest.mark.parametrize('workers', [0, 4])
+    def test_server_malformed_request(self, sftp, sftp_server, monkeypatch,
+                                      workers):
+        """
+        verify that the server answers a malformed request with an error,
+        rather than ending the session.
+        """
+        monkeypatch.setattr(SFTPServer, 'MAX_WORKERS', workers)
+        client = SFTP.from_transport(sftp_server)
+        try:
+            # an extended request name which isn't UTF-8
+            with pytest.raises(IOError):
+                client._request(CMD_EXTENDED, b'\xff\xfe')
+            assert client.listdir(sftp.FOLDER) == []
+        finally:
+            client.close()
+
+    def test_reader_thread(self, sftp, sftp_server, monkeypatch):
+        """
+        verify that with a reader thread, several threads can use one client
+        at once, each getting its own responses.
+        """
+        gate = threading.Event()
+        stat = StubSFTPServer.stat
+
+        def gated_stat(self, path):
+            if path.endswith('/first'):
+                gate.wait(10)
+            elif path.endswith('/second'):
+                gate.set()
+            return stat(self, path)
+
+        monkeypatch.setattr(StubSFTPServer, 'stat', gated_stat)
+        monkeypatch.setattr(SFTPServer, 'MAX_WORKERS', 4)
+        client = SFTP.from_transport(sftp_server, reader_thread=True)
+        names = [sftp.FOLDER + '/' + name
+                 for name in ('first', 'second', 'a', 'b', 'c', 'd')]
+        errors = []
+
+        def run(func, *args):
+            try:
+                func(*args)
+            except Exception as e:
+                errors.append(e)
+
+        def copy(name):
+            data = os.urandom(512 * 1024)
+            with client.open(name, 'wb') as f:
+                f.set_pipelined()
+                for i in range(0, len(data), 8192):
+                    f.write(data[i:i + 8192])
+            with client.open(name, 'rb') as f:
+                f.prefetch()
+                assert f.read() == data
+            assert len(client.listdir(sftp.FOLDER)) >= 3
+
+        try:
+            for name in names[:2]:
+                client.open(name, 'w').close()
+            threads = [threading.Thread(target=run, args=(client.stat, name))
+                       for name in names[:2]]
+            threads += [threading.Thread(target=run, args=(copy, name))
+                        for name in names[2:]]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+            assert errors == []
+            assert gate.is_set()
+        finally:
+            client.remove_many(names)
+            client.close()
+        client._reader.join(10)
+        with pytest.raises(SSHException):
+            client.stat(sftp.FOLDER)
+
+    def test_reader_thread_timeout(self, sftp, sftp_server, monkeypatch):
+        """
+        verify that a channel timeout while the reader thread is part way
+        through a response doesn't lose that part of it.
+        """
+        write_all = SFTPServer._write_all
+
+        def stalled_write_all(self, out):
+            if len(out) > 32768:
+                # time out the reader in the middle of the response
+                write_all(self, out[:1000])
+                time.sleep(0.3)
+                out = out[1000:]
+            write_all(self, out)
+
+        client = SFTP.from_transport(sftp_server, reader_thread=True)
+        data = os.urandom(65536)
+        path = sftp.FOLDER + '/timeout.bin'
+        try:
+            with client.open(path, 'wb') as f:
+                f.write(data)
+            monkeypatch.setattr(SFTPServer, '_write_all', stalled_write_all)
+            with client.open(path, 'rb') as f:
+                client.get_channel().settimeout(0.1)
+                with pytest.raises(socket.timeout):
+                    f.read(len(data))
+                client.get_channel().settimeout(None)
+                f.seek(0)
+                assert f.read(len(data)) == data
+            assert client.stat(path).st_size == len(data)
+        finally:
+            client.get_channel().settimeout(None)
+            monkeypatch.undo()
+            client.remove(path)
+            client.close()
+
+    def test_cache(self, sftp, sftp_server):
+        """
+        verify the metadata cache: repeated lookups are answered locally,
+        listings fill it, and changes made through the client invalidate it.
+        """
+        client = SFTP.from_transport(sftp_server)
+        cache = client.enable_cache(ttl=60)
+        folder = sftp.FOLDER + '/cached'
+        client.mkdir(folder)
+        try:
+            with client.open(folder + '/a.txt', 'w') as f:
+                f.write(b'hello')
+            assert client.listdir(folder) == ['a.txt']
+            misses = cache.misses
+            assert client.stat(folder + '/a.txt').st_size == 5
+            assert client.lstat(folder + '/a.txt').st_size == 5
+            assert client.listdir(folder) == ['a.txt']
+            assert cache.misses == misses
+            assert cache.hits == 3
+
+            # changes through other clients aren't seen...
+            sftp.truncate(folder + '/a.txt', 2)
+            assert client.stat(folder + '/a.txt').st_size == 5
+            # ...until they're invalidated...
+            cache.invalidate(folder + '/a.txt/')
+            assert client.stat(folder + '/a.txt').st_size == 2
+            # ...but changes through this one are
+            client.truncate(folder + '/a.txt', 1)
+            assert client.stat(folder + '/a.txt').st_size == 1
+            with client.open(folder + '/a.txt', 'a') as f:
+                f.write(b'xyz')
+                f.flush()
+                assert client.stat(folder + '/a.txt').st_size == 4
+            assert client.stat(folder + '/a.txt').st_size == 4
+            client.rename(folder + '/a.txt', folder + '/b.txt')
+            assert client.listdir(folder) == ['b.txt']
+            with pytest.raises(IOError):
+                client.stat(folder + '/a.txt')
+            client.put_many([(__file__, folder + '/c.py')])
+            assert client.stat(folder + '/c.py').st_size == \
+                os.stat(__file__).st_size
+            client.remove_many([folder + '/b.txt', folder + '/c.py'])
+            assert client.listdir(folder) == []
+
+            client.normalize(folder)
+            hits = cache.hits
+            assert client.normalize(folder) == client.normalize(folder)
+            assert cache.hits == hits + 2
+
+            # least recently used entries are dropped first
+            cache.max_entries = 2
+            client.stat(folder)
+            client.lstat(folder)
+            client.stat(folder)
+            client.normalize(folder)
+            hits = cache.hits
+            client.stat(folder)
+            assert cache.hits == hits + 1
+            client.lstat(folder)
+            assert cache.hits == hits + 1
+        finally:
+            client.rmdir(folder)
+            client.close()
+        with pytest.raises(IOError):
+            sftp.stat(folder)
+
+    @pytest.mark.skipif("PY2")
+    def test_async_client(self, sftp, sftp_server, monkeypatch):
+        """
+        verify the asyncio client: file reads and writes, many requests in
+        flight at once, listings, transfers and errors.
+        """
+        import asyncio
+        from paramiko import AsyncSFTPClient
+
+        loop = asyncio.new_event_loop()
+        run = loop.run_until_complete
+        client = run(AsyncSFTPClient.from_transport(sftp_server, loop=loop))
+        name = sftp.FOLDER + '/async.bin'
+        data = os.urandom(300 * 1024)
+        localdir = mkdtemp()
+        try:
+            f = run(client.open(name, 'wb'))
+            run(f.write(data))
+            run(f.close())
+            f = run(client.open(name, 'rb'))
+            assert run(f.read()) == data
+            f.seek(1000)
+            assert run(f.read(5000)) == data[1000:6000]
+            assert f.tell() == 6000
+            f.seek(len(data) - 10)
+            assert run(f.read(100)) == data[-10:]
+            run(f.close())
+
+            stats = [client.stat(name) for i in range(50)]
+            for attrs in run(asyncio.gather(*stats)):
+                assert attrs.st_size == len(data)
+            assert 'async.bin' in run(client.listdir(sftp.FOLDER))
+
+            local = os.path.join(localdir, 'async.bin')
+            run(client.get(name, local))
+            with open(local, 'rb') as fl:
+                assert fl.read() == data
+            attrs = run(client.put(local, name + '.2'))
+            assert attrs.st_size == len(data)
+            assert sftp.open(name + '.2', 'rb').read() == data
+
+            with pytest.raises(IOError) as info:
+                run(client.stat(sftp.FOLDER + '/missing'))
+            assert info.value.errno == errno.ENOENT
+            run(client.remove(name + '.2'))
+            # the error is only from the future
+            putting = client.put(local + '.missing', name + '.3')
+            with pytest.raises(IOError) as info:
+                run(putting)
+            assert info.value.errno == errno.ENOENT
+
+            # the folder is closed even if reading it goes wrong
+            closed = []
+            monkeypatch.setattr(
+                SFTPServer, '_read_folder',
+                lambda self, num, folder: self._send_status(num, SFTP_OK))
+            monkeypatch.setattr(
+                SFTPHandle, 'close', lambda self: closed.append(self))
+            with pytest.raises(SFTPError):
+                run(client.listdir(sftp.FOLDER))
+            assert len(closed) == 1
+            monkeypatch.undo()
+        finally:
+            shutil.rmtree(localdir)
+            sftp.remove(name)
+            client.close()
+            loop.close()
+
+    def test_fsync(self, sftp):
+        """
+        verify the "fsync@openssh.com" extension with file object handles.
+        """
+        try:
+            with sftp.open(sftp.FOLDER + '/sync.txt', 'w') as f:
+                f.set_pipelined()
+                f.write(ARTICLE)
+                f.fsync()
+                assert f.stat().st_size == 1483
+        finally:
+            sftp.remove(sftp.FOLDER + '/sync.txt')
+
+    def test_fd_handles(self, sftp, sftp_server, monkeypatch):
+        """
+        verify reading, writing, appending and syncing with handles which use
+        pread/pwrite on a raw file descriptor.
+        """
+        monkeypatch.setattr(StubSFTPServer, 'USE_FD', True)
+        monkeypatch.setattr(SFTPServer, 'MAX_WORKERS', 4)
+        client = SFTP.from_transport(sftp_server)
+        path = sftp.FOLDER + '/fd.bin'
+        data = os.urandom(1024 * 1024)
+        try:
+            with client.open(path, 'wb') as f:
+                f.set_pipelined()
+                for i in range(0, len(data), 4096):
+                    f.write(data[i:i + 4096])
+                f.fsync()
+                assert f.stat().st_size == len(data)
+            with client.open(path, 'ab') as f:
+                f.write(b'tail')
+            with client.open(path, 'r+b') as f:
+                f.seek(len(data) - 4)
+                f.write(b'abcd')
+            with client.open(path, 'rb') as f:
+                f.prefetch()
+                assert f.read() == data[:-4] + b'abcdtail'
+                f.seek(10)
+                assert f.read(10) == data[10:20]
+        finally:
+            client.remove(path)
+            client.close()
+
     def test_x_flag(self, sftp):
         """
         verify that the 'x' flag works when opening a file.
@@ -741,6 +1603,32 @@ class TestSFTP(object):
         sftp_attributes = SFTPAttributes()
         assert str(sftp_attributes) == "?---------   1 0        0               0 (unknown date) ?"
 
+    def test_sftp_attributes_extended(self):
+        """
+        verify that extended attributes are decoded when used, and passed
+        through unchanged otherwise; and that longname is decoded lazily.
+        """
+        attr = SFTPAttributes()
+        attr.st_size = 1234
+        attr.st_mode = o644
+        attr.attr[b'acl@example.com'] = b'rw'
+        msg = Message()
+        attr._pack(msg)
+        raw = msg.asbytes()
+
+        copy = SFTPAttributes._from_msg(
+            Message(raw), 'file.txt', u'caf\u00e9'.encode('utf-8'))
+        assert (copy.st_size, copy.st_mode) == (1234, o644)
+        assert copy.st_uid is None
+        msg = Message()
+        copy._pack(msg)
+        assert msg.asbytes() == raw
+        assert copy.attr == {b'acl@example.com': b'rw'}
+        assert copy.longname == u'caf\u00e9'
+        assert SFTPAttributes().longname == str(SFTPAttributes())
+        with pytest.raises(AttributeError):
+            copy.color = 'blue'
+
     @needs_builtin('buffer')
     def test_write_buffer(self, sftp):
         """Test write() using a buffer instance."""
@@ -23,12 +23,15 @@ a real actual sftp server is contacted, and a new folder is created there to
 do test file operations in (so no existing files will be harmed).
 """
 
+import os
 import random
 import struct
 import sys
 import time
+from tempfile import mkstemp
 
 from paramiko.common import o660
+from paramiko.sftp_server import SFTPServer
 
 from .util import slow
 
@@ -132,6 +135,187 @@ class TestBigSFTP(object):
         finally:
             sftp.remove('%s/hongry.txt' % sftp.FOLDER)
 
+    def test_prefetch_window(self, sftp):
+        """
+        verify that prefetch keeps only a bounded window of data in flight
+        and buffered, refilling it as the file is read.
+        """
+        kblob = bytes().join([struct.pack('>H', n) for n in range(512)])
+        try:
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'wb') as f:
+                f.set_pipelined(True)
+                for n in range(1024):
+                    f.write(kblob)
+
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'rb') as f:
+                f.prefetch(1024 * 1024, max_concurrent_requests=4)
+                window = 4 * f._read_size
+                assert len(f._prefetch_extents) == 4
+                n = 0
+                while n < 1024 * 1024:
+                    data = f.read(5000)
+                    assert data
+                    expected = (kblob * 7)[n % 1024:n % 1024 + len(data)]
+                    assert data == expected
+                    assert len(f._prefetch_extents) <= 4
+                    assert f._prefetch_inflight + f._prefetch_buffered <= window
+                    n += len(data)
+                assert f.read(5000) == b''
+                assert not f._prefetch_extents
+                assert not f._prefetching
+        finally:
+            sftp.remove('%s/hongry.txt' % sftp.FOLDER)
+
+    def test_prefetch_window_seek(self, sftp):
+        """
+        verify that seeking forward past the prefetch window drops what was
+        skipped, and prefetching carries on from the new position.
+        """
+        kblob = bytes().join([struct.pack('>H', n) for n in range(512)])
+        try:
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'wb') as f:
+                f.set_pipelined(True)
+                for n in range(1024):
+                    f.write(kblob)
+
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'rb') as f:
+                f.prefetch(1024 * 1024, max_concurrent_requests=4)
+                window = 4 * f._read_size
+                assert f.read(10) == kblob[:10]
+                f.seek(512 * 1024 + 6)
+                reads = []
+                request = f.sftp._request
+
+                def counting_request(t, *args):
+                    reads.append(t)
+                    return request(t, *args)
+
+                f.sftp._request = counting_request
+                try:
+                    n = 512 * 1024 + 6
+                    while n < 1024 * 1024:
+                        data = f.read(5000)
+                        assert data == (kblob * 7)[n % 1024:n % 1024 + len(data)]
+                        assert f._prefetch_inflight + f._prefetch_buffered <= window
+                        n += len(data)
+                finally:
+                    del f.sftp._request
+                # at most the first read after the seek wasn't prefetched
+                assert len(reads) <= 1
+                assert not f._prefetch_data
+                assert f._prefetch_buffered == 0
+        finally:
+            sftp.remove('%s/hongry.txt' % sftp.FOLDER)
+
+    def test_prefetch_partial_reads(self, sftp):
+        """
+        verify that what's left of a partly read chunk is counted as the
+        whole chunk in the prefetch window, until it's small enough to copy.
+        """
+        data = os.urandom(64 * 1024)
+        try:
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'wb') as f:
+                f.write(data)
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'rb') as f:
+                # the whole file comes back as one chunk
+                f.prefetch(len(data), max_concurrent_requests=1)
+                assert f.read(100) == data[:100]
+                assert f._prefetch_buffered == len(data)
+                assert f.read(len(data) - 5000) == data[100:-4900]
+                # 4900 bytes left: copied, and only they count
+                assert f._prefetch_buffered == 4900
+                assert f.read() == data[-4900:]
+        finally:
+            sftp.remove('%s/hongry.txt' % sftp.FOLDER)
+
+    def test_big_file_pipelined_window(self, sftp):
+        """
+        write a 1MB file pipelined, with a small window of writes in flight.
+        """
+        kblob = bytes().join([struct.pack('>H', n) for n in range(512)])
+        try:
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'wb') as f:
+                f.set_pipelined(True, max_concurrent_requests=4)
+                for n in range(1024):
+                    f.write(kblob)
+                    assert len(f._write_reqs) < 4
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'rb') as f:
+                assert f.read() == kblob * 1024
+        finally:
+            sftp.remove('%s/hongry.txt' % sftp.FOLDER)
+
+    def test_get_windowed(self, sftp):
+        """
+        verify that get() reassembles a file from a small window of reads,
+        including short reads and a file bigger than its stat'd size.
+        """
+        data = os.urandom(1024 * 1024 + 123)
+        fd, localname = mkstemp()
+        os.close(fd)
+        remotename = '%s/hongry.bin' % sftp.FOLDER
+        saved_progress = []
+        try:
+            with sftp.open(remotename, 'wb') as f:
+                f.write(data)
+
+            def progress(x, y):
+                saved_progress.append((x, y))
+            sftp.get(remotename, localname, progress,
+                     max_concurrent_prefetch_requests=3)
+            with open(localname, 'rb') as f:
+                assert f.read() == data
+            assert saved_progress[-1] == (len(data), len(data))
+
+            # the server now answers with less than the client asked for
+            limit = SFTPServer.MAX_READ_LENGTH
+            SFTPServer.MAX_READ_LENGTH = 10000
+            try:
+                sftp.get(remotename, localname)
+            finally:
+                SFTPServer.MAX_READ_LENGTH = limit
+            with open(localname, 'rb') as f:
+                assert f.read() == data
+
+            # the file turns out longer than expected
+            with open(localname, 'wb') as fl:
+                with sftp.open(remotename, 'rb') as fr:
+                    size = sftp._download(fr, fl.fileno(), 1000)
+            assert size == len(data)
+            with open(localname, 'rb') as f:
+                assert f.read() == data
+        finally:
+            os.unlink(localname)
+            sftp.remove(remotename)
+
+    def test_put_mapped(self, sftp):
+        """
+        verify that put() sends a file from a memory map, with a small window
+        of writes, and still handles empty files.
+        """
+        data = os.urandom(1024 * 1024 + 123)
+        fd, localname = mkstemp()
+        os.close(fd)
+        remotename = '%s/hongry.bin' % sftp.FOLDER
+        saved_progress = []
+        try:
+            with open(localname, 'wb') as f:
+                f.write(data)
+
+            def progress(x, y):
+                saved_progress.append((x, y))
+            attrs = sftp.put(localname, remotename, progress,
+                             max_concurrent_requests=3)
+            assert attrs.st_size == len(data)
+            assert saved_progress[-1] == (len(data), len(data))
+            with sftp.open(remotename, 'rb') as f:
+                assert f.read() == data
+
+            open(localname, 'wb').close()
+            assert sftp.put(localname, remotename).st_size == 0
+        finally:
+            os.unlink(localname)
+            sftp.remove(remotename)
+
     def test_prefetch_seek(self, sftp):
         kblob = bytes().join([struct.pack('>H', n) for n in range(512)])
         try:
@@ -273,6 +457,35 @@ class TestBigSFTP(object):
         finally:
             sftp.remove('%s/hongry.txt' % sftp.FOLDER)
 
+    def test_readv_unsorted(self, sftp):
+        """
+        verify that readv serves chunks out of order from what it prefetched,
+        without reading any of them again.
+        """
+        data = os.urandom(256 * 1024)
+        try:
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'wb') as f:
+                f.write(data)
+
+            with sftp.open('%s/hongry.txt' % sftp.FOLDER, 'rb') as f:
+                chunks = [(200000, 5000), (1000, 10), (0, 10), (100000, 40000)]
+                reads = []
+                request = f.sftp._request
+
+                def counting_request(t, *args):
+                    reads.append(t)
+                    return request(t, *args)
+
+                f.sftp._request = counting_request
+                try:
+                    for (offset, size), block in zip(chunks, f.readv(chunks)):
+                        assert block == data[offset:offset + size]
+                finally:
+                    del f.sftp._request
+                assert reads == []
+        finally:
+            sftp.remove('%s/hongry.txt' % sftp.FOLDER)
+
     def test_large_readv(self, sftp):
         """
         verify that a very large readv is broken up correctly and still
@@ -371,6 +371,37 @@ class TransportTest(unittest.TestCase):
         except ChannelException as e:
             self.assertTrue(e.code == OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED)
 
+    def test_open_channel_async(self):
+        """
+        verify that many channel opens can be in flight at once, and that
+        failures are reported through the future.
+        """
+        self.setup_test_server()
+        futures = [self.tc.open_session_async() for i in range(20)]
+        bogus = self.tc.open_channel_async('bogus')
+        chans = [f.result(5) for f in futures]
+        self.assertEqual(20, len(set(c.get_id() for c in chans)))
+        for chan in chans:
+            self.assertTrue(chan.active)
+            self.assertTrue(self.ts.accept(1.0) is not None)
+        try:
+            bogus.result(5)
+            self.fail('expected exception')
+        except ChannelException as e:
+            self.assertEqual(OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED, e.code)
+        # ...and only there, not left for open_channel() to find
+        self.assertTrue(self.tc.get_exception() is None)
+
+        for chan in chans:
+            chan.close()
+
+        # pending opens are resolved one way or the other on close, and not
+        # with an unrelated earlier failure
+        pending = self.tc.open_session_async()
+        self.tc.close()
+        self.assertTrue(pending.done())
+        self.assertFalse(isinstance(pending.exception(), ChannelException))
+
     def test_exit_status(self):
         """
         verify that get_exit_status() works.
@@ -455,6 +486,47 @@ class TransportTest(unittest.TestCase):
         # ...and now is closed.
         self.assertEqual(True, p._closed)
 
+    def test_select_channels(self):
+        """
+        verify that Transport.select_channels() reports channels with
+        stdout/stderr data or EOF, without using a pipe per channel.
+        """
+        self.setup_test_server()
+        chans = []
+        schans = []
+        for i in range(3):
+            chan = self.tc.open_session()
+            chan.invoke_shell()
+            chans.append(chan)
+            schans.append(self.ts.accept(1.0))
+
+        # nothing should be ready
+        self.assertEqual([], self.tc.select_channels(chans, 0.1))
+
+        schans[1].send('hello\n')
+        self.assertEqual([chans[1]], self.tc.select_channels(chans, 1.0))
+        # a channel not asked about is not reported
+        self.assertEqual([], self.tc.select_channels([chans[0]], 0.1))
+        self.assertEqual(b'hello\n', chans[1].recv(6))
+        self.assertEqual([], self.tc.select_channels(chans, 0.1))
+
+        schans[2].send_stderr('oops\n')
+        self.assertEqual([chans[2]], self.tc.select_channels(timeout=1.0))
+        self.assertEqual(b'oops\n', chans[2].recv_stderr(5))
+
+        # works together with fileno()
+        self.assertEqual([], select.select([chans[0]], [], [], 0.1)[0])
+        schans[0].close()
+        for i in range(10):
+            if chans[0] in select.select([chans[0]], [], [], 0.1)[0]:
+                break
+        self.assertEqual([chans[0]], self.tc.select_channels(chans, 1.0))
+        self.assertEqual(bytes(), chans[0].recv(16))
+
+        for chan in chans:
+            chan.close()
+        self.assertEqual([], self.tc.select_channels(chans, 0.1))
+
     def test_renegotiate(self):
         """
         verify that a transport can correctly renegotiate mid-stream.